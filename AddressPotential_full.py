@@ -1,12 +1,15 @@
 
 import requests
 import urllib.parse
-import csv
-import io
-import warnings
-import os
 from dotenv import load_dotenv
 
+import http_client
+from cirac_grid import describe_risk, get_cirac_level
+from geocode_cache import geocode_cache, normalize_address, coordinate_key
+from municipality_resolver import get_municipality_resolver
+from population_data import get_population
+from scoring import parse_population, score_one
+
 load_dotenv()
 
 def analyze_address():
@@ -18,9 +21,11 @@ def analyze_address():
 
     try:
         print("A obter coordenadas...")
-        geocode_response = requests.get(geocode_url, headers=headers)
-        geocode_response.raise_for_status()
-        results = geocode_response.json()
+        def search():
+            geocode_response = http_client.get(geocode_url, headers=headers)
+            geocode_response.raise_for_status()
+            return geocode_response.json()
+        results = geocode_cache.cached("search", normalize_address(address), search)
 
         if not results:
             print("Não foi possível encontrar as coordenadas para a morada indicada.")
@@ -32,10 +37,15 @@ def analyze_address():
 
         print("A determinar o concelho...")
         reverse_geocode_url = f"https://api.bigdatacloud.net/data/reverse-geocode-client?latitude={input_lat}&longitude={input_lon}&localityLanguage=pt"
-        reverse_response = requests.get(reverse_geocode_url)
-        reverse_response.raise_for_status()
-        location_data = reverse_response.json()
-        out_municipality = location_data.get('city')
+        def reverse():
+            reverse_response = http_client.get(reverse_geocode_url)
+            reverse_response.raise_for_status()
+            return reverse_response.json().get('city')
+        resolver = get_municipality_resolver()
+        out_municipality = resolver.resolve(float(input_lat), float(input_lon))[0] if resolver else None
+        if not out_municipality:
+            # BigDataCloud names can differ from Nominatim's, so they are cached separately
+            out_municipality = geocode_cache.cached("reverse_bigdatacloud", coordinate_key(input_lat, input_lon), reverse)
         
         if not out_municipality:
             print("Não foi possível encontrar o concelho para a morada indicada.")
@@ -43,44 +53,16 @@ def analyze_address():
 
         print("A recolher dados de população, risco e pontos de interesse...")
         
-        csv_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vR0A79pNYNO4YD-jhyZ4baNjHsGZCsAyTgVlZgaoSGdKN_ehlS5fUnwmESyknqyy-Wf9-30OnjdCR3I/pub?gid=0&single=true&output=csv"
-        csv_response = requests.get(csv_url)
-        csv_response.raise_for_status()
-        csv_text = csv_response.text
-        csv_file = io.StringIO(csv_text)
-        csv_reader = csv.reader(csv_file)
-        out_pop = None
-        for row in csv_reader:
-            if len(row) > 2 and row[1] == out_municipality:
-                out_pop = row[2]
-                break
-
-        warnings.filterwarnings('ignore', message='Unverified HTTPS request')
-        cirac_url = "https://segurmaps.apseguradores.pt/api/v2/extract?map_id=36"
-        cirac_headers = {
-            "Authorization": os.getenv("AUTHORIZATION"),
-            "content-type": "application/json",
-            "accept": "application/json"
-        }
-        cirac_json_data = {"type": "Point", "coordinates": [float(input_lon), float(input_lat)]}
-        
-        cirac_response = requests.post(cirac_url, headers=cirac_headers, json=cirac_json_data, verify=False)
-        cirac_response.raise_for_status()
-        cirac_data = cirac_response.json()
-
-        out_cirac_cod = None
-        try:
-            out_cirac_cod = cirac_data['geojson']['features'][0]['properties']['__extract__']['ridx']
-        except (KeyError, IndexError):
-            pass
+        out_pop = get_population(out_municipality)
 
-        risk_map = {1: "Risco muito baixo", 2: "Risco baixo", 3: "Risco moderado", 4: "Risco elevado", 5: "Risco muito elevado"}
-        out_cirac_desc = risk_map.get(out_cirac_cod, "desconhecido")
+        # The local CIRAC grid answers cached cells; the segurmaps API is asked only for the others
+        out_cirac_cod = get_cirac_level(float(input_lat), float(input_lon), use_api=True)
+        out_cirac_desc = describe_risk(out_cirac_cod)
 
         radius = 500
         overpass_url = "https://overpass-api.de/api/interpreter"
         overpass_query = f'''[out:json];(node["amenity"](around:{radius},{input_lat},{input_lon});way["amenity"](around:{radius},{input_lat},{input_lon});relation["amenity"](around:{radius},{input_lat},{input_lon}););out center;'''
-        poi_response = requests.post(overpass_url, data=overpass_query)
+        poi_response = http_client.post(overpass_url, data=overpass_query)
         poi_response.raise_for_status()
         poi_data = poi_response.json()
         points_of_interest = [el.get('tags', {}).get('name') for el in poi_data.get('elements', []) if el.get('tags', {}).get('name')]
@@ -89,31 +71,8 @@ def analyze_address():
         print("A calcular o potencial...")
         final_class = None
         if out_pop and out_poi_count > 0 and out_cirac_cod is not None:
-            numeric_population = int(out_pop.replace(",", ""))
-            resid_poi = numeric_population / out_poi_count
-            
-            POP_MIN, POP_MAX = 384, 545_796
-            CIRAC_MIN, CIRAC_MAX = 1.0, 5.0
-            RESID_POI_MIN, RESID_POI_MAX = 0.0, 2000.0
-
-            def min_max_scale(x, xmin, xmax):
-                if xmax == xmin: return 0.0
-                val = (x - xmin) / (xmax - xmin)
-                return max(0.0, min(1.0, val))
-
-            pop_norm = min_max_scale(numeric_population, POP_MIN, POP_MAX)
-            cirac_norm = min_max_scale(out_cirac_cod, CIRAC_MIN, CIRAC_MAX)
-            resid_norm = min_max_scale(resid_poi, RESID_POI_MIN, RESID_POI_MAX)
-
-            cirac_norm_inv = 1.0 - cirac_norm
-            resid_norm_inv = 1.0 - resid_norm
-
-            w_pop, w_cirac, w_poi = 0.4, 0.3, 0.3
-            final_score = (w_pop * pop_norm + w_cirac * cirac_norm_inv + w_poi * resid_norm_inv)
-
-            if final_score < 0.33: final_class = "BAIXO"
-            elif final_score < 0.66: final_class = "MÉDIO"
-            else: final_class = "ALTO"
+            # This script divides by the POI count itself and labels the lowest class BAIXO
+            final_score, final_class = score_one(parse_population(out_pop), out_cirac_cod, out_poi_count, poi_offset=0, labels=("BAIXO", "MÉDIO", "ALTO"))
 
         # --- This is where we add the new print statements for debugging ---
         print("\n--- DADOS INTERMÉDIOS ---")
@@ -0,0 +1,531 @@
+import argparse
+import csv
+import difflib
+import json
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import NamedTuple
+
+import numpy as np
+
+from poi_index import _bbox_center, _flatten_coordinates
+
+# --- Address Index Settings ---
+ADDRESS_INDEX_PATH = os.getenv("ADDRESS_INDEX_PATH", os.path.join("data", "address_index.npz"))
+# Local answers below this confidence are left to Nominatim
+ADDRESS_MIN_CONFIDENCE = float(os.getenv("ADDRESS_MIN_CONFIDENCE", 0.8))
+# Street names closer than this (difflib ratio) count as a misspelling of each other
+FUZZY_MIN_RATIO = 0.85
+# Fuzzy candidates share this many leading characters with the typed street
+FUZZY_PREFIX_CHARS = 2
+# Suggestions start after this many typed characters; each one reads at most SUGGEST_SCAN_LIMIT index entries
+SUGGEST_MIN_CHARS = 3
+SUGGEST_SCAN_LIMIT = 2000
+
+STREET_ABBREVIATIONS = {
+    "r": "rua", "av": "avenida", "avda": "avenida", "pc": "praca", "pca": "praca", "lg": "largo", "lgo": "largo",
+    "tv": "travessa", "trav": "travessa", "estr": "estrada", "est": "estrada", "al": "alameda", "bc": "beco",
+    "cc": "calcada", "calc": "calcada", "qta": "quinta", "urb": "urbanizacao", "pq": "parque", "bo": "bairro",
+    "dr": "doutor", "eng": "engenheiro", "prof": "professor", "sto": "santo", "sta": "santa", "s": "sao",
+}
+STOP_WORDS = {"de", "da", "do", "das", "dos", "d", "e", "n", "no", "num", "numero", "portugal"}
+# A CP7 code anywhere; a bare CP4 only at the start of a part and before the locality ('1100 Lisboa'),
+# so the house number in 'Rua Augusta 1100' is not read as a postcode
+POSTCODE_PATTERN = re.compile(r"\b(\d{4})(?:\s*-\s*)?(\d{3})\b|(?:^|(?<=,))\s*(\d{4})(?=\s+[^\W\d])")
+HOUSE_NUMBER_PATTERN = re.compile(r"^\d+[a-z]?$")
+
+# How sure a local answer is, by what matched
+CONFIDENCE_HOUSE_NUMBER = 1.0
+CONFIDENCE_NEAREST_NUMBER = 0.85
+# The nearest-number confidence falls linearly to zero as the stored number gets this far from the typed one
+NEAREST_NUMBER_MAX_GAP = 50
+CONFIDENCE_STREET = 0.75
+CONFIDENCE_POSTCODE = 0.6
+CONFIDENCE_POSTCODE_AREA = 0.4
+# Several streets with the same name and nothing in the query to choose between them
+AMBIGUOUS_STREET_FACTOR = 0.7
+# The typed locality or postcode belongs to another place than every street of that name
+CONTRADICTED_STREET_FACTOR = 0.5
+
+
+def normalize_words(text):
+    """'R. de São Bento' -> 'rua sao bento': no accents or punctuation, abbreviations spelt out, small words dropped."""
+    without_accents = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    tokens = re.sub(r"[^a-z0-9]+", " ", re.sub(r"(\d)\s*([a-z])\b", r"\1\2", without_accents)).split()
+    return " ".join(STREET_ABBREVIATIONS.get(token, token) for token in tokens if token not in STOP_WORDS)
+
+
+def normalize_house_number(number):
+    """'12 A' -> '12a'. Only the first number of a range like '12-14' is kept."""
+    match = re.match(r"\s*(\d+)\s*([a-zA-Z]?)\b", str(number or ""))
+    return (match.group(1).lstrip("0") + match.group(2).lower()) if match else ""
+
+
+def normalize_prefix(text):
+    """
+    normalize_words() for text still being typed: the last word may be cut short,
+    so it is only lower cased and stripped of accents, never expanded.
+    A last word that is a whole small word ('Av 24 de') is dropped, as the indexed names have it dropped too.
+    """
+    if not text or text[-1].isspace():
+        return normalize_words(text)
+    head, _, last = text.rpartition(" ")
+    last_word = re.sub(r"[^a-z0-9]", "", unicodedata.normalize("NFKD", last).encode("ascii", "ignore").decode("ascii").lower())
+    if last_word in STOP_WORDS:
+        last_word = ""
+    elif last_word not in STREET_ABBREVIATIONS:
+        last_word = normalize_words(last) or last_word
+    return " ".join(word for word in (normalize_words(head), last_word) if word)
+
+
+def format_postcode(code4, code3=None):
+    return f"{code4}-{code3}" if code3 else code4
+
+
+def normalize_postcode(text):
+    """'1100053' or '1100 - 053' -> '1100-053', '1100' stays a CP4 area. Anything else gives ''."""
+    match = re.fullmatch(r"\s*(\d{4})\s*-?\s*(\d{3})?\s*", str(text or ""))
+    return format_postcode(match.group(1), match.group(2)) if match else ""
+
+
+class ParsedAddress(NamedTuple):
+    street: str
+    number: str
+    postcode: str
+    locality: str
+
+
+def parse_address(address):
+    """Splits a typed address into normalized street, house number, postcode (CP4 or CP7) and locality."""
+    postcode = ""
+    match = POSTCODE_PATTERN.search(address)
+    if match:
+        postcode = format_postcode(match.group(1), match.group(2)) if match.group(1) else match.group(3)
+        address = address[:match.start()] + "," + address[match.end():]
+
+    street, number, others = "", "", []
+    for part in (normalize_words(part) for part in address.split(",")):
+        if not part:
+            continue
+        if HOUSE_NUMBER_PATTERN.match(part) and not number:
+            number = normalize_house_number(part)
+        elif not street:
+            tokens = part.split()
+            # 'Avenida 24 de Julho 100': a number at the end is the house number, one inside belongs to the name
+            if len(tokens) > 1 and HOUSE_NUMBER_PATTERN.match(tokens[-1]):
+                number = number or normalize_house_number(tokens.pop())
+            street = " ".join(tokens)
+        else:
+            others.append(part)
+    return ParsedAddress(street, number, postcode, others[-1] if others else "")
+
+
+class GeocodeMatch(NamedTuple):
+    lat: float
+    lon: float
+    confidence: float
+    display_name: str
+
+    def as_nominatim(self):
+        """The match in the shape of a Nominatim search result, so analysis code reads it the same way."""
+        return {"lat": str(self.lat), "lon": str(self.lon), "display_name": self.display_name, "confidence": self.confidence}
+
+
+def _encode(values):
+    return np.char.encode(np.array(values, dtype=np.str_), "utf-8") if len(values) else np.array([], dtype="S1")
+
+
+def _decode(value):
+    return bytes(value).decode("utf-8")
+
+
+def _same_locality(typed, stored):
+    """'lisboa' matches 'lisboa' and 'santa maria maior lisboa'; an unknown stored locality matches nothing."""
+    return bool(stored) and (f" {typed} " in f" {stored} " or f" {stored} " in f" {typed} ")
+
+
+def _number_value(number):
+    digits = re.match(r"\d+", number)
+    return int(digits.group()) if digits else -1
+
+
+# --- Address Index ---
+class AddressIndex:
+    """
+    Addresses from an OSM extract, plus postal code centroids, as sorted arrays of byte strings.
+    Streets are sorted by (name, locality), and the house numbers of each street are one contiguous slice,
+    so a lookup is a few binary searches with no network call.
+    """
+
+    ARRAYS = (
+        "street_names", "street_localities", "street_labels", "street_lats", "street_lons", "address_starts",
+        "address_numbers", "address_postcodes", "address_lats", "address_lons", "postcode_keys", "postcode_lats", "postcode_lons",
+    )
+
+    def __init__(self, street_names, street_localities, street_labels, street_lats, street_lons, address_starts,
+                 address_numbers, address_postcodes, address_lats, address_lons, postcode_keys, postcode_lats, postcode_lons,
+                 suggest_keys=None, suggest_streets=None):
+        self.street_names = street_names
+        self.street_localities = street_localities
+        self.street_labels = street_labels
+        self.street_lats = street_lats
+        self.street_lons = street_lons
+        self.address_starts = address_starts
+        self.address_numbers = address_numbers
+        self.address_postcodes = address_postcodes
+        self.address_lats = address_lats
+        self.address_lons = address_lons
+        self.postcode_keys = postcode_keys
+        self.postcode_lats = postcode_lats
+        self.postcode_lons = postcode_lons
+        # Every street name from its second word on ('augusta' for 'rua augusta'), sorted, so typing any word finds it.
+        # Saved with the index; indexes built before it existed get it computed when loaded
+        if suggest_keys is None:
+            suggest_keys, suggest_streets = self._word_suffixes()
+        self.suggest_keys = suggest_keys
+        self.suggest_streets = suggest_streets
+
+    def _word_suffixes(self):
+        pairs = sorted(
+            (" ".join(words[start:]), street)
+            for street, words in enumerate(_decode(name).split() for name in self.street_names)
+            for start in range(1, len(words))
+        )
+        return _encode([key for key, street in pairs]), np.array([street for key, street in pairs], dtype=np.int32)
+
+    @classmethod
+    def from_addresses(cls, addresses, postcodes=()):
+        """
+        Builds the index from (street, house number, postcode, locality, lat, lon) tuples, where the house number
+        may be empty for a point on the street itself, and (postcode, lat, lon) centroids. Postcodes without a
+        centroid get the mean of their addresses.
+        """
+        streets = defaultdict(lambda: {"label": None, "points": [], "numbers": {}})
+        postcode_points = defaultdict(list)
+        for street, number, postcode, locality, lat, lon in addresses:
+            key = (normalize_words(street), normalize_words(locality))
+            if not key[0] or lat is None or lon is None:
+                continue
+            entry = streets[key]
+            entry["label"] = entry["label"] or (f"{street}, {locality}" if locality else street)
+            entry["points"].append((lat, lon))
+            postcode = normalize_postcode(postcode)
+            number = normalize_house_number(number)
+            if number:
+                entry["numbers"].setdefault(number, (postcode or "", lat, lon))
+            if postcode:
+                postcode_points[postcode].append((lat, lon))
+
+        centroids = {postcode: (lat, lon) for postcode, lat, lon in postcodes}
+        for postcode, points in postcode_points.items():
+            if postcode not in centroids:
+                centroids[postcode] = tuple(np.mean(points, axis=0))
+        # Each CP4 area is answered with the mean of its CP7 centroids
+        areas = defaultdict(list)
+        for postcode, point in centroids.items():
+            areas[postcode[:4]].append(point)
+        for area, points in areas.items():
+            centroids.setdefault(area, tuple(np.mean(points, axis=0)))
+
+        keys = sorted(streets)
+        starts, numbers, number_postcodes, number_lats, number_lons = [0], [], [], [], []
+        for key in keys:
+            for number, (postcode, lat, lon) in sorted(streets[key]["numbers"].items()):
+                numbers.append(number)
+                number_postcodes.append(postcode)
+                number_lats.append(lat)
+                number_lons.append(lon)
+            starts.append(len(numbers))
+        street_points = [np.mean(streets[key]["points"], axis=0) for key in keys]
+        postcode_keys = sorted(centroids)
+
+        return cls(
+            _encode([name for name, locality in keys]), _encode([locality for name, locality in keys]),
+            _encode([streets[key]["label"] for key in keys]),
+            np.array([point[0] for point in street_points], dtype=np.float64), np.array([point[1] for point in street_points], dtype=np.float64),
+            np.array(starts, dtype=np.int64), _encode(numbers), _encode(number_postcodes),
+            np.array(number_lats, dtype=np.float64), np.array(number_lons, dtype=np.float64),
+            _encode(postcode_keys), np.array([centroids[key][0] for key in postcode_keys], dtype=np.float64),
+            np.array([centroids[key][1] for key in postcode_keys], dtype=np.float64),
+        )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, suggest_keys=self.suggest_keys, suggest_streets=self.suggest_streets,
+                            **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            suggestions = (data["suggest_keys"], data["suggest_streets"]) if "suggest_keys" in data else (None, None)
+            return cls(*(data[name] for name in cls.ARRAYS), *suggestions)
+
+    @property
+    def street_count(self):
+        return len(self.street_names)
+
+    def _street_range(self, name):
+        encoded = name.encode("utf-8")
+        return int(np.searchsorted(self.street_names, encoded, "left")), int(np.searchsorted(self.street_names, encoded, "right"))
+
+    def find_streets(self, name):
+        """
+        Positions of the streets called name, and how close the name matched (1.0 when exact).
+        A misspelt name falls back to the closest name starting with the same letters.
+        """
+        start, end = self._street_range(name)
+        if end > start:
+            return list(range(start, end)), 1.0
+
+        prefix = name[:FUZZY_PREFIX_CHARS].encode("utf-8")
+        first = int(np.searchsorted(self.street_names, prefix, "left"))
+        last = int(np.searchsorted(self.street_names, prefix + b"\xff", "left"))
+        candidates = sorted({_decode(value) for value in self.street_names[first:last]})
+        close = difflib.get_close_matches(name, candidates, n=1, cutoff=FUZZY_MIN_RATIO)
+        if not close:
+            return [], 0.0
+        start, end = self._street_range(close[0])
+        return list(range(start, end)), difflib.SequenceMatcher(None, name, close[0]).ratio()
+
+    def _postcode_areas(self, street):
+        postcodes = self.address_postcodes[self.address_starts[street]:self.address_starts[street + 1]]
+        return {postcode[:4] for postcode in postcodes if postcode}
+
+    def _pick_street(self, streets, parsed):
+        """
+        The street that best fits the locality and postcode typed, and a factor for how sure that choice is:
+        lower when several streets fit equally well, or when the typed locality or postcode contradicts them.
+        A street with no stored locality or postcodes neither confirms nor contradicts what was typed.
+        """
+        factor = 1.0
+        if parsed.locality:
+            matching = [street for street in streets if _same_locality(parsed.locality, _decode(self.street_localities[street]))]
+            if matching:
+                streets = matching
+            elif all(self.street_localities[street] for street in streets):
+                factor *= CONTRADICTED_STREET_FACTOR
+        if parsed.postcode:
+            # Postcodes are compared by CP4 area, since a street often spans several CP7 codes
+            wanted_area = parsed.postcode[:4].encode("utf-8")
+            areas = {street: self._postcode_areas(street) for street in streets}
+            matching = [street for street in streets if wanted_area in areas[street]]
+            if matching:
+                streets = matching
+            elif any(areas.values()):
+                factor *= CONTRADICTED_STREET_FACTOR
+        if len(streets) > 1:
+            factor *= AMBIGUOUS_STREET_FACTOR
+        return streets[0], factor
+
+    def _postcode_match(self, postcode):
+        for key, confidence in ((postcode, CONFIDENCE_POSTCODE if len(postcode) > 4 else CONFIDENCE_POSTCODE_AREA), (postcode[:4], CONFIDENCE_POSTCODE_AREA)):
+            position = int(np.searchsorted(self.postcode_keys, key.encode("utf-8")))
+            if position < len(self.postcode_keys) and _decode(self.postcode_keys[position]) == key:
+                return GeocodeMatch(float(self.postcode_lats[position]), float(self.postcode_lons[position]), confidence, key)
+        return None
+
+    def geocode(self, address):
+        """The best local GeocodeMatch for a typed address, or None when nothing in the index fits."""
+        parsed = parse_address(address)
+        streets, name_ratio = self.find_streets(parsed.street) if parsed.street else ([], 0.0)
+        if not streets:
+            return self._postcode_match(parsed.postcode) if parsed.postcode else None
+
+        street, pick_factor = self._pick_street(streets, parsed)
+        label = _decode(self.street_labels[street])
+        confidence_factor = name_ratio * pick_factor
+        start, end = int(self.address_starts[street]), int(self.address_starts[street + 1])
+
+        if parsed.number and end > start:
+            numbers = self.address_numbers[start:end]
+            position = start + int(np.searchsorted(numbers, parsed.number.encode("utf-8")))
+            if position < end and _decode(self.address_numbers[position]) == parsed.number:
+                return GeocodeMatch(float(self.address_lats[position]), float(self.address_lons[position]),
+                                    CONFIDENCE_HOUSE_NUMBER * confidence_factor, f"{parsed.number}, {label}")
+            # The closest number on the same side of the street, or on either side when that side has none
+            wanted = _number_value(parsed.number)
+            values = np.array([_number_value(_decode(number)) for number in numbers])
+            same_side = values % 2 == wanted % 2
+            candidates = np.flatnonzero(same_side) if same_side.any() else np.arange(len(values))
+            gaps = np.abs(values[candidates] - wanted)
+            nearest = start + int(candidates[np.argmin(gaps)])
+            gap_factor = max(0.0, 1.0 - float(gaps.min()) / NEAREST_NUMBER_MAX_GAP)
+            return GeocodeMatch(float(self.address_lats[nearest]), float(self.address_lons[nearest]),
+                                CONFIDENCE_NEAREST_NUMBER * gap_factor * confidence_factor, f"{_decode(self.address_numbers[nearest])}, {label}")
+
+        return GeocodeMatch(float(self.street_lats[street]), float(self.street_lons[street]), CONFIDENCE_STREET * confidence_factor, label)
+
+
+    def _prefix_range(self, keys, prefix):
+        encoded = prefix.encode("utf-8")
+        return int(np.searchsorted(keys, encoded, "left")), int(np.searchsorted(keys, encoded + b"\xff", "left"))
+
+    def _streets_starting_with(self, prefix, locality, limit):
+        streets = []
+        for keys, street_of in ((self.street_names, None), (self.suggest_keys, self.suggest_streets)):
+            start, end = self._prefix_range(keys, prefix)
+            for position in range(start, min(end, start + SUGGEST_SCAN_LIMIT)):
+                street = position if street_of is None else int(street_of[position])
+                if street in streets or (locality and not _decode(self.street_localities[street]).startswith(locality)):
+                    continue
+                streets.append(street)
+                if len(streets) == limit:
+                    return streets
+        return streets
+
+    def suggest(self, text, limit=5):
+        """
+        Up to limit complete addresses ('Rua Augusta 100, Lisboa') for what has been typed so far.
+        Streets whose name starts with the text come first, then streets with a later word starting with it.
+        Text after a comma narrows the locality, and a house number typed after the street is kept.
+        """
+        street_text, _, locality_text = text.partition(",")
+        prefix, locality = normalize_prefix(street_text), normalize_prefix(locality_text)
+        if len(prefix) < SUGGEST_MIN_CHARS:
+            return []
+
+        number = ""
+        streets = self._streets_starting_with(prefix, locality, limit)
+        tokens = street_text.split()
+        # 'Av. 24' is the start of 'Avenida 24 de Julho'; only when no name goes on does a last number become the house number
+        if not streets and len(tokens) > 1 and HOUSE_NUMBER_PATTERN.match(tokens[-1].lower()):
+            number = normalize_house_number(tokens[-1])
+            streets = self._streets_starting_with(normalize_words(" ".join(tokens[:-1])), locality, limit)
+
+        suggestions = []
+        for street in streets:
+            name, _, place = _decode(self.street_labels[street]).partition(", ")
+            name = f"{name} {number}" if number else name
+            suggestions.append(f"{name}, {place}" if place else name)
+        return suggestions
+
+
+_loaded_index = None
+_load_lock = threading.Lock()
+
+
+def get_address_index(path=ADDRESS_INDEX_PATH):
+    """Returns the local address index, or None when no index file has been built."""
+    global _loaded_index
+    if _loaded_index is None and path and os.path.exists(path):
+        with _load_lock:
+            if _loaded_index is None:
+                _loaded_index = AddressIndex.load(path)
+    return _loaded_index
+
+
+def geocode_locally(address, min_confidence=ADDRESS_MIN_CONFIDENCE):
+    """The local match for the address when an index exists and the match is at least min_confidence sure, else None."""
+    index = get_address_index()
+    if index is None:
+        return None
+    match = index.geocode(address)
+    return match if match is not None and match.confidence >= min_confidence else None
+
+
+# --- Reading OSM Extracts ---
+def _address_tags(tags):
+    """(street, house number, postcode, locality) from OSM tags; addr:place stands in for the street in villages."""
+    street = tags.get("addr:street") or tags.get("addr:place")
+    locality = tags.get("addr:city") or tags.get("addr:municipality") or tags.get("addr:suburb") or ""
+    return street, tags.get("addr:housenumber") or "", tags.get("addr:postcode") or "", locality
+
+
+def read_pbf_addresses(pbf_path):
+    """Yields (street, house number, postcode, locality, lat, lon) for every address and named street in an .osm.pbf file."""
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Para ler ficheiros .osm.pbf instale o pacote 'osmium' (pip install osmium).")
+
+    addresses = []
+
+    class AddressHandler(osmium.SimpleHandler):
+        def node(self, n):
+            street, number, postcode, locality = _address_tags(n.tags)
+            if street and (number or postcode):
+                addresses.append((street, number, postcode, locality, n.location.lat, n.location.lon))
+
+        def way(self, w):
+            points = [(node.location.lon, node.location.lat) for node in w.nodes if node.location.valid()]
+            if not points:
+                return
+            street, number, postcode, locality = _address_tags(w.tags)
+            if street and (number or postcode):
+                addresses.append((street, number, postcode, locality, *_bbox_center(points)))
+            elif "highway" in w.tags and "name" in w.tags:
+                # Streets without address points can still be found, at their centre
+                addresses.append((w.tags["name"], "", "", "", *_bbox_center(points)))
+
+    AddressHandler().apply_file(pbf_path, locations=True)
+    return addresses
+
+
+def read_geojson_addresses(geojson_path):
+    """Yields (street, house number, postcode, locality, lat, lon) for every feature with address tags in a GeoJSON export."""
+    with open(geojson_path, encoding="utf-8") as geojson_file:
+        features = json.load(geojson_file).get("features", [])
+    for feature in features:
+        properties = feature.get("properties") or {}
+        tags = properties.get("tags") if isinstance(properties.get("tags"), dict) else properties
+        geometry = feature.get("geometry") or {}
+        street, number, postcode, locality = _address_tags(tags)
+        if not street or not geometry.get("coordinates"):
+            continue
+        if geometry.get("type") == "Point":
+            lon, lat = geometry["coordinates"][:2]
+        else:
+            lat, lon = _bbox_center(_flatten_coordinates(geometry["coordinates"]))
+        yield street, number, postcode, locality, lat, lon
+
+
+def read_postcode_centroids(csv_path):
+    """Yields (postcode, lat, lon) from a CSV of CTT postal codes with latitude and longitude columns."""
+    with open(csv_path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.DictReader(csv_file)
+        columns = {name.lower(): name for name in reader.fieldnames or []}
+        postcode_column = next((columns[name] for name in ("cp", "postcode", "codigo_postal", "código_postal", "cp7") if name in columns), None)
+        lat_column = next((columns[name] for name in ("lat", "latitude") if name in columns), None)
+        lon_column = next((columns[name] for name in ("lon", "lng", "longitude") if name in columns), None)
+        if not (postcode_column and lat_column and lon_column):
+            raise ValueError(f"O ficheiro {csv_path} precisa das colunas código postal, latitude e longitude.")
+        for row in reader:
+            postcode = normalize_postcode(row[postcode_column])
+            if postcode and row[lat_column] and row[lon_column]:
+                yield postcode, float(row[lat_column]), float(row[lon_column])
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Geocodificador local a partir de moradas OSM e códigos postais CTT.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Cria o índice a partir de um ficheiro .osm.pbf ou .geojson.")
+    build_parser.add_argument("source")
+    build_parser.add_argument("--postcodes", help="CSV com os centróides dos códigos postais CTT.")
+    build_parser.add_argument("--output", default=ADDRESS_INDEX_PATH)
+    lookup_parser = commands.add_parser("lookup", help="Geocodifica uma morada com o índice local.")
+    lookup_parser.add_argument("address")
+    lookup_parser.add_argument("--index", default=ADDRESS_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        addresses = read_pbf_addresses(args.source) if args.source.endswith(".pbf") else read_geojson_addresses(args.source)
+        postcodes = read_postcode_centroids(args.postcodes) if args.postcodes else ()
+        index = AddressIndex.from_addresses(addresses, postcodes)
+        index.save(args.output)
+        print(f"Índice criado em {args.output} com {index.street_count} ruas e {len(index.address_numbers)} números de porta.")
+    elif args.command == "lookup":
+        match = AddressIndex.load(args.index).geocode(args.address)
+        if match is None:
+            print("Morada não encontrada no índice local.")
+        else:
+            print(f"{match.display_name}: {match.lat:.6f}, {match.lon:.6f} (confiança {match.confidence:.2f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
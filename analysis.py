@@ -0,0 +1,217 @@
+import os
+import requests
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import http_client
+import metrics
+from address_index import geocode_locally
+from analysis_result import NO_POIS, AnalysisResult, format_population
+from cirac_grid import describe_risk, get_cirac_level
+from geocode_cache import geocode_cache, normalize_address, coordinate_key
+from municipality_resolver import get_municipality_resolver
+from poi_index import format_category, get_poi_index, poi_columns_around
+from poi_tiles import fetch_overpass_pois, get_poi_tile_cache
+from population_data import get_population
+from scoring import parse_population, score_one
+from single_flight import SingleFlight
+
+# --- Upstream Services ---
+HEADERS = {'User-Agent': 'MyStreamlitApp/1.0'}
+NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+# POIs within this many metres are scored and drawn on the map
+POI_RADIUS = int(os.getenv("POI_RADIUS", 500))
+# Extra rings of the POI density profile, e.g. "250,1000,2000". The POIs are fetched once, at the largest ring,
+# and every ring is counted from them, so wider rings mean larger Overpass queries and cached results; none by default
+POI_PROFILE_RADII = tuple(sorted({int(radius) for radius in os.getenv("POI_PROFILE_RADII", "").split(",") if radius.strip()} | {POI_RADIUS}))
+POI_FETCH_RADIUS = POI_PROFILE_RADII[-1]
+# Largest distance between a point and its coordinate_key cell centre (4 decimal places), with some slack
+CELL_MARGIN_METERS = 10
+DEFAULT_CIRAC_LEVEL = 3
+
+# Shared threads for the lookups that run in parallel once the coordinates are known
+fan_out_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="analysis")
+# Concurrent POI lookups in the same coordinate cell share one Overpass request
+overpass_queries = SingleFlight()
+
+
+# --- Data Sources ---
+@metrics.timed("geocode")
+def fetch_coordinates(address):
+    # A confident match in the local address index answers at once; Nominatim is only asked for the rest
+    local_match = geocode_locally(address)
+    if local_match is not None:
+        metrics.record_cache(True)
+        return [local_match.as_nominatim()]
+
+    def search():
+        safe_address = urllib.parse.quote(address)
+        geocode_url = f"{NOMINATIM_URL}/search?q={safe_address}&format=json"
+        geocode_response = http_client.get(geocode_url, headers=HEADERS)
+        geocode_response.raise_for_status()
+        return geocode_response.json()
+
+    return geocode_cache.cached("search", normalize_address(address), search)
+
+
+@metrics.timed("reverse_geocode")
+def fetch_municipality(lat, lon):
+    # The official CAOP boundaries give names that match the population sheet, with no network call
+    resolver = get_municipality_resolver()
+    if resolver is not None:
+        municipality, code = resolver.resolve(lat, lon)
+        if municipality:
+            return municipality
+
+    def reverse():
+        # Use Nominatim for reverse geocoding
+        reverse_geocode_url = f"{NOMINATIM_URL}/reverse?format=json&lat={lat}&lon={lon}&accept-language=pt"
+        reverse_response = http_client.get(reverse_geocode_url, headers=HEADERS)
+        reverse_response.raise_for_status()
+        location_data = reverse_response.json()
+
+        address_details = location_data.get('address', {})
+        return address_details.get('county') or address_details.get('city') or address_details.get('town') or address_details.get('village')
+
+    return geocode_cache.cached("reverse", coordinate_key(lat, lon), reverse)
+
+
+@metrics.timed("cirac")
+def fetch_cirac(lat, lon):
+    try:
+        out_cirac_cod = get_cirac_level(lat, lon)
+    except requests.exceptions.RequestException:
+        out_cirac_cod = None
+    if out_cirac_cod is None:
+        # Without a cached or live value a moderate risk is assumed, as before the grid existed
+        out_cirac_cod = DEFAULT_CIRAC_LEVEL
+    return out_cirac_cod, describe_risk(out_cirac_cod)
+
+
+@metrics.timed("poi")
+def fetch_pois(lat, lon, radius=POI_FETCH_RADIUS):
+    # A local index built with poi_index.py answers without calling Overpass
+    poi_index = get_poi_index()
+    if poi_index is not None:
+        return poi_index.query(lat, lon, radius)
+
+    # Otherwise the tile cache only asks Overpass for the tiles no earlier analysis has covered
+    tile_cache = get_poi_tile_cache()
+    if tile_cache is not None:
+        return tile_cache.query(lat, lon, radius)
+
+    # The query is centred on the coordinate cell and widened by the rounding, so every caller in the
+    # cell can share it and still gets all the POIs within radius of its own point
+    cell_lat, cell_lon = (float(value) for value in coordinate_key(lat, lon).split(","))
+    query_radius = radius + CELL_MARGIN_METERS
+    found = overpass_queries.run(
+        (cell_lat, cell_lon, query_radius), lambda: fetch_overpass_pois(f"around:{query_radius},{cell_lat},{cell_lon}"),
+    )
+
+    # Distances are measured from the element centres, the same points the local index stores
+    pois = [(name, format_category(amenity), poi_lat, poi_lon) for name, amenity, poi_lat, poi_lon in found]
+    return poi_columns_around(lat, lon, pois).within(radius)
+
+
+# --- Core Logic Function ---
+def get_analysis_for_address(address, trace=None, on_progress=None):
+    """
+    Runs the whole analysis for one address and returns an AnalysisResult.
+    When a metrics.AnalysisTrace is given, the time of every stage is recorded in it.
+    on_progress(stage, values) is called on the caller's thread as each piece of data arrives:
+    "coordinates" (lat, lon), "municipality", "population", "cirac" (cirac_desc) and "pois"
+    (pois within POI_RADIUS, poi_categories, poi_count), so a page can show them before the analysis ends.
+    """
+    with metrics.tracing(trace or metrics.AnalysisTrace(address)):
+        return _analyse(address, on_progress or _ignore_progress)
+
+
+def _ignore_progress(stage, values):
+    pass
+
+
+def _analyse(address, on_progress):
+    try:
+        results = fetch_coordinates(address)
+    except requests.exceptions.RequestException as e:
+        return AnalysisResult(address, f"Erro de rede ao contactar o serviço de geocodificação: {e}")
+
+    if not results:
+        return AnalysisResult(address, "Não foi possível encontrar as coordenadas para a morada indicada.")
+
+    first_result = results[0]
+    input_lat_str = first_result.get('lat')
+    input_lon_str = first_result.get('lon')
+
+    if not input_lat_str or not input_lon_str:
+        return AnalysisResult(address, "O serviço de geocodificação não retornou uma latitude ou longitude para esta morada.")
+
+    try:
+        input_lat = float(input_lat_str)
+        input_lon = float(input_lon_str)
+    except (ValueError, TypeError):
+        return AnalysisResult(address, f"Não foi possível converter latitude '{input_lat_str}' ou longitude '{input_lon_str}' para um número.")
+
+    on_progress("coordinates", {"lat": input_lat, "lon": input_lon})
+
+    # The reverse geocode, CIRAC and POI lookups only need the coordinates, so they all start now.
+    # Each runs in a copy of this context, so its timings land in the same trace.
+    municipality_future = fan_out_pool.submit(copy_context().run, fetch_municipality, input_lat, input_lon)
+    cirac_future = fan_out_pool.submit(copy_context().run, fetch_cirac, input_lat, input_lon)
+    poi_future = fan_out_pool.submit(copy_context().run, fetch_pois, input_lat, input_lon)
+
+    try:
+        out_municipality = municipality_future.result()
+    except requests.exceptions.RequestException as e:
+        return AnalysisResult(address, f"Erro de rede ao contactar o serviço de geocodificação inversa: {e}", lat=input_lat, lon=input_lon)
+
+    if not out_municipality:
+        return AnalysisResult(address, "Não foi possível encontrar o concelho para a morada indicada.", lat=input_lat, lon=input_lon)
+    on_progress("municipality", {"municipality": out_municipality})
+
+    pois = NO_POIS
+    population = None
+    out_poi_count = None
+    poi_categories = None
+    errors = []
+
+    try:
+        with metrics.stage("population"):
+            population = parse_population(get_population(out_municipality))
+        on_progress("population", {"population": population})
+    except requests.exceptions.RequestException as e:
+        errors.append(e)
+
+    out_cirac_cod, out_cirac_desc = cirac_future.result()
+    on_progress("cirac", {"cirac_desc": out_cirac_desc})
+
+    try:
+        pois = poi_future.result()
+        scored_pois = pois.within(POI_RADIUS)
+        out_poi_count = scored_pois.count
+        poi_categories = scored_pois.category_counts()
+        on_progress("pois", {"pois": scored_pois, "poi_categories": poi_categories, "poi_count": out_poi_count})
+    except requests.exceptions.RequestException as e:
+        errors.append(e)
+
+    partial_result = AnalysisResult(
+        address, "", lat=input_lat, lon=input_lon, municipality=out_municipality, population=population,
+        cirac_level=out_cirac_cod, cirac_desc=out_cirac_desc, poi_radius=POI_RADIUS, poi_count=out_poi_count, poi_categories=poi_categories, pois=pois,
+    )
+    if errors:
+        # Keep whatever the other sources returned, so the caller still gets the partial data
+        return partial_result._replace(message=f"Erro de rede ao obter dados (população ou POIs): {errors[0]}")
+
+    final_score, final_class = None, None
+    if population is not None:
+        with metrics.stage("scoring"):
+            final_score, final_class = score_one(population, out_cirac_cod, out_poi_count, poi_radius=POI_RADIUS)
+
+    if final_class and out_cirac_desc:
+        message = f'''<p>A morada analizada localiza-se no concelho ({out_municipality}) onde residem {format_population(population)} pessoas.</p>
+<p>Apresenta um {out_cirac_desc} de inundação (CIRAC 2.0) e, num raio de {POI_RADIUS}m, existem {out_poi_count} POIs.</p>'''
+    else:
+        message = "Não foi possível concluir a análise. Um ou mais dados (população, POIs) não foram encontrados para este local."
+
+    return partial_result._replace(message=message, final_class=final_class, score=final_score)
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from analysis import get_analysis_for_address
+from geocode_cache import normalize_address
+
+# --- Job Queue Settings ---
+JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", 8))
+# Finished jobs are kept this long, so the sessions waiting for them can still read the result
+JOB_KEEP_SECONDS = int(os.getenv("ANALYSIS_JOB_KEEP_SECONDS", 600))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class AnalysisJob:
+    """One analysis running in the background. progress holds the values reported so far."""
+
+    def __init__(self, key, address):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.address = address
+        self.status = QUEUED
+        self.progress = {}
+        self.trace = metrics.AnalysisTrace(address)
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def report_progress(self, stage, values):
+        # A new dict each time, so a page reading progress never sees it half updated
+        self.progress = {**self.progress, **values}
+
+
+class AnalysisJobQueue:
+    """
+    Runs analyses on a pool of worker threads, so a Streamlit rerun only submits a job and polls it.
+    A submit for an address that is already being analysed returns the job in flight.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, keep_seconds=JOB_KEEP_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self.keep_seconds = keep_seconds
+        self.jobs = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, address, analyse=get_analysis_for_address, key=None):
+        """
+        Starts analyse(address, trace, on_progress) in the background and returns its AnalysisJob.
+        Jobs with the same key (by default the normalized address) share one analysis while it runs.
+        """
+        key = key or normalize_address(address)
+        with self.lock:
+            self._forget_old_jobs()
+            job = self.in_flight.get(key)
+            if job is not None:
+                return job
+            job = AnalysisJob(key, address)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job
+        self.executor.submit(self._run, job, analyse)
+        return job
+
+    def get(self, job_id):
+        """The job, or None when it is unknown or was finished more than keep_seconds ago."""
+        return self.jobs.get(job_id)
+
+    def _run(self, job, analyse):
+        job.status = RUNNING
+        try:
+            job.result = analyse(job.address, job.trace, job.report_progress)
+            status = DONE
+        except Exception as e:
+            job.error = e
+            status = FAILED
+        job.finished_at = time.time()
+        with self.lock:
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+        # Set last, so a job seen as finished always has its result
+        job.status = status
+
+    def _forget_old_jobs(self):
+        oldest_kept = time.time() - self.keep_seconds
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < oldest_kept]:
+            del self.jobs[job_id]
+
+
+# One queue for the whole process, shared by every session
+job_queue = AnalysisJobQueue()
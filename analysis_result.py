@@ -0,0 +1,133 @@
+import json
+import struct
+from collections import Counter
+from typing import NamedTuple
+
+import numpy as np
+
+# Layout of AnalysisResult.to_bytes(): this header with the section sizes, the other fields as JSON,
+# the POI names and categories separated by NUL, then the POI latitudes, longitudes and distances as raw float64
+_BYTES_HEADER = struct.Struct("<4sIIII")
+_BYTES_MAGIC = b"AR02"
+_NAME_SEPARATOR = "\x00"
+
+
+def format_population(population):
+    """545796 -> '545 796', as shown on the page. None stays None."""
+    return None if population is None else f"{population:,}".replace(",", " ")
+
+
+class PoiColumns(NamedTuple):
+    """
+    POIs as parallel arrays, so the map and the maths use them without a list of dicts.
+    distances are in metres from the analysed address.
+    """
+    names: np.ndarray
+    categories: np.ndarray
+    lats: np.ndarray
+    lons: np.ndarray
+    distances: np.ndarray
+
+    @classmethod
+    def from_lists(cls, names, categories, lats, lons, distances):
+        return cls(
+            np.array(names, dtype=np.str_), np.array(categories, dtype=np.str_),
+            np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64), np.array(distances, dtype=np.float64),
+        )
+
+    @property
+    def count(self):
+        return len(self.lats)
+
+    def within(self, radius):
+        """The POIs at most radius metres away."""
+        inside = self.distances <= radius
+        return PoiColumns(*(column[inside] for column in self))
+
+    def category_counts(self):
+        """POIs per category, or None when there are none."""
+        return Counter(self.categories.tolist()) or None
+
+    def profile(self, radii):
+        """(radius, POI count, POIs per category) for each radius, all from the POIs already fetched."""
+        counts = np.searchsorted(np.sort(self.distances), radii, side="right")
+        return [(radius, int(count), self.within(radius).category_counts()) for radius, count in zip(radii, counts)]
+
+
+NO_POIS = PoiColumns.from_lists([], [], [], [], [])
+
+
+def _join_names(values):
+    return _NAME_SEPARATOR.join(values.tolist()).encode("utf-8")
+
+
+def _split_names(data, count):
+    return np.array(bytes(data).decode("utf-8").split(_NAME_SEPARATOR) if count else [], dtype=np.str_)
+
+
+class AnalysisResult(NamedTuple):
+    """
+    The outcome of one address analysis, with every number parsed once.
+    Failed analyses have a message and no final_class; the fields found before the failure are kept.
+    """
+    address: str
+    message: str
+    final_class: str = None
+    score: float = None
+    lat: float = None
+    lon: float = None
+    municipality: str = None
+    population: int = None
+    cirac_level: int = None
+    cirac_desc: str = None
+    poi_radius: int = None
+    poi_count: int = None
+    poi_categories: dict = None
+    pois: PoiColumns = NO_POIS
+
+    @property
+    def ok(self):
+        return self.final_class is not None
+
+    def summary(self):
+        """Every field but the POI arrays, plus ok, as JSON-ready values."""
+        fields = self._asdict()
+        del fields["pois"]
+        return {"ok": self.ok, **fields}
+
+    def to_bytes(self):
+        """A compact encoding for caches and other processes; the POI arrays are copied as raw memory."""
+        fields = self._asdict()
+        pois = fields.pop("pois")
+        fields_json = json.dumps(fields, ensure_ascii=False).encode("utf-8")
+        names, categories = _join_names(pois.names), _join_names(pois.categories)
+        return b"".join((
+            _BYTES_HEADER.pack(_BYTES_MAGIC, len(fields_json), len(names), len(categories), pois.count),
+            fields_json,
+            names,
+            categories,
+            pois.lats.astype("<f8").tobytes(),
+            pois.lons.astype("<f8").tobytes(),
+            pois.distances.astype("<f8").tobytes(),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Reads what to_bytes() wrote. The POI coordinates and distances are read-only views over data.
+        Raises ValueError for data in another format.
+        """
+        if bytes(data[:len(_BYTES_MAGIC)]) != _BYTES_MAGIC:
+            raise ValueError("Os dados não são um resultado de análise neste formato.")
+        magic, fields_size, names_size, categories_size, poi_count = _BYTES_HEADER.unpack_from(data)
+        offset = _BYTES_HEADER.size
+        fields = json.loads(bytes(data[offset:offset + fields_size]))
+        offset += fields_size
+        names = _split_names(data[offset:offset + names_size], poi_count)
+        offset += names_size
+        categories = _split_names(data[offset:offset + categories_size], poi_count)
+        offset += categories_size
+        lats, lons, distances = (
+            np.frombuffer(data, dtype="<f8", count=poi_count, offset=offset + column * 8 * poi_count) for column in range(3)
+        )
+        return cls(pois=PoiColumns(names, categories, lats, lons, distances), **fields)
@@ -0,0 +1,345 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import shutil
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+import http_client
+from address_index import parse_address
+from analysis import get_analysis_for_address
+from geocode_cache import normalize_address
+from raw_inputs import open_raw_input_writer
+
+# --- Batch Settings ---
+DEFAULT_ADDRESS_COLUMN = "address"
+DEFAULT_MAX_WORKERS = 4
+PARQUET_ROWS_PER_GROUP = 500
+
+OUTPUT_COLUMNS = [
+    "row_id", "address", "status", "final_class", "lat", "lon",
+    "municipality", "population", "cirac_desc", "poi_count", "error",
+]
+
+
+def read_addresses(csv_path, address_column=DEFAULT_ADDRESS_COLUMN):
+    """
+    Reads the input CSV and yields (row_id, address) pairs.
+    The row id is the 'id' column when present, otherwise the line number.
+    Raises ValueError for a repeated id, since the checkpoint and the shard merge would treat both rows as one.
+    """
+    seen_ids = set()
+    with open(csv_path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.DictReader(csv_file)
+        if address_column not in (reader.fieldnames or []):
+            raise ValueError(f"A coluna '{address_column}' não existe no ficheiro {csv_path}.")
+        for line_number, row in enumerate(reader, start=1):
+            address = (row.get(address_column) or "").strip()
+            if address:
+                row_id = str(row.get("id") or line_number)
+                if row_id in seen_ids:
+                    raise ValueError(f"O id '{row_id}' repete-se na linha {line_number} de {csv_path}; cada morada precisa de um id único.")
+                seen_ids.add(row_id)
+                yield row_id, address
+
+
+def check_addresses(csv_path, address_column=DEFAULT_ADDRESS_COLUMN):
+    """Reads the whole input once, so a missing column or a repeated id stops the run before any address is analysed."""
+    for _ in read_addresses(csv_path, address_column):
+        pass
+
+
+def result_to_row(row_id, address, result):
+    return {
+        "row_id": row_id,
+        "address": address,
+        "status": "ok" if result.ok else "erro",
+        "final_class": result.final_class,
+        "lat": result.lat,
+        "lon": result.lon,
+        "municipality": result.municipality,
+        "population": result.population,
+        "cirac_desc": result.cirac_desc,
+        "poi_count": result.poi_count,
+        "error": None if result.ok else result.message,
+    }
+
+
+# --- Checkpoint ---
+def checkpoint_path_for(output_path):
+    return output_path.rstrip(os.sep) + ".checkpoint"
+
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, encoding="utf-8") as checkpoint_file:
+        return {line.strip() for line in checkpoint_file if line.strip()}
+
+
+# --- Output Writers ---
+# write() and close() return the ids of the rows that are now safely on disk, and only those go into the checkpoint
+class CsvRowWriter:
+    """Appends rows to a CSV file, writing the header only for a new file."""
+
+    def __init__(self, output_path):
+        is_new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.file = open(output_path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=OUTPUT_COLUMNS)
+        if is_new_file:
+            self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+        return [row["row_id"]]
+
+    def close(self):
+        self.file.close()
+        return []
+
+
+class ParquetRowWriter:
+    """
+    Writes rows into a Parquet dataset directory, PARQUET_ROWS_PER_GROUP rows per part file.
+    Each part is complete, footer included, before its rows are reported as saved, so a killed run
+    never leaves checkpointed rows in an unreadable file, and a resumed run never rewrites earlier parts.
+    Read the whole result back with pandas.read_parquet(output_path).
+    """
+
+    def __init__(self, output_path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(output_path, exist_ok=True)
+        self.output_path = output_path
+        self.part_number = len([name for name in os.listdir(output_path) if name.endswith(".parquet")])
+        self.pa = pa
+        self.pq = pq
+        self.schema = pa.schema([
+            (column, pa.float64() if column in ("lat", "lon") else pa.int64() if column in ("population", "poi_count") else pa.string())
+            for column in OUTPUT_COLUMNS
+        ])
+        self.pending_rows = []
+
+    def write(self, row):
+        self.pending_rows.append(row)
+        if len(self.pending_rows) >= PARQUET_ROWS_PER_GROUP:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self.pending_rows:
+            return []
+        part_name = f"part-{self.part_number:05d}.parquet"
+        # Written under a hidden name first, which Parquet readers skip, so a part file only ever appears whole
+        temp_path = os.path.join(self.output_path, f".{part_name}.tmp")
+        self.pq.write_table(self.pa.Table.from_pylist(self.pending_rows, schema=self.schema), temp_path)
+        os.replace(temp_path, os.path.join(self.output_path, part_name))
+        saved_ids = [row["row_id"] for row in self.pending_rows]
+        self.part_number += 1
+        self.pending_rows = []
+        return saved_ids
+
+    def close(self):
+        return self.flush()
+
+
+def open_row_writer(output_path):
+    if output_path.endswith(".parquet"):
+        return ParquetRowWriter(output_path)
+    return CsvRowWriter(output_path)
+
+
+# --- Batch Runner ---
+def run_batch(addresses, output_path, max_workers=DEFAULT_MAX_WORKERS, checkpoint_path=None, on_row=None):
+    """
+    Analyses (row_id, address) pairs with at most max_workers requests in flight.
+    Each finished row is written to output_path (.csv or .parquet) and recorded
+    in the checkpoint file, so running again with the same output skips it.
+    The inputs behind each result are also kept in RAW_INPUTS_PATH, for raw_inputs.py rescore.
+    Returns the number of rows analysed in this run.
+    """
+    checkpoint_path = checkpoint_path or checkpoint_path_for(output_path)
+    done_ids = load_checkpoint(checkpoint_path)
+    pending = ((row_id, address) for row_id, address in addresses if row_id not in done_ids)
+
+    row_writer = open_row_writer(output_path)
+    raw_input_writer = open_raw_input_writer()
+    checkpoint_file = open(checkpoint_path, "a", encoding="utf-8")
+    rows_done = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+            for row_id, address in pending:
+                # Only keep a small window of jobs queued, so huge files are never fully loaded in memory
+                if len(in_flight) >= max_workers * 2:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        rows_done += _save_finished(future, in_flight.pop(future), row_writer, raw_input_writer, checkpoint_file, on_row)
+                in_flight[executor.submit(get_analysis_for_address, address)] = (row_id, address)
+
+            for future in as_completed(list(in_flight)):
+                rows_done += _save_finished(future, in_flight.pop(future), row_writer, raw_input_writer, checkpoint_file, on_row)
+    finally:
+        _record_saved(checkpoint_file, row_writer.close())
+        if raw_input_writer:
+            raw_input_writer.close()
+        checkpoint_file.close()
+    return rows_done
+
+
+def _save_finished(future, job, row_writer, raw_input_writer, checkpoint_file, on_row):
+    row_id, address = job
+    try:
+        result = future.result()
+        row = result_to_row(row_id, address, result)
+        if raw_input_writer:
+            raw_input_writer.write(result)
+    except Exception as e:
+        row = {column: None for column in OUTPUT_COLUMNS}
+        row.update({"row_id": row_id, "address": address, "status": "erro", "error": f"Ocorreu um erro inesperado: {e}"})
+
+    _record_saved(checkpoint_file, row_writer.write(row))
+    if on_row:
+        on_row(row)
+    return 1
+
+
+def _record_saved(checkpoint_file, row_ids):
+    # The checkpoint only names rows already on disk, so an interrupted run never skips an unsaved row
+    if row_ids:
+        checkpoint_file.write("".join(row_id + "\n" for row_id in row_ids))
+        checkpoint_file.flush()
+
+
+# --- Sharded Runs ---
+def shard_key(address):
+    """
+    The part of the address that decides its shard: the CP4 postcode area, else the locality, else the address.
+    Nearby addresses then land in the same shard and reuse the same cached tiles and lookups.
+    """
+    parsed = parse_address(address)
+    return parsed.postcode[:4] or parsed.locality or normalize_address(address)
+
+
+def shard_of(address, shards):
+    # crc32 rather than hash(), which changes between processes
+    return zlib.crc32(shard_key(address).encode("utf-8")) % shards
+
+
+def shard_part_path(output_path, shard_index, shards):
+    extension = ".parquet" if output_path.endswith(".parquet") else ".csv"
+    return os.path.join(output_path.rstrip(os.sep) + ".shards", f"shard-{shard_index:03d}-of-{shards:03d}{extension}")
+
+
+def run_shard(csv_path, output_path, shard_index, shards, address_column=DEFAULT_ADDRESS_COLUMN,
+              max_workers=DEFAULT_MAX_WORKERS, processes=1, on_row=None):
+    """
+    Analyses the addresses of one shard into its part file, with its own checkpoint, so shards can run
+    in separate processes or on separate machines sharing the input file. Returns the number of rows analysed.
+    processes is how many shards run at the same time against the same upstreams; the rate limits are shared among them.
+    """
+    http_client.share_rate_limits(processes)
+    part_path = shard_part_path(output_path, shard_index, shards)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    addresses = ((row_id, address) for row_id, address in read_addresses(csv_path, address_column) if shard_of(address, shards) == shard_index)
+    return run_batch(addresses, part_path, max_workers=max_workers, on_row=on_row)
+
+
+def _read_part(part_path):
+    if part_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.read_table(part_path).to_pylist()
+    with open(part_path, newline="", encoding="utf-8") as part_file:
+        return [{column: value or None for column, value in row.items()} for row in csv.DictReader(part_file)]
+
+
+def merge_shards(csv_path, output_path, shards, address_column=DEFAULT_ADDRESS_COLUMN):
+    """
+    Writes the rows of every shard part into output_path, in the order of the input file,
+    so the result matches a serial run. A previous output_path is replaced. Returns the number of rows written.
+    """
+    missing = [shard_part_path(output_path, index, shards) for index in range(shards) if not os.path.exists(shard_part_path(output_path, index, shards))]
+    if missing:
+        raise ValueError(f"Faltam partes: {', '.join(missing)}.")
+    rows = {}
+    for index in range(shards):
+        for row in _read_part(shard_part_path(output_path, index, shards)):
+            rows[str(row["row_id"])] = row
+
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    elif os.path.exists(output_path):
+        os.remove(output_path)
+    row_writer = open_row_writer(output_path)
+    rows_written = 0
+    try:
+        for row_id, address in read_addresses(csv_path, address_column):
+            row = rows.pop(row_id, None)
+            if row is not None:
+                row_writer.write(row)
+                rows_written += 1
+    finally:
+        row_writer.close()
+    return rows_written
+
+
+def run_sharded(csv_path, output_path, shards, processes=None, address_column=DEFAULT_ADDRESS_COLUMN, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Runs every shard in a pool of processes (by default one per shard), then merges them into output_path.
+    Each process has its own threads, so the CPU work of parsing and scoring uses every core.
+    Returns the number of rows analysed in this run.
+    """
+    processes = min(processes or shards, shards)
+    # spawn, since forking a process that already has thread pools can leave their locks held
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            executor.submit(run_shard, csv_path, output_path, index, shards, address_column, max_workers, processes)
+            for index in range(shards)
+        ]
+        rows_done = sum(future.result() for future in futures)
+    merge_shards(csv_path, output_path, shards, address_column)
+    return rows_done
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analisa em lote as moradas de um ficheiro CSV.")
+    parser.add_argument("input_csv", help="Ficheiro CSV com as moradas.")
+    parser.add_argument("output", help="Ficheiro de resultados (.csv ou .parquet).")
+    parser.add_argument("--column", default=DEFAULT_ADDRESS_COLUMN, help="Nome da coluna com as moradas.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="Número de análises em simultâneo.")
+    parser.add_argument("--checkpoint", default=None, help="Ficheiro de progresso (por omissão: <output>.checkpoint).")
+    parser.add_argument("--shards", type=int, default=1, help="Divide as moradas em partes, por código postal ou localidade.")
+    parser.add_argument("--processes", type=int, default=None, help="Processos em simultâneo (por omissão: um por parte).")
+    parser.add_argument("--shard-index", type=int, default=None, help="Corre só esta parte (0 a shards-1), p.ex. noutra máquina.")
+    parser.add_argument("--merge", action="store_true", help="Só junta as partes já calculadas no ficheiro de resultados.")
+    args = parser.parse_args(argv)
+
+    def print_progress(row):
+        print(f"[{row['status']}] {row['row_id']}: {row['address']} -> {row['final_class'] or row['error']}")
+
+    try:
+        check_addresses(args.input_csv, args.column)
+        if args.merge:
+            print(f"{merge_shards(args.input_csv, args.output, args.shards, args.column)} linhas juntas em {args.output}.")
+            return 0
+        if args.shard_index is not None:
+            rows_done = run_shard(args.input_csv, args.output, args.shard_index, args.shards, args.column, args.workers,
+                                  processes=args.processes or 1, on_row=print_progress)
+        elif args.shards > 1:
+            rows_done = run_sharded(args.input_csv, args.output, args.shards, args.processes, args.column, args.workers)
+        else:
+            rows_done = run_batch(read_addresses(args.input_csv, args.column), args.output, max_workers=args.workers, checkpoint_path=args.checkpoint, on_row=print_progress)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"\nERRO: {e}")
+        return 1
+    print(f"\nAnálise em lote concluída: {rows_done} moradas analisadas nesta execução.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,420 @@
+"""
+Benchmark of the address analysis pipeline against recorded upstream responses.
+
+A local stub server replays the files in benchmarks/fixtures/ for Nominatim,
+BigDataCloud, the population sheet, CIRAC and Overpass, with a configurable
+latency per service. Every HTTP call made by the pipeline is redirected to it,
+so no live service is used. Without --warm-cache every address gets its own
+point, so the caches keyed by coordinates start cold for each analysis too.
+
+    python benchmarks/benchmark_pipeline.py run --version v2 --output bench_v2.json
+    python benchmarks/benchmark_pipeline.py run --version v1 --latency overpass-api.de=800
+    python benchmarks/benchmark_pipeline.py compare bench_v1.json bench_v2.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(REPO_DIR, "benchmarks", "fixtures")
+sys.path.insert(0, REPO_DIR)
+
+# --- Recorded Upstreams ---
+# (host, first path segment) -> (stage name, fixture file, content type)
+ROUTES = {
+    ("nominatim.openstreetmap.org", "search"): ("geocode", "nominatim_search.json", "application/json"),
+    ("nominatim.openstreetmap.org", "reverse"): ("reverse_geocode", "nominatim_reverse.json", "application/json"),
+    ("api.bigdatacloud.net", "data"): ("reverse_geocode", "bigdatacloud_reverse.json", "application/json"),
+    ("docs.google.com", "spreadsheets"): ("population", "population.csv", "text/csv; charset=utf-8"),
+    ("segurmaps.apseguradores.pt", "api"): ("cirac", "cirac_extract.json", "application/json"),
+    ("overpass-api.de", "api"): ("poi", "overpass.json", "application/json"),
+}
+DEFAULT_ADDRESS = "Rua Augusta 100, Lisboa"
+# In cold runs each address is answered with its own point, up to this many steps from the fixture's in each direction.
+# Steps are wider than a zoom 15 POI tile and a CIRAC cell, so no two points share their cached data
+COLD_OFFSET_STEPS = 20
+COLD_OFFSET_DEGREES = 0.02
+
+
+def route_for(host, path):
+    first_segment = path.strip("/").split("/", 1)[0]
+    return ROUTES.get((host, first_segment))
+
+
+def moved_search_answer(fixture, query):
+    """The Nominatim search fixture with its point moved by a fixed offset derived from the query text."""
+    places = json.loads(fixture)
+    code = zlib.crc32(query.encode("utf-8"))
+    lat_step = code % (2 * COLD_OFFSET_STEPS + 1) - COLD_OFFSET_STEPS
+    lon_step = code // (2 * COLD_OFFSET_STEPS + 1) % (2 * COLD_OFFSET_STEPS + 1) - COLD_OFFSET_STEPS
+    for place in places:
+        place["lat"] = str(float(place["lat"]) + lat_step * COLD_OFFSET_DEGREES)
+        place["lon"] = str(float(place["lon"]) + lon_step * COLD_OFFSET_DEGREES)
+    return json.dumps(places).encode("utf-8")
+
+
+class StubServer:
+    """
+    Serves the fixtures over local HTTP, sleeping latency_ms[host] before each answer.
+    With vary_coordinates, every searched address gets its own point, so the reverse geocode,
+    CIRAC and POI caches, which are keyed by coordinates, miss for every new address as they would in real use.
+    """
+
+    def __init__(self, latency_ms, default_latency_ms=0, vary_coordinates=False):
+        fixtures = {}
+        for stage, file_name, content_type in ROUTES.values():
+            with open(os.path.join(FIXTURES_DIR, file_name), "rb") as fixture_file:
+                fixtures[file_name] = fixture_file.read()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body are written separately; without this, keep-alive clients wait ~40 ms for delayed ACKs
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def answer(self):
+                # Paths look like /<original host>/<original path>
+                host, _, path = urlsplit(self.path).path.lstrip("/").partition("/")
+                route = route_for(host, "/" + path)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                if route is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                time.sleep(latency_ms.get(host, default_latency_ms) / 1000)
+                body = fixtures[route[1]]
+                if vary_coordinates and route[0] == "geocode":
+                    query = parse_qs(urlsplit(self.path).query).get("q", [""])[0]
+                    body = moved_search_answer(body, query)
+                self.send_response(200)
+                self.send_header("Content-Type", route[2])
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = answer
+            do_POST = answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StageTimer:
+    """Collects the duration of every upstream call, grouped by pipeline stage."""
+
+    def __init__(self):
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}
+
+
+class TraceCollector:
+    """
+    Collects the metrics.AnalysisTrace spans of v2 analyses. Unlike StageTimer, which only sees upstream
+    HTTP calls, it times every stage, including the ones answered from a cache, and counts the cache hits.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def traced(self, analyse):
+        import metrics
+
+        def analyse_traced(address):
+            trace = metrics.AnalysisTrace(address)
+            result = analyse(address, trace)
+            with self.lock:
+                self.spans.extend(trace.spans)
+            return result
+        return analyse_traced
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+
+    def summary(self):
+        stages = {}
+        for span in self.spans:
+            stages.setdefault(span["stage"], []).append(span)
+        return {
+            stage: dict(
+                summarize([span["ms"] / 1000 for span in spans]),
+                cache_hits=sum(span["cache"] == "hit" for span in spans),
+                cache_misses=sum(span["cache"] == "miss" for span in spans),
+            )
+            for stage, spans in sorted(stages.items())
+        }
+
+
+def redirect_requests(stub_base_url, stage_timer):
+    """
+    Sends every requests call (the module-level helpers and shared sessions alike)
+    to the stub server, and times it under its pipeline stage.
+    """
+    import requests
+
+    original_request = requests.Session.request
+
+    def routed_request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        route = route_for(parts.hostname, parts.path)
+        stub_url = f"{stub_base_url}/{parts.hostname}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+        kwargs.pop("verify", None)
+        start = time.perf_counter()
+        try:
+            return original_request(self, method, stub_url, *args, **kwargs)
+        finally:
+            stage_timer.record(route[0] if route else parts.hostname, time.perf_counter() - start)
+
+    requests.Session.request = routed_request
+
+
+# --- Pipelines ---
+def isolate_local_state(work_dir):
+    """
+    Points caches and offline data at an empty folder, so every run starts from the same cold state.
+    A dummy AUTHORIZATION makes v2 ask the stubbed CIRAC API, which it skips without one;
+    v1 never calls CIRAC and always uses a moderate risk, so its results have no cirac stage.
+    """
+    os.environ["AUTHORIZATION"] = "benchmark"
+    os.environ["GEOCODE_CACHE_PATH"] = os.path.join(work_dir, "geocode_cache.sqlite")
+    os.environ["POPULATION_SNAPSHOT_PATH"] = os.path.join(work_dir, "population_snapshot.csv")
+    os.environ["POI_TILE_CACHE_PATH"] = os.path.join(work_dir, "poi_tiles.sqlite")
+    for variable in ("POI_INDEX_PATH", "MUNICIPALITY_BOUNDARIES_PATH", "CIRAC_GRID_PATH", "ADDRESS_INDEX_PATH"):
+        os.environ[variable] = ""
+
+
+def load_pipeline(version):
+    """Returns (analyse function, source file) for 'v1' (streamlit_app.py) or 'v2' (analysis.py, used by streamlit_app_v2.py)."""
+    if version == "v2":
+        import analysis
+        # The upstreams are local, so the per-host rate limits would only measure the limiter
+        import http_client
+        http_client._rate_limiters.clear()
+        return analysis.get_analysis_for_address, "analysis.py"
+
+    # streamlit_app.py builds its page at import time; outside 'streamlit run' those calls do nothing
+    spec = importlib.util.spec_from_file_location("streamlit_app_v1", os.path.join(REPO_DIR, "streamlit_app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.get_analysis_for_address, "streamlit_app.py"
+
+
+# --- Measurements ---
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(seconds):
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 0.95) * 1000, 3),
+        "mean_ms": round(statistics.fmean(seconds) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3),
+    }
+
+
+def run_level(analyse, addresses, concurrency):
+    """Runs every address with `concurrency` sessions at once. Returns (latencies, wall seconds, failures)."""
+    latencies = []
+    failures = 0
+
+    def timed(address):
+        start = time.perf_counter()
+        result = analyse(address)
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for seconds, result in executor.map(timed, addresses):
+            latencies.append(seconds)
+            # streamlit_app.py returns a message string, analysis.py an AnalysisResult
+            if hasattr(result, "ok") and not result.ok:
+                failures += 1
+    return latencies, time.perf_counter() - start, failures
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(version, requests_per_level, concurrency_levels, latency_ms, default_latency_ms, warm_cache, address=DEFAULT_ADDRESS):
+    stage_timer = StageTimer()
+    trace_collector = TraceCollector()
+    with tempfile.TemporaryDirectory() as work_dir, StubServer(latency_ms, default_latency_ms, vary_coordinates=not warm_cache) as stub:
+        isolate_local_state(work_dir)
+        redirect_requests(stub.base_url, stage_timer)
+        analyse, source_file = load_pipeline(version)
+        if version == "v2":
+            analyse = trace_collector.traced(analyse)
+
+        # One untimed call loads the population sheet and opens the connections, like a running server
+        analyse(address)
+        stage_timer.reset()
+        trace_collector.reset()
+
+        tracemalloc.start()
+        analyse(f"{address} (memória)")
+        single_call_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        levels = {}
+        all_latencies = []
+        for concurrency in concurrency_levels:
+            # A cold cache needs a different address per call; the stub answers each one with its own point
+            addresses = [address if warm_cache else f"{address} #{concurrency}-{number}" for number in range(requests_per_level)]
+            latencies, wall_seconds, failures = run_level(analyse, addresses, concurrency)
+            all_latencies.extend(latencies)
+            levels[str(concurrency)] = dict(summarize(latencies), throughput_per_s=round(len(latencies) / wall_seconds, 3), failures=failures)
+
+        return {
+            "version": version,
+            "source_file": source_file,
+            "git_commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "settings": {
+                "address": address,
+                "requests_per_level": requests_per_level,
+                "concurrency_levels": concurrency_levels,
+                "default_latency_ms": default_latency_ms,
+                "latency_ms": latency_ms,
+                "warm_cache": warm_cache,
+            },
+            "end_to_end": dict(summarize(all_latencies), by_concurrency=levels),
+            # Upstream HTTP calls only, for both versions
+            "stages": {stage: summarize(seconds) for stage, seconds in sorted(stage_timer.durations.items())},
+            # Every pipeline stage, cache hits included; only v2 records them
+            "trace_stages": trace_collector.summary(),
+            "memory": {
+                "single_analysis_peak_bytes": single_call_peak,
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+        }
+
+
+def compare(baseline_path, candidate_path):
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(candidate_path, encoding="utf-8") as candidate_file:
+        candidate = json.load(candidate_file)
+
+    def line(label, before, after):
+        if before is None or after is None:
+            # A stage one version never calls, such as cirac in v1
+            return f"{label:<34} {'-' if before is None else f'{before:.1f}':>12} {'-' if after is None else f'{after:.1f}':>12}"
+        change = (after - before) / before * 100 if before else 0.0
+        return f"{label:<34} {before:>12.1f} {after:>12.1f} {change:>+8.1f}%"
+
+    print(f"{'':<34} {baseline['version'] + '@' + str(baseline['git_commit']):>12} {candidate['version'] + '@' + str(candidate['git_commit']):>12}")
+    for key in ("p50_ms", "p95_ms"):
+        print(line(f"end_to_end {key}", baseline["end_to_end"][key], candidate["end_to_end"][key]))
+    for concurrency, level in candidate["end_to_end"]["by_concurrency"].items():
+        before = baseline["end_to_end"]["by_concurrency"].get(concurrency, {}).get("throughput_per_s")
+        print(line(f"throughput/s @ {concurrency} sessions", before, level["throughput_per_s"]))
+    for stage in sorted(set(baseline["stages"]) | set(candidate["stages"])):
+        print(line(f"{stage} p50_ms", baseline["stages"].get(stage, {}).get("p50_ms"), candidate["stages"].get(stage, {}).get("p50_ms")))
+    baseline_traces, candidate_traces = baseline.get("trace_stages", {}), candidate.get("trace_stages", {})
+    for stage in sorted(set(baseline_traces) | set(candidate_traces)):
+        for key in ("p50_ms", "p95_ms"):
+            print(line(f"traced {stage} {key}", baseline_traces.get(stage, {}).get(key), candidate_traces.get(stage, {}).get(key)))
+    print(line("memory peak KiB (1 analysis)", baseline["memory"]["single_analysis_peak_bytes"] / 1024, candidate["memory"]["single_analysis_peak_bytes"] / 1024))
+
+
+# --- Command Line ---
+def parse_latencies(values):
+    latencies = {}
+    for value in values or []:
+        host, _, milliseconds = value.partition("=")
+        latencies[host] = float(milliseconds)
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de análise com respostas gravadas.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Mede o pipeline e grava os resultados em JSON.")
+    run_parser.add_argument("--version", choices=("v1", "v2"), default="v2", help="v1 = streamlit_app.py, v2 = analysis.py (streamlit_app_v2.py).")
+    run_parser.add_argument("--requests", type=int, default=50, help="Análises por nível de concorrência.")
+    run_parser.add_argument("--concurrency", default="1,4,16", help="Níveis de concorrência, separados por vírgulas.")
+    run_parser.add_argument("--default-latency-ms", type=float, default=50, help="Latência injetada em cada serviço.")
+    run_parser.add_argument("--latency", action="append", metavar="HOST=MS", help="Latência de um serviço em particular, p.ex. overpass-api.de=800.")
+    run_parser.add_argument("--warm-cache", action="store_true", help="Repete a mesma morada, para medir com a cache de geocodificação preenchida.")
+    run_parser.add_argument("--output", help="Ficheiro JSON de resultados (por omissão, escreve no ecrã).")
+    compare_parser = commands.add_parser("compare", help="Compara dois ficheiros de resultados.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        compare(args.baseline, args.candidate)
+        return 0
+
+    results = run_benchmark(
+        args.version,
+        args.requests,
+        [int(level) for level in args.concurrency.split(",")],
+        parse_latencies(args.latency),
+        args.default_latency_ms,
+        args.warm_cache,
+    )
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+        print(f"Resultados gravados em {args.output}.")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import warnings
+
+import numpy as np
+import requests
+from dotenv import load_dotenv
+
+import http_client
+import metrics
+from municipality_resolver import MAX_MATRIX_CELLS, MunicipalityPolygon
+from poi_tiles import parse_bbox
+from single_flight import SingleFlight
+
+load_dotenv()
+
+# --- CIRAC Grid Settings ---
+CIRAC_GRID_PATH = os.getenv("CIRAC_GRID_PATH", os.path.join("data", "cirac_grid.u8"))
+CIRAC_URL = "https://segurmaps.apseguradores.pt/api/v2/extract?map_id=36"
+# Mainland Portugal (min_lat, min_lon, max_lat, max_lon)
+MAINLAND_BBOX = (36.9, -9.6, 42.2, -6.1)
+# 0.0025 degrees is about 250 metres
+DEFAULT_CELL_DEGREES = 0.0025
+
+# Cell values: 0 = not cached yet, 1..5 = CIRAC risk level, NO_DATA = asked but the map has no value there
+NOT_CACHED = 0
+NO_DATA = 255
+
+RISK_DESCRIPTIONS = {1: "Risco muito baixo", 2: "Risco baixo", 3: "Risco moderado", 4: "Risco elevado", 5: "Risco muito elevado"}
+
+
+def describe_risk(level):
+    return RISK_DESCRIPTIONS.get(level, "desconhecido")
+
+
+def fetch_cirac_live(lat, lon):
+    """Asks the segurmaps extract API for the CIRAC risk level at a point. Returns None when the map has no value."""
+    warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+    cirac_headers = {
+        "Authorization": os.getenv("AUTHORIZATION"),
+        "content-type": "application/json",
+        "accept": "application/json"
+    }
+    cirac_json_data = {"type": "Point", "coordinates": [float(lon), float(lat)]}
+
+    cirac_response = http_client.post(CIRAC_URL, headers=cirac_headers, json=cirac_json_data, verify=False)
+    cirac_response.raise_for_status()
+    cirac_data = cirac_response.json()
+
+    try:
+        return cirac_data['geojson']['features'][0]['properties']['__extract__']['ridx']
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def grid_shape(bbox, cell_degrees):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    # Rounded first so float noise (0.3 / 0.0025 = 120.00000000000001) does not add an extra row
+    return int(np.ceil(round((max_lat - min_lat) / cell_degrees, 6))), int(np.ceil(round((max_lon - min_lon) / cell_degrees, 6)))
+
+
+class CiracGrid:
+    """
+    CIRAC risk levels stored as one byte per grid cell in a memory-mapped file,
+    next to a small JSON file with the grid's bounding box and cell size.
+    A lookup is a single array read; the operating system keeps the file in memory.
+    """
+
+    def __init__(self, path, bbox, cell_degrees, writable=False):
+        self.path = path
+        self.bbox = tuple(bbox)
+        self.cell_degrees = cell_degrees
+        self.shape = grid_shape(self.bbox, cell_degrees)
+        self.cells = np.memmap(path, dtype=np.uint8, mode="r+" if writable else "r", shape=self.shape)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, bbox=MAINLAND_BBOX, cell_degrees=DEFAULT_CELL_DEGREES):
+        """Creates an empty grid (every cell NOT_CACHED), or opens the existing one for writing."""
+        if os.path.exists(path):
+            return cls.open(path, writable=True)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".json", "w", encoding="utf-8") as header_file:
+            json.dump({"bbox": list(bbox), "cell_degrees": cell_degrees}, header_file)
+        np.memmap(path, dtype=np.uint8, mode="w+", shape=grid_shape(bbox, cell_degrees)).flush()
+        return cls(path, bbox, cell_degrees, writable=True)
+
+    @classmethod
+    def open(cls, path, writable=False):
+        with open(path + ".json", encoding="utf-8") as header_file:
+            header = json.load(header_file)
+        return cls(path, header["bbox"], header["cell_degrees"], writable=writable)
+
+    def cell_of(self, lat, lon):
+        """(row, col) of the cell containing the point, or None when it is outside the grid."""
+        min_lat, min_lon = self.bbox[0], self.bbox[1]
+        row = int((lat - min_lat) // self.cell_degrees)
+        col = int((lon - min_lon) // self.cell_degrees)
+        if 0 <= row < self.shape[0] and 0 <= col < self.shape[1]:
+            return row, col
+        return None
+
+    def cell_centers(self):
+        """Arrays with the latitude of every row and the longitude of every column centre."""
+        min_lat, min_lon = self.bbox[0], self.bbox[1]
+        lats = min_lat + (np.arange(self.shape[0]) + 0.5) * self.cell_degrees
+        lons = min_lon + (np.arange(self.shape[1]) + 0.5) * self.cell_degrees
+        return lats, lons
+
+    def lookup(self, lat, lon):
+        """Returns the cell value: NOT_CACHED, a risk level 1..5 or NO_DATA."""
+        cell = self.cell_of(lat, lon)
+        return NOT_CACHED if cell is None else int(self.cells[cell])
+
+    def lookup_many(self, lats, lons):
+        """lookup() for arrays of points at once. Points outside the grid are NOT_CACHED."""
+        min_lat, min_lon = self.bbox[0], self.bbox[1]
+        rows = np.floor((np.asarray(lats, dtype=np.float64) - min_lat) / self.cell_degrees).astype(np.int64)
+        cols = np.floor((np.asarray(lons, dtype=np.float64) - min_lon) / self.cell_degrees).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        values = np.full(len(rows), NOT_CACHED, dtype=np.uint8)
+        values[inside] = self.cells[rows[inside], cols[inside]]
+        return values
+
+    def store(self, lat, lon, level):
+        cell = self.cell_of(lat, lon)
+        if cell is not None:
+            with self.lock:
+                self.cells[cell] = NO_DATA if level is None else int(level)
+
+    def flush(self):
+        self.cells.flush()
+
+    # --- Populating the grid ---
+    def import_geojson(self, geojson_path, level_field="ridx"):
+        """Rasterises risk polygons: every cell whose centre falls inside a polygon gets its level."""
+        with open(geojson_path, encoding="utf-8") as geojson_file:
+            features = json.load(geojson_file).get("features", [])
+        lats, lons = self.cell_centers()
+        filled = 0
+        for feature in features:
+            properties = feature.get("properties") or {}
+            level = properties.get(level_field, (properties.get("__extract__") or {}).get(level_field))
+            geometry = feature.get("geometry") or {}
+            if level is None or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+                continue
+            parts = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+            for rings in parts:
+                polygon = MunicipalityPolygon(None, None, rings)
+                row_range = np.flatnonzero((lats >= polygon.min_lat) & (lats <= polygon.max_lat))
+                col_range = np.flatnonzero((lons >= polygon.min_lon) & (lons <= polygon.max_lon))
+                if not len(row_range) or not len(col_range):
+                    continue
+                # A few rows at a time, so the points x edges matrices stay within MAX_MATRIX_CELLS
+                rows_per_chunk = max(1, MAX_MATRIX_CELLS // max(polygon.edge_count * len(col_range), 1))
+                for start in range(0, len(row_range), rows_per_chunk):
+                    rows = row_range[start:start + rows_per_chunk]
+                    grid_lats, grid_lons = np.meshgrid(lats[rows], lons[col_range], indexing="ij")
+                    inside = polygon.contains(grid_lons.ravel(), grid_lats.ravel()).reshape(grid_lats.shape)
+                    block = self.cells[rows[0]:rows[-1] + 1, col_range[0]:col_range[-1] + 1]
+                    block[inside] = int(level)
+                    filled += int(inside.sum())
+        self.flush()
+        return filled
+
+    def import_raster(self, raster_path):
+        """Samples a single-band raster (e.g. a GeoTIFF in WGS84) at every cell centre. Needs the optional rasterio package."""
+        try:
+            import rasterio
+        except ImportError:
+            raise ImportError("Para importar rasters instale o pacote 'rasterio' (pip install rasterio).")
+        lats, lons = self.cell_centers()
+        with rasterio.open(raster_path) as raster:
+            nodata = raster.nodata
+            for row, lat in enumerate(lats):
+                values = np.array([value[0] for value in raster.sample([(lon, lat) for lon in lons])])
+                valid = (values >= 1) & (values <= 5) & (values != nodata)
+                self.cells[row, valid] = values[valid].astype(np.uint8)
+        self.flush()
+
+    def fill_from_api(self, bbox):
+        """
+        Asks the live API for every cell centre in bbox that is not cached yet. Can be stopped and run again.
+        The pace is set by the segurmaps rate limit in http_client.
+        """
+        min_lat, min_lon, max_lat, max_lon = bbox
+        lats, lons = self.cell_centers()
+        rows = np.flatnonzero((lats >= min_lat) & (lats <= max_lat))
+        cols = np.flatnonzero((lons >= min_lon) & (lons <= max_lon))
+        asked = 0
+        for row in rows:
+            for col in cols:
+                if self.cells[row, col] != NOT_CACHED:
+                    continue
+                try:
+                    level = fetch_cirac_live(lats[row], lons[col])
+                    self.cells[row, col] = NO_DATA if level is None else int(level)
+                except requests.exceptions.RequestException as e:
+                    print(f"Erro no ponto ({lats[row]:.4f}, {lons[col]:.4f}): {e}")
+                asked += 1
+            self.flush()
+            print(f"Linha {row - rows[0] + 1} de {len(rows)} concluída ({asked} pedidos).")
+        return asked
+
+
+_loaded_grid = None
+_load_lock = threading.Lock()
+# Concurrent live lookups in the same grid cell (or the same ~11 m point without a grid) share one request
+_live_lookups = SingleFlight()
+
+
+def get_cirac_grid(path=CIRAC_GRID_PATH):
+    """Returns the CIRAC grid opened for lookups and write-through, or None when no grid file exists."""
+    global _loaded_grid
+    if _loaded_grid is None and path and os.path.exists(path):
+        with _load_lock:
+            if _loaded_grid is None:
+                _loaded_grid = CiracGrid.open(path, writable=os.access(path, os.W_OK))
+    return _loaded_grid
+
+
+def get_cirac_level(lat, lon, use_api=None):
+    """
+    CIRAC risk level at a point: read from the grid when the cell is cached,
+    otherwise asked to the live API (when AUTHORIZATION is set) and saved in the grid.
+    Returns None when the level is not known.
+    """
+    grid = get_cirac_grid()
+    if grid is not None:
+        value = grid.lookup(lat, lon)
+        metrics.record_cache(value != NOT_CACHED)
+        if value != NOT_CACHED:
+            return None if value == NO_DATA else value
+
+    if use_api is None:
+        use_api = bool(os.getenv("AUTHORIZATION"))
+    if not use_api:
+        return None
+
+    cell = grid.cell_of(lat, lon) if grid is not None else None
+    lookup_key = cell if cell is not None else (round(float(lat), 4), round(float(lon), 4))
+    level = _live_lookups.run(lookup_key, lambda: fetch_cirac_live(lat, lon))
+    if grid is not None and grid.cells.mode != "r":
+        grid.store(lat, lon, level)
+    return level
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grelha local com o risco de inundação CIRAC.")
+    parser.add_argument("--grid", default=CIRAC_GRID_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_parser = commands.add_parser("create", help="Cria uma grelha vazia.")
+    create_parser.add_argument("--bbox", type=parse_bbox, default=MAINLAND_BBOX, help="min_lat,min_lon,max_lat,max_lon")
+    create_parser.add_argument("--cell", type=float, default=DEFAULT_CELL_DEGREES, help="Tamanho da célula em graus.")
+    import_parser = commands.add_parser("import", help="Importa um GeoJSON de polígonos de risco ou um raster.")
+    import_parser.add_argument("source")
+    import_parser.add_argument("--field", default="ridx", help="Propriedade com o nível de risco (GeoJSON).")
+    fill_parser = commands.add_parser("fill", help="Preenche as células em falta com pedidos à API segurmaps.")
+    fill_parser.add_argument("bbox", type=parse_bbox, help="min_lat,min_lon,max_lat,max_lon")
+    lookup_parser = commands.add_parser("lookup", help="Mostra o risco num ponto.")
+    lookup_parser.add_argument("lat", type=float)
+    lookup_parser.add_argument("lon", type=float)
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        grid = CiracGrid.create(args.grid, args.bbox, args.cell)
+        print(f"Grelha {grid.shape[0]} x {grid.shape[1]} em {args.grid}.")
+    elif args.command == "import":
+        grid = CiracGrid.open(args.grid, writable=True)
+        if args.source.lower().endswith((".geojson", ".json")):
+            print(f"{grid.import_geojson(args.source, args.field)} células preenchidas.")
+        else:
+            grid.import_raster(args.source)
+            print("Raster importado.")
+    elif args.command == "fill":
+        grid = CiracGrid.open(args.grid, writable=True)
+        print(f"{grid.fill_from_api(args.bbox)} pedidos feitos.")
+    elif args.command == "lookup":
+        value = CiracGrid.open(args.grid).lookup(args.lat, args.lon)
+        print("Sem dados em cache." if value == NOT_CACHED else describe_risk(None if value == NO_DATA else value))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+
+from sqlite_cache import SqliteCache
+
+# --- Geocode Cache Settings ---
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", os.path.join("data", "geocode_cache.sqlite"))
+GEOCODE_CACHE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", 100_000))
+# 4 decimal places is about 11 metres, much smaller than a municipality
+COORDINATE_PRECISION = 4
+
+
+def normalize_address(address):
+    """Lower case with single spaces, so 'Rua  Augusta, Lisboa' and 'rua augusta , lisboa' share a key."""
+    return " ".join(address.casefold().replace(",", " , ").split()).replace(" ,", ",")
+
+
+def coordinate_key(lat, lon):
+    return f"{round(float(lat), COORDINATE_PRECISION)},{round(float(lon), COORDINATE_PRECISION)}"
+
+
+# One shared cache for the whole process
+geocode_cache = SqliteCache(GEOCODE_CACHE_PATH, GEOCODE_CACHE_TTL_SECONDS, GEOCODE_CACHE_MAX_ENTRIES)
+
+
+# --- Command Line ---
+def read_address_list(path):
+    with open(path, encoding="utf-8-sig") as address_file:
+        return [line.strip() for line in address_file if line.strip()]
+
+
+def prewarm(addresses):
+    """
+    Geocodes and reverse geocodes each address so later analyses find them in the cache.
+    Nominatim's one request per second is enforced by the rate limiter in http_client.
+    """
+    from analysis import fetch_coordinates, fetch_municipality
+    import requests
+
+    for number, address in enumerate(addresses, start=1):
+        try:
+            results = fetch_coordinates(address)
+            if results and results[0].get('lat') and results[0].get('lon'):
+                fetch_municipality(float(results[0]['lat']), float(results[0]['lon']))
+            status = "ok" if results else "sem resultados"
+        except requests.exceptions.RequestException as e:
+            status = f"erro: {e}"
+        print(f"[{number}/{len(addresses)}] {address}: {status}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gere a cache local de geocodificação.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prewarm_parser = commands.add_parser("prewarm", help="Preenche a cache a partir de um ficheiro com uma morada por linha.")
+    prewarm_parser.add_argument("addresses_file")
+    commands.add_parser("stats", help="Mostra o número de entradas na cache.")
+    commands.add_parser("purge", help="Remove as entradas expiradas.")
+    args = parser.parse_args(argv)
+
+    if args.command == "prewarm":
+        prewarm(read_address_list(args.addresses_file))
+        print(geocode_cache.stats())
+    elif args.command == "stats":
+        print(geocode_cache.stats())
+    elif args.command == "purge":
+        print(f"{geocode_cache.remove_expired()} entradas expiradas removidas.")
+    return 0
+
+
+if __name__ == "__main__":
+    # Run through the imported module, so the CLI and analysis.py share one cache object
+    from geocode_cache import main as module_main
+    sys.exit(module_main())
@@ -0,0 +1,118 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# --- HTTP Client Settings ---
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", 30))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+BACKOFF_SECONDS = 0.5
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+POOL_SIZE_PER_HOST = 20
+
+# Requests per second allowed for each upstream, shared by every thread and user of the process
+HOST_RATE_LIMITS = {
+    "nominatim.openstreetmap.org": 1.0,  # Nominatim usage policy: at most 1 request per second
+    "overpass-api.de": 2.0,
+    "segurmaps.apseguradores.pt": 5.0,
+    "api.bigdatacloud.net": 10.0,
+    "docs.google.com": 5.0,
+}
+
+
+class TokenBucket:
+    """Lets through `rate` requests per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is free."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def _build_session():
+    session = requests.Session()
+    # Keep-alive connections are reused per host; retries are done in request() so they also wait for the rate limiter
+    adapter = HTTPAdapter(pool_connections=len(HOST_RATE_LIMITS) + 4, pool_maxsize=POOL_SIZE_PER_HOST, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = _build_session()
+_rate_limiters = {host: TokenBucket(rate) for host, rate in HOST_RATE_LIMITS.items()}
+
+
+def share_rate_limits(processes):
+    """
+    Divides every host's rate limit between processes running at once, so the upstreams
+    see the same total request rate however many batch processes there are.
+    """
+    for host, rate in HOST_RATE_LIMITS.items():
+        _rate_limiters[host] = TokenBucket(rate / max(processes, 1))
+
+
+def _retry_delay(attempt, response):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), 60.0)
+    # Exponential backoff with a little jitter, so parallel callers do not retry in lockstep
+    return BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random() / 4)
+
+
+def request(method, url, **kwargs):
+    """
+    Sends a request through the shared session with a default timeout,
+    the upstream's rate limit, and retries with exponential backoff on
+    connection errors, timeouts, 429 and 5xx answers.
+    After the last attempt the response is returned as is, so callers still use raise_for_status().
+    With stream=True the body is left unread, and the caller records its size with metrics.record_payload().
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS))
+    rate_limiter = _rate_limiters.get(urlsplit(url).hostname)
+
+    for attempt in range(MAX_RETRIES + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(attempt, None))
+            continue
+        if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+            if not kwargs.get("stream"):
+                metrics.record_payload(len(response.content))
+            return response
+        response.close()
+        time.sleep(_retry_delay(attempt, response))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
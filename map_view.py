@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+import pydeck as pdk
+import streamlit as st
+
+# --- Map Settings ---
+MAP_STYLE = os.getenv("MAP_STYLE", "https://basemaps.cartocdn.com/gl/voyager-gl-style/style.json")
+# One small image with every marker. pydeck embeds a local file in the map JSON, so the browser
+# does not fetch any icon; an http(s) URL can be given instead
+ICON_ATLAS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "map_icons.png")
+ICON_ATLAS = os.getenv("MAP_ICON_ATLAS", ICON_ATLAS_PATH)
+ICON_SIZE = 64
+ICON_COLORS = {"address": (220, 53, 69), "poi": (37, 99, 235)}
+ICON_MAPPING = {
+    name: {"x": number * ICON_SIZE, "y": 0, "width": ICON_SIZE, "height": ICON_SIZE, "anchorY": ICON_SIZE, "mask": False}
+    for number, name in enumerate(ICON_COLORS)
+}
+# From this many POIs on they are drawn as circles, so the map stays light however many there are
+SCATTERPLOT_MIN_POIS = int(os.getenv("MAP_SCATTERPLOT_MIN_POIS", 200))
+DECK_CACHE_MAX_ENTRIES = 256
+# 6 decimal places is about 10 centimetres
+COORDINATE_DECIMALS = 6
+TOOLTIP = {"text": "{name}"}
+# Region cells, coloured like the class banners of a single analysis
+CLASS_COLORS = {"REDUZIDO": (40, 167, 69, 150), "MÉDIO": (255, 193, 7, 150), "ALTO": (220, 53, 69, 150)}
+REGION_TOOLTIP = {"text": "{c}\nPontuação: {s}"}
+
+
+class PrebuiltDeck:
+    """A map already turned into JSON. st.pydeck_chart only calls to_json() and reads the tooltip from it."""
+
+    def __init__(self, deck_json, tooltip=TOOLTIP):
+        self.deck_json = deck_json
+        self._tooltip = tooltip
+
+    def to_json(self):
+        return self.deck_json
+
+
+def _point_records(names, lats, lons, icon=None):
+    # Short keys and rounded coordinates keep the JSON small
+    positions = zip(np.round(lons, COORDINATE_DECIMALS).tolist(), np.round(lats, COORDINATE_DECIMALS).tolist())
+    if icon is None:
+        return [{"name": name, "p": [lon, lat]} for name, (lon, lat) in zip(names, positions)]
+    return [{"name": name, "p": [lon, lat], "icon": icon} for name, (lon, lat) in zip(names, positions)]
+
+
+def _icon_layer(records, size_scale):
+    return pdk.Layer(
+        "IconLayer", data=records, icon_atlas=ICON_ATLAS, icon_mapping=ICON_MAPPING,
+        get_icon="icon", get_position="p", get_size=4, size_scale=size_scale, pickable=True,
+    )
+
+
+def build_deck(lat, lon, pois=None):
+    """The map of one address and, when given, its PoiColumns."""
+    layers = [_icon_layer(_point_records(["Morada Analisada"], [lat], [lon], icon="address"), 15)]
+
+    if pois is not None and pois.count:
+        names = pois.names.tolist()
+        if pois.count >= SCATTERPLOT_MIN_POIS:
+            layers.append(pdk.Layer(
+                "ScatterplotLayer", data=_point_records(names, pois.lats, pois.lons), get_position="p",
+                get_fill_color=list(ICON_COLORS["poi"]), get_radius=6, radius_min_pixels=3, pickable=True,
+            ))
+        else:
+            layers.append(_icon_layer(_point_records(names, pois.lats, pois.lons, icon="poi"), 10))
+
+    return pdk.Deck(
+        map_style=MAP_STYLE,
+        initial_view_state=pdk.ViewState(latitude=float(lat), longitude=float(lon), zoom=15, pitch=0, bearing=0),
+        layers=layers,
+        tooltip=TOOLTIP,
+    )
+
+
+@st.cache_data(max_entries=DECK_CACHE_MAX_ENTRIES, show_spinner=False)
+def deck_json(map_key, lat, lon, _pois):
+    """The map JSON of one result. The POI arrays are not hashed; map_key must change when they do."""
+    return build_deck(lat, lon, _pois).to_json()
+
+
+def show_map(lat, lon, pois=None, map_key=None):
+    """
+    Draws the map. With a map_key the JSON is built once and reused on every rerun and session,
+    and since the element is identified by its JSON, the browser keeps the map it already has.
+    """
+    if map_key is None:
+        st.pydeck_chart(build_deck(lat, lon, pois))
+    else:
+        st.pydeck_chart(PrebuiltDeck(deck_json(map_key, float(lat), float(lon), pois)))
+
+
+def build_region_deck(region):
+    """
+    The hexagon map of a RegionResult. Each cell is one flat six-sided column, so the browser
+    only receives the cell centres, scores and colours, not polygons.
+    """
+    cells = region.cells
+    records = [
+        {"p": [lon, lat], "s": round(score, 2), "c": final_class, "f": list(CLASS_COLORS[final_class])}
+        for lon, lat, score, final_class in zip(
+            np.round(cells["lon"].to_numpy(), COORDINATE_DECIMALS).tolist(), np.round(cells["lat"].to_numpy(), COORDINATE_DECIMALS).tolist(),
+            cells["score"].tolist(), cells["final_class"].tolist(),
+        )
+    ]
+    # Hexagons touching their neighbours: the distance from the centre to a corner is cell / sqrt(3)
+    layer = pdk.Layer(
+        "ColumnLayer", data=records, get_position="p", get_fill_color="f", radius=region.cell_meters / np.sqrt(3),
+        disk_resolution=6, extruded=False, pickable=True,
+    )
+    lon_span = max(float(cells["lon"].max() - cells["lon"].min()), 0.01)
+    return pdk.Deck(
+        map_style=MAP_STYLE,
+        initial_view_state=pdk.ViewState(
+            latitude=float(cells["lat"].mean()), longitude=float(cells["lon"].mean()),
+            zoom=float(np.clip(np.log2(360 / lon_span), 8, 14)), pitch=0, bearing=0,
+        ),
+        layers=[layer],
+        tooltip=REGION_TOOLTIP,
+    )
+
+
+@st.cache_data(max_entries=DECK_CACHE_MAX_ENTRIES, show_spinner=False)
+def region_deck_json(map_key, _region):
+    """
+    The map JSON of one region, without the indentation pydeck adds, since thousands of cells would triple its size.
+    The cells are not hashed; map_key must change when they do.
+    """
+    return json.dumps(json.loads(build_region_deck(_region).to_json()), separators=(",", ":"), ensure_ascii=False)
+
+
+def show_region_map(region, map_key=None):
+    if map_key is None:
+        st.pydeck_chart(build_region_deck(region))
+    else:
+        st.pydeck_chart(PrebuiltDeck(region_deck_json(map_key, region), REGION_TOOLTIP))
+
+
+# --- Icon Atlas ---
+def draw_pin(color):
+    """A map pin as an ICON_SIZE x ICON_SIZE RGBA array."""
+    y, x = np.mgrid[0:ICON_SIZE, 0:ICON_SIZE] + 0.5
+    center_x, center_y, radius = ICON_SIZE / 2, ICON_SIZE * 0.36, ICON_SIZE * 0.28
+    distance = np.hypot(x - center_x, y - center_y)
+    # The tail narrows from the circle down to the tip at the bottom edge
+    tail_half_width = radius * np.clip((ICON_SIZE - y) / (ICON_SIZE - center_y), 0, 1) * 0.8
+    inside = (distance <= radius) | ((y >= center_y) & (np.abs(x - center_x) <= tail_half_width))
+
+    pixels = np.zeros((ICON_SIZE, ICON_SIZE, 4), dtype=np.uint8)
+    pixels[inside] = (*color, 255)
+    pixels[inside & (distance >= radius - 2.5) & (y < center_y + radius * 0.6)] = (*(channel // 2 for channel in color), 255)
+    pixels[distance <= radius * 0.35] = (255, 255, 255, 255)
+    return pixels
+
+
+def write_png(path, pixels):
+    """Writes an RGBA array as a PNG file, without an imaging library."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    height, width = pixels.shape[:2]
+    rows = b"".join(b"\x00" + row.tobytes() for row in pixels)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as png_file:
+        png_file.write(b"\x89PNG\r\n\x1a\n")
+        png_file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        png_file.write(chunk(b"IDAT", zlib.compress(rows, 9)))
+        png_file.write(chunk(b"IEND", b""))
+
+
+def build_icon_atlas(path=ICON_ATLAS_PATH):
+    write_png(path, np.concatenate([draw_pin(color) for color in ICON_COLORS.values()], axis=1))
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ferramentas do mapa de resultados.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    atlas_parser = commands.add_parser("atlas", help="Gera a imagem com os marcadores do mapa.")
+    atlas_parser.add_argument("--output", default=ICON_ATLAS_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "atlas":
+        build_icon_atlas(args.output)
+        print(f"Marcadores gravados em {args.output}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Metrics Settings ---
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_FILE = os.getenv("METRICS_FILE")
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("analysis.metrics")
+
+# The trace of the analysis running in this context, and the stage currently being timed
+_current_trace = contextvars.ContextVar("analysis_trace", default=None)
+_current_span = contextvars.ContextVar("analysis_span", default=None)
+
+
+class AnalysisTrace:
+    """The timed stages of one analysis, in the order they finished."""
+
+    def __init__(self, address=None):
+        self.address = address
+        self.spans = []
+        self.total_ms = None
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+
+class MetricsRegistry:
+    """Process-wide latency histograms, cache counters and payload sizes per stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bucket_counts = {}
+        self.duration_sums = {}
+        self.duration_counts = {}
+        self.cache_counts = {}
+        self.payload_bytes = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            buckets = self.bucket_counts.setdefault(stage, [0] * len(LATENCY_BUCKETS))
+            for number, upper_bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= upper_bound:
+                    buckets[number] += 1
+            self.duration_sums[stage] = self.duration_sums.get(stage, 0.0) + seconds
+            self.duration_counts[stage] = self.duration_counts.get(stage, 0) + 1
+
+    def count_cache(self, stage, hit):
+        key = (stage, "hit" if hit else "miss")
+        with self.lock:
+            self.cache_counts[key] = self.cache_counts.get(key, 0) + 1
+
+    def add_payload(self, stage, size):
+        with self.lock:
+            self.payload_bytes[stage] = self.payload_bytes.get(stage, 0) + size
+
+    def render_prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self.lock:
+            lines = [
+                "# HELP analysis_stage_seconds Time spent in each analysis stage.",
+                "# TYPE analysis_stage_seconds histogram",
+            ]
+            for stage in sorted(self.duration_counts):
+                for upper_bound, count in zip(LATENCY_BUCKETS, self.bucket_counts[stage]):
+                    lines.append(f'analysis_stage_seconds_bucket{{stage="{stage}",le="{upper_bound}"}} {count}')
+                lines.append(f'analysis_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {self.duration_counts[stage]}')
+                lines.append(f'analysis_stage_seconds_sum{{stage="{stage}"}} {self.duration_sums[stage]:.6f}')
+                lines.append(f'analysis_stage_seconds_count{{stage="{stage}"}} {self.duration_counts[stage]}')
+
+            lines += ["# HELP analysis_cache_requests_total Cache lookups per stage and result.", "# TYPE analysis_cache_requests_total counter"]
+            for (stage, result), count in sorted(self.cache_counts.items()):
+                lines.append(f'analysis_cache_requests_total{{stage="{stage}",result="{result}"}} {count}')
+
+            lines += ["# HELP analysis_payload_bytes_total Bytes received from upstream services per stage.", "# TYPE analysis_payload_bytes_total counter"]
+            for stage, size in sorted(self.payload_bytes.items()):
+                lines.append(f'analysis_payload_bytes_total{{stage="{stage}"}} {size}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def enable_structured_logs(level=logging.INFO):
+    """Prints the metrics log lines (one JSON object per line) to stderr."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+# --- Recording ---
+@contextmanager
+def stage(name):
+    """Times a block as one stage of the current analysis, and of the process-wide metrics."""
+    span = {"stage": name, "ms": None, "cache": None, "bytes": 0}
+    token = _current_span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        seconds = time.perf_counter() - start
+        _current_span.reset(token)
+        span["ms"] = round(seconds * 1000, 2)
+        registry.observe(name, seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(span)
+        logger.info(json.dumps({"event": "stage", **span}, ensure_ascii=False))
+
+
+def timed(name):
+    """Decorator version of stage()."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(hit):
+    """Marks the running stage as answered from a cache (hit) or not (miss)."""
+    span = _current_span.get()
+    if span is not None:
+        # A stage may consult a cache more than once; any miss makes it a miss
+        span["cache"] = "miss" if span["cache"] == "miss" or not hit else "hit"
+        registry.count_cache(span["stage"], hit)
+
+
+def record_payload(size):
+    """Adds the size of an upstream response to the running stage."""
+    span = _current_span.get()
+    if span is not None:
+        span["bytes"] += size
+        registry.add_payload(span["stage"], size)
+
+
+@contextmanager
+def tracing(trace):
+    """
+    Collects the stages run inside the block (including in threads started with copy_context) into trace.
+    Inside a block that already traces the same trace, it only runs the inner block.
+    """
+    if _current_trace.get() is trace:
+        yield trace
+        return
+    token = _current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.total_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(json.dumps({"event": "analysis", "total_ms": trace.total_ms, "stages": {span["stage"]: span["ms"] for span in trace.spans}}, ensure_ascii=False))
+        write_metrics_file()
+
+
+# --- Exporters ---
+def write_metrics_file(path=METRICS_FILE):
+    """Writes the metrics to a file (e.g. for the node_exporter textfile collector), when a path is configured."""
+    if not path:
+        return
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(registry.render_prometheus())
+    os.replace(temp_path, path)
+
+
+_metrics_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves /metrics on the given port in a background thread. Calling it again does nothing."""
+    global _metrics_server
+    if not port:
+        return None
+    with _server_lock:
+        if _metrics_server is None:
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    found = self.path.split("?")[0] == "/metrics"
+                    body = registry.render_prometheus().encode("utf-8") if found else b""
+                    self.send_response(200 if found else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True, name="metrics-server").start()
+    return _metrics_server
@@ -0,0 +1,191 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import threading
+
+import numpy as np
+
+from population_data import normalize_municipality
+
+# --- Municipality Boundaries Settings ---
+MUNICIPALITY_BOUNDARIES_PATH = os.getenv("MUNICIPALITY_BOUNDARIES_PATH", os.path.join("data", "concelhos.geojson"))
+# Grid cells of 0.05 degrees (about 5 km); each one lists the polygons whose bounding box touches it
+GRID_CELL_DEGREES = 0.05
+# CAOP exports name these attributes differently depending on the year and format
+NAME_FIELDS = ("concelho", "municipio", "município", "name_2", "name")
+CODE_FIELDS = ("dico", "codigo", "código", "cod_concelho", "id")
+# Largest points x edges matrix built at once by resolve_many
+MAX_MATRIX_CELLS = 5_000_000
+
+
+def _find_field(properties, candidates):
+    lower_properties = {key.lower(): value for key, value in properties.items()}
+    for field in candidates:
+        if lower_properties.get(field) not in (None, ""):
+            return str(lower_properties[field])
+    return None
+
+
+def _points_in_ring(xs, ys, ring):
+    """Even-odd ray casting of many points against one ring. Returns how many edges each point's ray crosses."""
+    x1, y1, x2, y2 = ring
+    with np.errstate(divide="ignore", invalid="ignore"):
+        straddles = (y1 > ys[:, None]) != (y2 > ys[:, None])
+        crossing_x = (x2 - x1) * (ys[:, None] - y1) / (y2 - y1) + x1
+        return np.count_nonzero(straddles & (xs[:, None] < crossing_x), axis=1)
+
+
+class MunicipalityPolygon:
+    """One polygon of a municipality, with its rings stored as edge arrays."""
+
+    def __init__(self, name, code, rings):
+        self.name = name
+        self.code = code
+        self.rings = []
+        for ring in rings:
+            coords = np.asarray(ring, dtype=np.float64)[:, :2]
+            previous = np.roll(coords, 1, axis=0)
+            self.rings.append((previous[:, 0], previous[:, 1], coords[:, 0], coords[:, 1]))
+        outer = np.asarray(rings[0], dtype=np.float64)
+        self.min_lon, self.min_lat = outer[:, 0].min(), outer[:, 1].min()
+        self.max_lon, self.max_lat = outer[:, 0].max(), outer[:, 1].max()
+        self.edge_count = sum(len(ring[0]) for ring in self.rings)
+
+    def contains(self, lons, lats):
+        """Boolean array telling which points are inside (holes are handled by the even-odd rule)."""
+        crossings = np.zeros(len(lons), dtype=np.int64)
+        for ring in self.rings:
+            crossings += _points_in_ring(lons, lats, ring)
+        return crossings % 2 == 1
+
+
+class MunicipalityResolver:
+    """
+    Maps coordinates to the municipality (concelho) that contains them,
+    using the official CAOP boundaries and a grid of bounding boxes so only
+    a handful of polygons are tested per point.
+    """
+
+    def __init__(self, polygons):
+        self.polygons = polygons
+        self.cells = {}
+        for number, polygon in enumerate(polygons):
+            for row in range(self._cell(polygon.min_lat), self._cell(polygon.max_lat) + 1):
+                for col in range(self._cell(polygon.min_lon), self._cell(polygon.max_lon) + 1):
+                    self.cells.setdefault((row, col), []).append(number)
+
+    @staticmethod
+    def _cell(value):
+        return math.floor(value / GRID_CELL_DEGREES)
+
+    @classmethod
+    def from_features(cls, features):
+        polygons = []
+        for properties, geometry in features:
+            name = _find_field(properties, NAME_FIELDS)
+            if not name or not geometry:
+                continue
+            code = _find_field(properties, CODE_FIELDS)
+            if geometry["type"] == "Polygon":
+                parts = [geometry["coordinates"]]
+            elif geometry["type"] == "MultiPolygon":
+                parts = geometry["coordinates"]
+            else:
+                continue
+            polygons.extend(MunicipalityPolygon(name, code, rings) for rings in parts if rings)
+        return cls(polygons)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a GeoJSON file, or a shapefile when the optional pyshp package is installed. Coordinates must be WGS84."""
+        if path.lower().endswith(".shp"):
+            try:
+                import shapefile
+            except ImportError:
+                raise ImportError("Para ler shapefiles instale o pacote 'pyshp' (pip install pyshp).")
+            with shapefile.Reader(path) as reader:
+                features = [(record.as_dict(), shape.__geo_interface__) for shape, record in zip(reader.iterShapes(), reader.iterRecords())]
+        else:
+            with open(path, encoding="utf-8") as geojson_file:
+                features = [(feature.get("properties") or {}, feature.get("geometry")) for feature in json.load(geojson_file).get("features", [])]
+        return cls.from_features(features)
+
+    def names(self):
+        """Every municipality name, sorted."""
+        return sorted({polygon.name for polygon in self.polygons})
+
+    def polygons_of(self, name):
+        """The polygons of the municipality called name (case and accents ignored)."""
+        wanted = normalize_municipality(name)
+        return [polygon for polygon in self.polygons if normalize_municipality(polygon.name) == wanted]
+
+    def resolve(self, lat, lon):
+        """Returns (name, code) of the municipality containing the point, or (None, None)."""
+        lats, lons = np.array([lat], dtype=np.float64), np.array([lon], dtype=np.float64)
+        for number in self.cells.get((self._cell(lat), self._cell(lon)), []):
+            polygon = self.polygons[number]
+            if polygon.min_lat <= lat <= polygon.max_lat and polygon.min_lon <= lon <= polygon.max_lon and polygon.contains(lons, lats)[0]:
+                return polygon.name, polygon.code
+        return None, None
+
+    def resolve_many(self, lats, lons):
+        """Resolves arrays of points at once. Returns two lists (names, codes) with None where no polygon matched."""
+        lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        names, codes = [None] * len(lats), [None] * len(lats)
+        unresolved = np.ones(len(lats), dtype=bool)
+        for polygon in self.polygons:
+            in_box = np.flatnonzero(unresolved & (lats >= polygon.min_lat) & (lats <= polygon.max_lat) & (lons >= polygon.min_lon) & (lons <= polygon.max_lon))
+            chunk_size = max(1, MAX_MATRIX_CELLS // max(polygon.edge_count, 1))
+            for start in range(0, len(in_box), chunk_size):
+                chunk = in_box[start:start + chunk_size]
+                for i in chunk[polygon.contains(lons[chunk], lats[chunk])]:
+                    names[i], codes[i] = polygon.name, polygon.code
+                    unresolved[i] = False
+        return names, codes
+
+
+_loaded_resolver = None
+_load_lock = threading.Lock()
+
+
+def get_municipality_resolver(path=MUNICIPALITY_BOUNDARIES_PATH):
+    """Returns the local resolver, or None when no boundaries file is available."""
+    global _loaded_resolver
+    if _loaded_resolver is None and path and os.path.exists(path):
+        with _load_lock:
+            if _loaded_resolver is None:
+                _loaded_resolver = MunicipalityResolver.load(path)
+    return _loaded_resolver
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Determina o concelho de coordenadas a partir dos limites oficiais (CAOP).")
+    parser.add_argument("points", nargs="?", help="Ficheiro CSV com colunas lat e lon. Sem ficheiro, use --lat e --lon.")
+    parser.add_argument("--lat", type=float)
+    parser.add_argument("--lon", type=float)
+    parser.add_argument("--boundaries", default=MUNICIPALITY_BOUNDARIES_PATH)
+    args = parser.parse_args(argv)
+
+    resolver = MunicipalityResolver.load(args.boundaries)
+    if args.points:
+        with open(args.points, newline="", encoding="utf-8-sig") as points_file:
+            rows = list(csv.DictReader(points_file))
+        names, codes = resolver.resolve_many([float(row["lat"]) for row in rows], [float(row["lon"]) for row in rows])
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["lat", "lon", "municipality", "code"])
+        for row, name, code in zip(rows, names, codes):
+            writer.writerow([row["lat"], row["lon"], name, code])
+    elif args.lat is not None and args.lon is not None:
+        name, code = resolver.resolve(args.lat, args.lon)
+        print(f"{name} ({code})" if name else "Nenhum concelho encontrado para estas coordenadas.")
+    else:
+        parser.error("Indique um ficheiro de pontos ou --lat e --lon.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+
+import numpy as np
+
+from analysis_result import PoiColumns
+
+# --- POI Index Settings ---
+POI_INDEX_PATH = os.getenv("POI_INDEX_PATH", os.path.join("data", "poi_index.npz"))
+# Grid cells of 0.01 degrees are about 1 km, so a 500 m query only touches a few cells
+GRID_CELL_DEGREES = 0.01
+EARTH_RADIUS_METERS = 6_371_000
+
+
+def haversine_meters(lat, lon, lats, lons):
+    """Distance in metres from one point to arrays of points."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+
+def format_category(amenity):
+    return amenity.replace('_', ' ').capitalize()
+
+
+def poi_columns_around(lat, lon, pois):
+    """PoiColumns of (name, category, lat, lon) tuples, with their distances in metres to (lat, lon)."""
+    names, categories, lats, lons = zip(*pois) if pois else ((), (), (), ())
+    lats, lons = np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64)
+    return PoiColumns.from_lists(names, categories, lats, lons, haversine_meters(lat, lon, lats, lons))
+
+
+# --- Reading OSM Extracts ---
+def _bbox_center(coordinates):
+    """Centre of the bounding box, the same point Overpass returns with 'out center'."""
+    lons = [point[0] for point in coordinates]
+    lats = [point[1] for point in coordinates]
+    return (min(lats) + max(lats)) / 2, (min(lons) + max(lons)) / 2
+
+
+def _flatten_coordinates(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [coordinates]
+    points = []
+    for part in coordinates:
+        points.extend(_flatten_coordinates(part))
+    return points
+
+
+def read_geojson_pois(geojson_path):
+    """Yields (name, amenity, lat, lon) for every named amenity in a GeoJSON export."""
+    with open(geojson_path, encoding="utf-8") as geojson_file:
+        features = json.load(geojson_file).get("features", [])
+    for feature in features:
+        properties = feature.get("properties") or {}
+        # osmtogeojson puts the OSM tags straight in properties, other tools nest them under 'tags'
+        tags = properties.get("tags") if isinstance(properties.get("tags"), dict) else properties
+        name, amenity = tags.get("name"), tags.get("amenity")
+        geometry = feature.get("geometry") or {}
+        if not name or not amenity or not geometry.get("coordinates"):
+            continue
+        if geometry.get("type") == "Point":
+            lon, lat = geometry["coordinates"][:2]
+        else:
+            lat, lon = _bbox_center(_flatten_coordinates(geometry["coordinates"]))
+        yield name, amenity, lat, lon
+
+
+def read_pbf_pois(pbf_path):
+    """Yields (name, amenity, lat, lon) for every named amenity node, way and multipolygon in an .osm.pbf file."""
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Para ler ficheiros .osm.pbf instale o pacote 'osmium' (pip install osmium).")
+
+    pois = []
+
+    class AmenityHandler(osmium.SimpleHandler):
+        def node(self, n):
+            if "amenity" in n.tags and "name" in n.tags:
+                pois.append((n.tags["name"], n.tags["amenity"], n.location.lat, n.location.lon))
+
+        def way(self, w):
+            if "amenity" in w.tags and "name" in w.tags:
+                points = [(node.location.lon, node.location.lat) for node in w.nodes if node.location.valid()]
+                if points:
+                    pois.append((w.tags["name"], w.tags["amenity"], *_bbox_center(points)))
+
+        def area(self, a):
+            # Ways are already handled above, so only areas built from relations are added here
+            if a.from_way() or "amenity" not in a.tags or "name" not in a.tags:
+                return
+            points = [(node.lon, node.lat) for ring in a.outer_rings() for node in ring]
+            if points:
+                pois.append((a.tags["name"], a.tags["amenity"], *_bbox_center(points)))
+
+    AmenityHandler().apply_file(pbf_path, locations=True)
+    return pois
+
+
+def read_overpass_pois(elements):
+    """Yields (name, amenity, lat, lon) for every named amenity among Overpass 'out center' elements, once per coordinate."""
+    unique_poi_coords = set()
+    for el in elements:
+        tags = el.get('tags', {})
+        name = tags.get('name')
+        amenity = tags.get('amenity')
+        if name and amenity:
+            poi_lat, poi_lon = (None, None)
+            if el['type'] == 'node':
+                poi_lat, poi_lon = el.get('lat'), el.get('lon')
+            elif 'center' in el:
+                poi_lat, poi_lon = el['center'].get('lat'), el['center'].get('lon')
+
+            if poi_lat and poi_lon and (poi_lat, poi_lon) not in unique_poi_coords:
+                unique_poi_coords.add((poi_lat, poi_lon))
+                yield name, amenity, poi_lat, poi_lon
+
+
+# --- Spatial Index ---
+class PoiIndex:
+    """
+    Named amenities stored as NumPy arrays, sorted by grid cell.
+    A radius query reads the few cells around the point and measures the
+    distance to the POIs in them, without any network call.
+    """
+
+    def __init__(self, lats, lons, names, category_codes, categories):
+        self.lats = lats
+        self.lons = lons
+        self.names = names
+        self.category_codes = category_codes
+        self.categories = categories
+        # The names shown on the page, e.g. 'fast_food' -> 'Fast food'
+        self.category_labels = np.array([format_category(str(category)) for category in categories], dtype=np.str_)
+        self.cells = {}
+        if len(lats):
+            cell_rows = np.floor(lats / GRID_CELL_DEGREES).astype(np.int64)
+            cell_cols = np.floor(lons / GRID_CELL_DEGREES).astype(np.int64)
+            # The points are already sorted by cell, so each cell is one contiguous slice
+            changes = np.flatnonzero((np.diff(cell_rows) != 0) | (np.diff(cell_cols) != 0)) + 1
+            starts = np.concatenate(([0], changes))
+            ends = np.concatenate((changes, [len(lats)]))
+            for start, end in zip(starts, ends):
+                self.cells[(int(cell_rows[start]), int(cell_cols[start]))] = (int(start), int(end))
+
+    @classmethod
+    def from_pois(cls, pois):
+        """Builds the index from (name, amenity, lat, lon) tuples, dropping POIs with repeated coordinates."""
+        unique = {}
+        for name, amenity, lat, lon in pois:
+            if lat and lon:
+                unique.setdefault((float(lat), float(lon)), (name, amenity))
+
+        categories = sorted({amenity for name, amenity in unique.values()})
+        category_numbers = {amenity: number for number, amenity in enumerate(categories)}
+        lats = np.array([lat for lat, lon in unique], dtype=np.float64)
+        lons = np.array([lon for lat, lon in unique], dtype=np.float64)
+        names = np.array([name for name, amenity in unique.values()], dtype=np.str_)
+        category_codes = np.array([category_numbers[amenity] for name, amenity in unique.values()], dtype=np.int32)
+
+        order = np.lexsort((np.floor(lons / GRID_CELL_DEGREES), np.floor(lats / GRID_CELL_DEGREES)))
+        return cls(lats[order], lons[order], names[order], category_codes[order], np.array(categories, dtype=np.str_))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, lats=self.lats, lons=self.lons, names=self.names, category_codes=self.category_codes, categories=self.categories)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["lats"], data["lons"], data["names"], data["category_codes"], data["categories"])
+
+    def query_indices(self, lat, lon, radius):
+        """Positions of the POIs within radius metres of (lat, lon), and their distances in metres."""
+        lat_margin = radius / 111_320
+        lon_margin = radius / (111_320 * max(math.cos(math.radians(lat)), 0.01))
+        min_row, max_row = math.floor((lat - lat_margin) / GRID_CELL_DEGREES), math.floor((lat + lat_margin) / GRID_CELL_DEGREES)
+        min_col, max_col = math.floor((lon - lon_margin) / GRID_CELL_DEGREES), math.floor((lon + lon_margin) / GRID_CELL_DEGREES)
+
+        slices = [self.cells[(row, col)] for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1) if (row, col) in self.cells]
+        if not slices:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        candidates = np.concatenate([np.arange(start, end) for start, end in slices])
+        distances = haversine_meters(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distances <= radius
+        return candidates[inside], distances[inside]
+
+    def query(self, lat, lon, radius):
+        """Returns the PoiColumns within radius metres, in the same shape as the Overpass lookup."""
+        found, distances = self.query_indices(lat, lon, radius)
+        return PoiColumns(self.names[found], self.category_labels[self.category_codes[found]], self.lats[found], self.lons[found], distances)
+
+
+_loaded_index = None
+_load_lock = threading.Lock()
+
+
+def get_poi_index(path=POI_INDEX_PATH):
+    """Returns the local POI index, or None when no index file has been built."""
+    global _loaded_index
+    if _loaded_index is None and path and os.path.exists(path):
+        with _load_lock:
+            if _loaded_index is None:
+                _loaded_index = PoiIndex.load(path)
+    return _loaded_index
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Índice local de pontos de interesse (POIs) a partir de um extrato OSM.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Cria o índice a partir de um ficheiro .osm.pbf ou .geojson.")
+    build_parser.add_argument("source")
+    build_parser.add_argument("--output", default=POI_INDEX_PATH)
+    query_parser = commands.add_parser("query", help="Conta os POIs à volta de um ponto.")
+    query_parser.add_argument("lat", type=float)
+    query_parser.add_argument("lon", type=float)
+    query_parser.add_argument("--radius", type=float, default=500)
+    query_parser.add_argument("--index", default=POI_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        pois = read_pbf_pois(args.source) if args.source.endswith(".pbf") else read_geojson_pois(args.source)
+        index = PoiIndex.from_pois(pois)
+        index.save(args.output)
+        print(f"Índice criado em {args.output} com {len(index.lats)} POIs.")
+    elif args.command == "query":
+        pois = PoiIndex.load(args.index).query(args.lat, args.lon, args.radius)
+        print(f"{pois.count} POIs num raio de {args.radius:.0f}m")
+        for category, count in sorted((pois.category_counts() or {}).items()):
+            print(f"- {category}: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
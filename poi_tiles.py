@@ -0,0 +1,287 @@
+import argparse
+import codecs
+import json
+import math
+import os
+import sys
+import threading
+
+import requests
+
+import http_client
+import metrics
+from sqlite_cache import SqliteCache
+from poi_index import format_category, poi_columns_around, read_overpass_pois
+from single_flight import SingleFlight
+
+# --- Overpass Settings ---
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+# The answer is read and parsed in pieces of this size, so a dense city centre never sits whole in memory
+OVERPASS_CHUNK_BYTES = 64 * 1024
+
+# --- POI Tile Cache Settings ---
+# An empty path turns the tile cache off, and every analysis asks Overpass around its own point
+POI_TILE_CACHE_PATH = os.getenv("POI_TILE_CACHE_PATH", os.path.join("data", "poi_tiles.sqlite"))
+POI_TILE_TTL_SECONDS = int(os.getenv("POI_TILE_TTL_SECONDS", 7 * 24 * 60 * 60))
+POI_TILE_MAX_ENTRIES = int(os.getenv("POI_TILE_MAX_ENTRIES", 200_000))
+# Zoom 15 slippy map tiles are about 1.2 km wide at the equator and 0.9 km in Lisbon
+TILE_ZOOM = 15
+METERS_PER_DEGREE_LAT = 111_320
+# Tiles fetched together by the prewarm command, so each Overpass request covers a block of them
+PREWARM_BLOCK_TILES = 4
+
+
+# --- Tile Maths ---
+def tile_of(lat, lon, zoom=TILE_ZOOM):
+    """(x, y) of the slippy map tile holding the point."""
+    tiles = 2 ** zoom
+    x = int((lon + 180) / 360 * tiles)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * tiles)
+    return min(max(x, 0), tiles - 1), min(max(y, 0), tiles - 1)
+
+
+def tile_bounds(x, y, zoom=TILE_ZOOM):
+    """(south, west, north, east) of a tile, in degrees."""
+    tiles = 2 ** zoom
+
+    def tile_lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+    return tile_lat(y + 1), x / tiles * 360 - 180, tile_lat(y), (x + 1) / tiles * 360 - 180
+
+
+def tiles_in_bbox(south, west, north, east, zoom=TILE_ZOOM):
+    """Every tile touching the box, row by row."""
+    min_x, min_y = tile_of(north, west, zoom)
+    max_x, max_y = tile_of(south, east, zoom)
+    return [(x, y) for y in range(min_y, max_y + 1) for x in range(min_x, max_x + 1)]
+
+
+def tiles_around(lat, lon, radius, zoom=TILE_ZOOM):
+    """The tiles covering the circle of radius metres around the point."""
+    lat_margin = radius / METERS_PER_DEGREE_LAT
+    lon_margin = radius / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return tiles_in_bbox(lat - lat_margin, lon - lon_margin, lat + lat_margin, lon + lon_margin, zoom)
+
+
+# --- Overpass ---
+def overpass_query(area):
+    """
+    Named amenities in area, an Overpass filter such as 'around:500,38.71,-9.14' or 's,w,n,e'.
+    Nodes come with their coordinates and tags; ways and relations with their tags and centre only,
+    without the node lists and members that 'out center' would also send.
+    """
+    return (
+        f'[out:json];node["amenity"]["name"]({area});out qt;'
+        f'(way["amenity"]["name"]({area});relation["amenity"]["name"]({area}););out tags center qt;'
+    )
+
+
+class OverpassError(requests.exceptions.RequestException):
+    """Overpass answered, but its 'remark' says the query failed (a timeout or out of memory), so the elements may be partial."""
+
+
+def iter_json_array(chunks, key="elements", other_fields=None):
+    """
+    Yields the items of the top-level array `key` of a JSON document given as byte chunks,
+    decoding one item at a time, so memory stays bounded by the largest item and not the document.
+    When other_fields is a dict, the rest of the document is read after the array and its other top-level fields put in it.
+    Raises requests.exceptions.InvalidJSONError, like Response.json(), when the array is missing or cut short.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    head, buffer, position = "", "", 0
+    in_array = False
+
+    for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        if not in_array:
+            start = buffer.find(f'"{key}"')
+            bracket = buffer.find("[", start) if start >= 0 else -1
+            if bracket < 0:
+                continue
+            head, buffer, in_array = buffer[:bracket + 1], buffer[bracket + 1:], True
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                if other_fields is not None:
+                    _read_other_fields(head, buffer[position:], chunks, text_decoder, key, other_fields)
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item goes on in the next chunk
+                break
+            yield item
+            position = end
+
+    if in_array:
+        raise requests.exceptions.InvalidJSONError("Resposta JSON incompleta.")
+    raise requests.exceptions.InvalidJSONError(f"A resposta não tem a lista '{key}'.")
+
+
+def _read_other_fields(head, tail, chunks, text_decoder, key, other_fields):
+    # The text around the array is small, so it is parsed whole with the array left empty
+    tail += "".join(text_decoder.decode(chunk) for chunk in chunks) + text_decoder.decode(b"", final=True)
+    try:
+        document = json.loads(head + tail)
+    except json.JSONDecodeError:
+        raise requests.exceptions.InvalidJSONError("Resposta JSON incompleta.")
+    document.pop(key, None)
+    other_fields.update(document)
+
+
+def fetch_overpass_pois(area):
+    """
+    (name, amenity, lat, lon) of the named amenities in area, read from Overpass as the answer streams in.
+    Raises OverpassError when Overpass reports that the query failed part way, so a partial answer is never used as complete.
+    """
+    response = http_client.post(OVERPASS_URL, data=overpass_query(area), stream=True)
+    try:
+        response.raise_for_status()
+        payload_size = 0
+
+        def counted_chunks():
+            nonlocal payload_size
+            for chunk in response.iter_content(chunk_size=OVERPASS_CHUNK_BYTES):
+                payload_size += len(chunk)
+                yield chunk
+
+        other_fields = {}
+        pois = list(read_overpass_pois(iter_json_array(counted_chunks(), other_fields=other_fields)))
+    finally:
+        response.close()
+    metrics.record_payload(payload_size)
+    if other_fields.get("remark"):
+        raise OverpassError(f"O Overpass não concluiu o pedido: {other_fields['remark']}")
+    return pois
+
+
+# --- Tile Cache ---
+class PoiTileCache:
+    """
+    Keeps the named amenities of each zoom 15 tile in a local SQLite file, for ttl_seconds.
+    A radius query merges the tiles covering the circle and filters them by distance, so nearby
+    addresses reuse the same tiles and Overpass is only asked for the tiles nobody has fetched yet.
+    """
+
+    def __init__(self, path=POI_TILE_CACHE_PATH, ttl_seconds=POI_TILE_TTL_SECONDS, max_entries=POI_TILE_MAX_ENTRIES):
+        self.tiles = SqliteCache(path, ttl_seconds, max_entries)
+        self.kind = f"z{TILE_ZOOM}"
+        # Concurrent analyses missing the same tiles share one Overpass request
+        self.fetches = SingleFlight()
+
+    def query(self, lat, lon, radius):
+        """PoiColumns of the POIs at most radius metres from the point."""
+        keys = [f"{x}/{y}" for x, y in tiles_around(lat, lon, radius)]
+        found = self.tiles.lookup_many(self.kind, keys)
+        missing = tuple(key for key in keys if key not in found)
+        metrics.record_cache(not missing)
+        if missing:
+            found.update(self.fetches.run(missing, lambda: self.fetch_tiles(missing)))
+
+        pois = [tuple(poi) for key in keys for poi in found[key]]
+        return poi_columns_around(lat, lon, pois).within(radius)
+
+    def fetch_tiles(self, keys):
+        """
+        Asks Overpass once for the box around the given tiles and stores each of them, empty ones included.
+        A failed or partial answer raises before anything is stored, so it is never kept as empty tiles.
+        Returns {key: [[name, category, lat, lon], ...]}.
+        """
+        tiles = [tuple(int(value) for value in key.split("/")) for key in keys]
+        bounds = [tile_bounds(x, y) for x, y in tiles]
+        south, west = min(b[0] for b in bounds), min(b[1] for b in bounds)
+        north, east = max(b[2] for b in bounds), max(b[3] for b in bounds)
+
+        # Each POI belongs to the tile holding its centre, so it is stored exactly once
+        fetched = {key: [] for key in keys}
+        for name, amenity, poi_lat, poi_lon in fetch_overpass_pois(f"{south},{west},{north},{east}"):
+            key = "%d/%d" % tile_of(poi_lat, poi_lon)
+            if key in fetched:
+                fetched[key].append([name, format_category(amenity), poi_lat, poi_lon])
+        self.tiles.store_many(self.kind, fetched)
+        return fetched
+
+    def prewarm(self, south, west, north, east, on_block=None):
+        """Fetches every tile of the box not cached yet, PREWARM_BLOCK_TILES x PREWARM_BLOCK_TILES tiles per request."""
+        tiles = tiles_in_bbox(south, west, north, east)
+        blocks = {}
+        for x, y in tiles:
+            blocks.setdefault((x // PREWARM_BLOCK_TILES, y // PREWARM_BLOCK_TILES), []).append(f"{x}/{y}")
+
+        requests_made = 0
+        for number, keys in enumerate(blocks.values(), start=1):
+            found = self.tiles.lookup_many(self.kind, keys)
+            missing = tuple(key for key in keys if key not in found)
+            if missing:
+                self.fetch_tiles(missing)
+                requests_made += 1
+            if on_block:
+                on_block(number, len(blocks), len(missing))
+        return requests_made
+
+    def pois_in_bbox(self, south, west, north, east):
+        """
+        (POIs, missing tile count) for the tiles touching the box, from the cache only; nothing is fetched.
+        Each POI is (name, category, lat, lon).
+        """
+        keys = [f"{x}/{y}" for x, y in tiles_in_bbox(south, west, north, east)]
+        found = self.tiles.lookup_many(self.kind, keys)
+        return [tuple(poi) for key in keys for poi in found.get(key, ())], len(keys) - len(found)
+
+    def stats(self):
+        return self.tiles.stats()
+
+
+_loaded_cache = None
+_load_lock = threading.Lock()
+
+
+def get_poi_tile_cache(path=POI_TILE_CACHE_PATH):
+    """Returns the shared tile cache, or None when POI_TILE_CACHE_PATH is empty."""
+    global _loaded_cache
+    if _loaded_cache is None and path:
+        with _load_lock:
+            if _loaded_cache is None:
+                _loaded_cache = PoiTileCache(path)
+    return _loaded_cache
+
+
+# --- Command Line ---
+def parse_bbox(text):
+    return tuple(float(value) for value in text.split(","))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache local de POIs por mosaicos (tiles) de zoom 15.")
+    parser.add_argument("--cache", default=POI_TILE_CACHE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    prewarm_parser = commands.add_parser("prewarm", help="Descarrega os POIs de todos os mosaicos de uma área.")
+    prewarm_parser.add_argument("bbox", type=parse_bbox, help="min_lat,min_lon,max_lat,max_lon")
+    commands.add_parser("stats", help="Mostra o número de mosaicos na cache.")
+    commands.add_parser("purge", help="Remove os mosaicos expirados.")
+    args = parser.parse_args(argv)
+
+    cache = PoiTileCache(args.cache)
+    if args.command == "prewarm":
+        def print_progress(number, total, missing):
+            print(f"[{number}/{total}] {missing} mosaicos descarregados")
+
+        print(f"{cache.prewarm(*args.bbox, on_block=print_progress)} pedidos feitos.")
+        print(cache.stats())
+    elif args.command == "stats":
+        print(cache.stats())
+    elif args.command == "purge":
+        print(f"{cache.tiles.remove_expired()} mosaicos expirados removidos.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
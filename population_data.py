@@ -0,0 +1,132 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+import unicodedata
+
+import requests
+
+import http_client
+import metrics
+
+# --- Population Data Settings ---
+POPULATION_CSV_URL = "https://docs.google.com/spreadsheets/d/e/2PACX-1vR0A79pNYNO4YD-jhyZ4baNjHsGZCsAyTgVlZgaoSGdKN_ehlS5fUnwmESyknqyy-Wf9-30OnjdCR3I/pub?gid=0&single=true&output=csv"
+POPULATION_SNAPSHOT_PATH = os.getenv("POPULATION_SNAPSHOT_PATH", os.path.join("data", "population_snapshot.csv"))
+POPULATION_TTL_SECONDS = int(os.getenv("POPULATION_TTL_SECONDS", 6 * 60 * 60))
+
+
+def normalize_municipality(name):
+    """Lower case, no accents and single spaces, so 'Évora ' and 'evora' match."""
+    if not name:
+        return ""
+    without_accents = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return " ".join(without_accents.lower().split())
+
+
+def parse_population_csv(csv_text):
+    """Builds {normalized municipality: population} from the sheet (column 1 = name, column 2 = population)."""
+    population_index = {}
+    for row in csv.reader(io.StringIO(csv_text)):
+        if len(row) > 2 and row[1]:
+            # Keep the first row for a name, like the old line-by-line scan did
+            population_index.setdefault(normalize_municipality(row[1]), row[2])
+    return population_index
+
+
+def sheet_version(csv_text):
+    """A short hash of the sheet contents, stored with results so later changes to the sheet can be found."""
+    return hashlib.sha1(csv_text.encode("utf-8")).hexdigest()[:12]
+
+
+class PopulationProvider:
+    """
+    Keeps the population sheet in memory as a dict.
+    The sheet is downloaded again only when the TTL has passed, and then with
+    ETag/Last-Modified headers so an unchanged sheet costs a 304 and no parsing.
+    If the download fails, the last snapshot saved on disk is used instead.
+    """
+
+    def __init__(self, csv_url=POPULATION_CSV_URL, snapshot_path=POPULATION_SNAPSHOT_PATH, ttl_seconds=POPULATION_TTL_SECONDS):
+        self.csv_url = csv_url
+        self.snapshot_path = snapshot_path
+        self.ttl_seconds = ttl_seconds
+        self.index = None
+        self.version = None
+        self.etag = None
+        self.last_modified = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def get_population(self, municipality):
+        """Returns the population string for the municipality, or None when it is not in the sheet."""
+        return self.get_index().get(normalize_municipality(municipality))
+
+    def get_index(self):
+        if self.index is not None and time.monotonic() - self.loaded_at < self.ttl_seconds:
+            metrics.record_cache(True)
+            return self.index
+        with self.lock:
+            # Another thread may have refreshed it while we were waiting for the lock
+            is_stale = self.index is None or time.monotonic() - self.loaded_at >= self.ttl_seconds
+            if is_stale:
+                self.refresh()
+            metrics.record_cache(not is_stale)
+            return self.index
+
+    def refresh(self):
+        headers = {}
+        if self.index is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+
+        try:
+            csv_response = http_client.get(self.csv_url, headers=headers)
+            csv_response.raise_for_status()
+        except requests.exceptions.RequestException:
+            if self.index is None:
+                self.index = self.load_snapshot()
+                if self.index is None:
+                    raise
+            # Try the network again after a full TTL instead of on every lookup
+            self.loaded_at = time.monotonic()
+            return
+
+        if csv_response.status_code != 304:
+            self.index = parse_population_csv(csv_response.text)
+            self.version = sheet_version(csv_response.text)
+            self.save_snapshot(csv_response.text)
+        self.etag = csv_response.headers.get("ETag", self.etag)
+        self.last_modified = csv_response.headers.get("Last-Modified", self.last_modified)
+        self.loaded_at = time.monotonic()
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, encoding="utf-8") as snapshot_file:
+            csv_text = snapshot_file.read()
+        self.version = sheet_version(csv_text)
+        return parse_population_csv(csv_text)
+
+    def save_snapshot(self, csv_text):
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            temp_path = self.snapshot_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+                snapshot_file.write(csv_text)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError:
+            pass  # The snapshot is only a fallback, so a read-only disk is not an error
+
+
+# One shared provider for the whole process
+population_provider = PopulationProvider()
+
+
+def get_population(municipality):
+    return population_provider.get_population(municipality)
@@ -0,0 +1,268 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from cirac_grid import get_cirac_grid
+from geocode_cache import normalize_address
+from poi_index import get_poi_index
+from poi_tiles import get_poi_tile_cache
+from population_data import PopulationProvider, normalize_municipality, population_provider
+from scoring import MODEL_VERSION, parse_population, score_frame
+
+# --- Raw Inputs Settings ---
+# A Parquet dataset directory; an empty path stops batch runs from recording their inputs
+RAW_INPUTS_PATH = os.getenv("RAW_INPUTS_PATH", os.path.join("data", "raw_inputs.parquet"))
+RAW_INPUTS_ROWS_PER_GROUP = 500
+
+RAW_INPUT_COLUMNS = [
+    ("address_key", "string"), ("address", "string"), ("lat", "float64"), ("lon", "float64"),
+    ("municipality", "string"), ("population", "int64"), ("cirac_level", "int64"),
+    ("poi_radius", "int64"), ("poi_count", "int64"), ("score", "float64"), ("final_class", "string"),
+    ("model_version", "string"), ("population_version", "string"), ("cirac_source", "string"),
+    ("poi_source", "string"), ("recorded_at", "float64"),
+]
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Para guardar os dados de entrada instale o pacote 'pyarrow' (pip install pyarrow), ou defina RAW_INPUTS_PATH vazio.")
+    return pa, pq
+
+
+def raw_inputs_schema():
+    pa, _ = _pyarrow()
+    return pa.schema([(column, getattr(pa, type_name)()) for column, type_name in RAW_INPUT_COLUMNS])
+
+
+def source_versions():
+    """Where this process reads each input from, stored with every row so a re-score can tell which rows used what."""
+    if get_poi_index() is not None:
+        poi_source = "index"
+    elif get_poi_tile_cache() is not None:
+        poi_source = "tiles"
+    else:
+        poi_source = "overpass"
+    return {
+        "model_version": MODEL_VERSION,
+        "population_version": population_provider.version,
+        "cirac_source": "grid" if get_cirac_grid() is not None else "api" if os.getenv("AUTHORIZATION") else "default",
+        "poi_source": poi_source,
+    }
+
+
+def result_to_raw_row(result, versions):
+    return {
+        "address_key": normalize_address(result.address),
+        "address": result.address,
+        "lat": result.lat,
+        "lon": result.lon,
+        "municipality": result.municipality,
+        "population": result.population,
+        "cirac_level": result.cirac_level,
+        "poi_radius": result.poi_radius,
+        "poi_count": result.poi_count,
+        "score": result.score,
+        "final_class": result.final_class,
+        "recorded_at": time.time(),
+        **versions,
+    }
+
+
+# --- Writer ---
+class RawInputWriter:
+    """
+    Appends the inputs of finished analyses to the dataset directory, RAW_INPUTS_ROWS_PER_GROUP rows per part file.
+    Parts are named after the time and process, so shards running at once never share a file, and each one
+    only appears once complete, so a re-score reading the dataset meanwhile never sees a part still being written.
+    Only results that reached a municipality are kept, since a re-score cannot do without one.
+    """
+
+    def __init__(self, path=RAW_INPUTS_PATH):
+        pa, pq = _pyarrow()
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.pa = pa
+        self.pq = pq
+        self.schema = raw_inputs_schema()
+        self.versions = None
+        self.pending_rows = []
+
+    def write(self, result):
+        if result.lat is None or not result.municipality:
+            return
+        # Read after the first analysis, once the population sheet has been loaded
+        self.versions = self.versions or source_versions()
+        self.pending_rows.append(result_to_raw_row(result, self.versions))
+        if len(self.pending_rows) >= RAW_INPUTS_ROWS_PER_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.pending_rows:
+            write_part(self.pq, self.pa.Table.from_pylist(self.pending_rows, schema=self.schema), self.path)
+            self.pending_rows = []
+
+    def close(self):
+        self.flush()
+
+
+def write_part(pq, table, path):
+    """Writes table as a new part of the dataset, under a hidden name first, which raw_input_parts() skips, so it only ever appears whole."""
+    part_name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+    temp_path = os.path.join(path, f".{part_name}.tmp")
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, os.path.join(path, part_name))
+
+
+def open_raw_input_writer(path=RAW_INPUTS_PATH):
+    """
+    A RawInputWriter, or None when RAW_INPUTS_PATH is empty.
+    Recording is a by-product of a batch run, so without pyarrow the run goes on with a warning instead of failing.
+    """
+    if not path:
+        return None
+    try:
+        return RawInputWriter(path)
+    except ImportError as e:
+        warnings.warn(f"Os dados de entrada não vão ser guardados: {e}", RuntimeWarning, stacklevel=2)
+        return None
+
+
+# --- Store ---
+def load_raw_inputs(path=RAW_INPUTS_PATH, parts=None):
+    """
+    Every stored address as a DataFrame, with only the latest row of an address analysed more than once.
+    parts, from raw_input_parts(), reads only those part files; by default every complete part is read.
+    """
+    _, pq = _pyarrow()
+    parts = raw_input_parts(path) if parts is None else parts
+    if not parts:
+        raise ValueError(f"Não há dados de entrada guardados em {path}.")
+    frame = pq.read_table(parts, schema=raw_inputs_schema()).to_pandas()
+    # Parts are named by time, so for rows recorded at the same time the later part wins
+    frame = frame.sort_values("recorded_at", kind="stable").drop_duplicates("address_key", keep="last")
+    return frame.reset_index(drop=True)
+
+
+def raw_input_parts(path=RAW_INPUTS_PATH):
+    """The complete part files of the dataset, oldest first; parts still being written have hidden names and are left out."""
+    if not path or not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".parquet") and not name.startswith("."))
+
+
+def save_raw_inputs(frame, replaced_parts, path=RAW_INPUTS_PATH):
+    """
+    Writes frame as a new part, then removes replaced_parts, the parts frame was loaded from.
+    Parts added meanwhile by a running batch are kept, so nothing it records is lost; their rows are simply
+    not re-scored, so run rescore again once the batch ends. A crash before the removal leaves both copies,
+    and load_raw_inputs() keeps the newer one.
+    """
+    pa, pq = _pyarrow()
+    table = pa.Table.from_pandas(frame[[column for column, _ in RAW_INPUT_COLUMNS]], schema=raw_inputs_schema(), preserve_index=False)
+    write_part(pq, table, path)
+    for part in replaced_parts:
+        os.remove(part)
+
+
+# --- Re-scoring ---
+def current_populations(municipalities, population_index):
+    """The population of each municipality in the given sheet index, as float64 with NaN for the missing ones."""
+    populations = {
+        name: parse_population(population_index.get(normalize_municipality(name)))
+        for name in set(municipalities)
+    }
+    return np.array([populations[name] if populations[name] is not None else np.nan for name in municipalities], dtype=np.float64)
+
+
+def rescore(frame, population_index, population_version=None, municipalities=(), rescore_all=False):
+    """
+    Scores again the stored rows that need it, from the stored inputs and population_index only, with no network I/O:
+    rows whose municipality has another population in the sheet, rows scored with another MODEL_VERSION
+    (bumped whenever the weights, bounds or classes change), rows of the given municipalities, or every row.
+    Returns (updated frame, mask of the rows scored again); the previous class of those rows is in 'previous_class'.
+    """
+    new_population = current_populations(frame["municipality"].tolist(), population_index)
+    old_population = frame["population"].to_numpy(dtype=np.float64, na_value=np.nan)
+    # A municipality missing from the sheet keeps its stored population, so only a new number counts as a change
+    population_changed = ~np.isnan(new_population) & (new_population != old_population)
+
+    wanted = {normalize_municipality(name) for name in municipalities}
+    affected = population_changed | (frame["model_version"] != MODEL_VERSION).to_numpy()
+    if wanted:
+        affected |= frame["municipality"].map(normalize_municipality).isin(wanted).to_numpy()
+    if rescore_all:
+        affected[:] = True
+
+    updated = frame.copy()
+    updated["population"] = old_population
+    updated["previous_class"] = updated["final_class"]
+    if affected.any():
+        rows = updated[affected].copy()
+        rows["population"] = np.where(np.isnan(new_population[affected]), old_population[affected], new_population[affected])
+        scored = score_frame(rows, poi_radius=rows["poi_radius"].to_numpy(dtype=np.float64, na_value=np.nan))
+        updated.loc[affected, "population"] = scored["population"].to_numpy()
+        updated.loc[affected, "score"] = scored["score"].to_numpy()
+        updated.loc[affected, "final_class"] = scored["final_class"].to_numpy()
+        updated.loc[affected, "model_version"] = MODEL_VERSION
+        if population_version:
+            updated.loc[affected, "population_version"] = population_version
+    updated["population"] = updated["population"].round().astype("Int64")
+    return updated, affected
+
+
+def load_population_snapshot():
+    """(index, version) of the population sheet saved on disk by earlier runs; the sheet is never downloaded here."""
+    provider = PopulationProvider()
+    population_index = provider.load_snapshot()
+    if population_index is None:
+        raise ValueError(f"Não existe cópia local da folha de população ({provider.snapshot_path}).")
+    return population_index, provider.version
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dados de entrada guardados pelas análises em lote, e novo cálculo do potencial sem acesso à rede.")
+    parser.add_argument("--store", default=RAW_INPUTS_PATH, help="Pasta Parquet com os dados de entrada.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rescore_parser = commands.add_parser("rescore", help="Recalcula as moradas afetadas por mudanças na população ou no modelo.")
+    rescore_parser.add_argument("--municipality", action="append", default=[], help="Recalcula também este concelho (pode repetir).")
+    rescore_parser.add_argument("--all", action="store_true", help="Recalcula todas as moradas.")
+    rescore_parser.add_argument("--output", help="Ficheiro CSV para as moradas recalculadas.")
+    commands.add_parser("stats", help="Mostra quantas moradas estão guardadas, por versão.")
+    args = parser.parse_args(argv)
+
+    try:
+        parts = raw_input_parts(args.store)
+        frame = load_raw_inputs(args.store, parts)
+        if args.command == "stats":
+            print(f"{len(frame)} moradas em {args.store}.")
+            for column in ("model_version", "population_version", "cirac_source", "poi_source"):
+                print(f"  {column}: {frame[column].value_counts(dropna=False).to_dict()}")
+            return 0
+
+        population_index, population_version = load_population_snapshot()
+        updated, affected = rescore(frame, population_index, population_version, args.municipality, args.all)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"ERRO: {e}")
+        return 1
+
+    rows = updated[affected]
+    changed = rows[rows["final_class"].fillna("") != rows["previous_class"].fillna("")]
+    print(f"{len(rows)} de {len(updated)} moradas recalculadas; {len(changed)} mudaram de classe.")
+    if len(rows):
+        save_raw_inputs(updated, parts, args.store)
+    if args.output:
+        rows.to_csv(args.output, index=False)
+        print(f"Moradas recalculadas gravadas em {args.output}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
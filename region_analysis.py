@@ -0,0 +1,153 @@
+import argparse
+import math
+import os
+import sys
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from analysis import DEFAULT_CIRAC_LEVEL, POI_RADIUS
+from cirac_grid import NO_DATA, NOT_CACHED, get_cirac_grid
+from municipality_resolver import MAX_MATRIX_CELLS, get_municipality_resolver
+from poi_index import PoiIndex, get_poi_index
+from poi_tiles import METERS_PER_DEGREE_LAT, get_poi_tile_cache
+from population_data import get_population
+from scoring import classify, compute_scores, parse_population
+
+# --- Region Analysis Settings ---
+# Distance between neighbouring hexagon centres
+REGION_CELL_METERS = float(os.getenv("REGION_CELL_METERS", 250))
+# Larger municipalities get wider cells, so the map never carries more than this many
+REGION_MAX_CELLS = int(os.getenv("REGION_MAX_CELLS", 5000))
+
+
+class RegionResult(NamedTuple):
+    """
+    Scores over a hexagonal grid covering one municipality.
+    cells has one row per hexagon: lat, lon (its centre), cirac_level, poi_count, score and final_class.
+    """
+    municipality: str
+    population: int
+    cell_meters: float
+    cells: pd.DataFrame
+
+    def class_counts(self):
+        return self.cells["final_class"].value_counts()
+
+
+def hex_centres(south, west, north, east, cell_meters):
+    """Centres of a hexagonal grid over the box, neighbours cell_meters apart; every other row is shifted by half a cell."""
+    mid_lat = math.radians((south + north) / 2)
+    row_step = cell_meters * math.sqrt(3) / 2 / METERS_PER_DEGREE_LAT
+    col_step = cell_meters / (METERS_PER_DEGREE_LAT * max(math.cos(mid_lat), 0.01))
+    row_lats = np.arange(south, north + row_step, row_step)
+    col_lons = np.arange(west, east + col_step, col_step)
+    lats = np.repeat(row_lats, len(col_lons))
+    lons = np.tile(col_lons, len(row_lats)) + np.repeat(np.arange(len(row_lats)) % 2, len(col_lons)) * col_step / 2
+    return lats, lons
+
+
+def region_grid(polygons, cell_meters=REGION_CELL_METERS, max_cells=REGION_MAX_CELLS):
+    """(lats, lons, cell_meters) of the hexagon centres inside the polygons, with cells widened until there are at most max_cells."""
+    south, west = min(p.min_lat for p in polygons), min(p.min_lon for p in polygons)
+    north, east = max(p.max_lat for p in polygons), max(p.max_lon for p in polygons)
+    while True:
+        lats, lons = hex_centres(south, west, north, east, cell_meters)
+        inside = np.zeros(len(lats), dtype=bool)
+        for polygon in polygons:
+            in_box = np.flatnonzero(~inside & (lats >= polygon.min_lat) & (lats <= polygon.max_lat) & (lons >= polygon.min_lon) & (lons <= polygon.max_lon))
+            chunk_size = max(1, MAX_MATRIX_CELLS // max(polygon.edge_count, 1))
+            for start in range(0, len(in_box), chunk_size):
+                chunk = in_box[start:start + chunk_size]
+                inside[chunk[polygon.contains(lons[chunk], lats[chunk])]] = True
+        if np.count_nonzero(inside) <= max_cells:
+            return lats[inside], lons[inside], cell_meters
+        cell_meters *= math.sqrt(np.count_nonzero(inside) / max_cells) * 1.05
+
+
+def region_poi_index(lats, lons, radius):
+    """
+    A PoiIndex holding every POI within radius of the points: the local index, or one built from the tile cache.
+    Tiles are never fetched here, since a municipality can need hundreds of Overpass requests;
+    a ValueError names the prewarm command to run first when some are missing.
+    """
+    poi_index = get_poi_index()
+    if poi_index is not None:
+        return poi_index
+    tile_cache = get_poi_tile_cache()
+    if tile_cache is None:
+        raise ValueError("A análise por região precisa do índice local de POIs ou da cache de mosaicos (POI_TILE_CACHE_PATH).")
+    lat_margin = radius / METERS_PER_DEGREE_LAT
+    lon_margin = radius / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(float(np.mean(lats)))), 0.01))
+    bbox = (lats.min() - lat_margin, lons.min() - lon_margin, lats.max() + lat_margin, lons.max() + lon_margin)
+    pois, missing_tiles = tile_cache.pois_in_bbox(*bbox)
+    if missing_tiles:
+        raise ValueError(
+            f"Faltam {missing_tiles} mosaicos de POIs desta zona na cache. Descarregue-os primeiro com: "
+            f"python poi_tiles.py prewarm {','.join(f'{value:.4f}' for value in bbox)}"
+        )
+    return PoiIndex.from_pois(pois)
+
+
+def analyse_region(municipality, cell_meters=REGION_CELL_METERS, max_cells=REGION_MAX_CELLS):
+    """
+    Scores every cell of a hexagonal grid over the municipality in bulk, from local data:
+    the CAOP boundaries, the population sheet, the CIRAC grid and the POI index or tile cache.
+    Only the population sheet may be downloaded, when it is not loaded yet.
+    Cells without a cached CIRAC level get DEFAULT_CIRAC_LEVEL, as single analyses do.
+    Raises ValueError when the municipality or the data it needs is not available.
+    """
+    resolver = get_municipality_resolver()
+    if resolver is None:
+        raise ValueError("A análise por região precisa dos limites dos concelhos (MUNICIPALITY_BOUNDARIES_PATH).")
+    polygons = resolver.polygons_of(municipality)
+    if not polygons:
+        raise ValueError(f"O concelho '{municipality}' não existe nos limites carregados.")
+    population = parse_population(get_population(polygons[0].name))
+    if population is None:
+        raise ValueError(f"Não foi possível obter a população de {polygons[0].name}.")
+
+    lats, lons, cell_meters = region_grid(polygons, cell_meters, max_cells)
+    if len(lats) == 0:
+        raise ValueError(f"Nenhuma célula de {cell_meters:.0f} m cai dentro de {polygons[0].name}. Escolha células mais pequenas.")
+
+    grid = get_cirac_grid()
+    cirac_levels = grid.lookup_many(lats, lons).astype(np.int64) if grid is not None else np.full(len(lats), NOT_CACHED)
+    cirac_levels[(cirac_levels == NOT_CACHED) | (cirac_levels == NO_DATA)] = DEFAULT_CIRAC_LEVEL
+
+    poi_index = region_poi_index(lats, lons, POI_RADIUS)
+    poi_counts = np.array([len(poi_index.query_indices(lat, lon, POI_RADIUS)[0]) for lat, lon in zip(lats.tolist(), lons.tolist())], dtype=np.int64)
+
+    scores = compute_scores(population, cirac_levels, poi_counts, poi_radius=POI_RADIUS)
+    cells = pd.DataFrame({
+        "lat": lats, "lon": lons, "cirac_level": cirac_levels, "poi_count": poi_counts,
+        "score": scores, "final_class": classify(scores),
+    })
+    return RegionResult(polygons[0].name, population, cell_meters, cells)
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcula o potencial numa grelha hexagonal sobre um concelho.")
+    parser.add_argument("municipality", help="Nome do concelho.")
+    parser.add_argument("--output", help="Ficheiro CSV para as células.")
+    parser.add_argument("--cell", type=float, default=REGION_CELL_METERS, help="Distância entre células, em metros.")
+    args = parser.parse_args(argv)
+
+    try:
+        region = analyse_region(args.municipality, args.cell)
+    except ValueError as e:
+        print(f"ERRO: {e}")
+        return 1
+    print(f"{region.municipality}: {len(region.cells)} células de {region.cell_meters:.0f} m.")
+    for final_class, count in region.class_counts().items():
+        print(f"  {final_class}: {count}")
+    if args.output:
+        region.cells.to_csv(args.output, index=False)
+        print(f"Células gravadas em {args.output}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import os
+
+import metrics
+from analysis import POI_FETCH_RADIUS, POI_RADIUS, get_analysis_for_address
+from analysis_result import AnalysisResult
+from geocode_cache import normalize_address
+from scoring import MODEL_VERSION
+from sqlite_cache import SqliteCache
+
+# --- Result Cache Settings ---
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join("data", "result_cache.sqlite"))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", 24 * 60 * 60))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10_000))
+
+# Finished analyses, shared by every page session and API request of the process and kept on disk between restarts
+result_cache = SqliteCache(RESULT_CACHE_PATH, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES,
+                           encode=AnalysisResult.to_bytes, decode=AnalysisResult.from_bytes)
+
+
+def result_cache_key(address):
+    # Results computed with another scoring model or POI radius, or holding POIs for other profile rings, are never reused
+    return f"{MODEL_VERSION}:{POI_RADIUS}:{POI_FETCH_RADIUS}:{normalize_address(address)}"
+
+
+def analyse_with_cache(address, trace=None, on_progress=None):
+    """The cached result for the address, or a new analysis (saved when it reached a class)."""
+    trace = trace or metrics.AnalysisTrace(address)
+    with metrics.tracing(trace):
+        with metrics.stage("result_cache"):
+            found, result = result_cache.lookup("result", result_cache_key(address))
+            metrics.record_cache(found)
+        if found:
+            # Show the address as typed by this caller
+            return result._replace(address=address)
+
+        result = get_analysis_for_address(address, trace, on_progress)
+        if result.ok:
+            result_cache.store("result", result_cache_key(address), result)
+        return result
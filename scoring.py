@@ -0,0 +1,98 @@
+import numpy as np
+
+# --- Scoring Model ---
+# Change whenever the weights, bounds or classes below change, so results saved with the old model are not reused
+MODEL_VERSION = "1"
+POP_MIN, POP_MAX = 384, 545_796
+CIRAC_MIN, CIRAC_MAX = 1.0, 5.0
+RESID_POI_MIN, RESID_POI_MAX = 0.0, 2000.0
+
+# Weights of population, CIRAC risk and residents per POI
+WEIGHTS = (0.4, 0.3, 0.3)
+CLASS_THRESHOLDS = (0.33, 0.66)
+CLASS_LABELS = ("REDUZIDO", "MÉDIO", "ALTO")
+# Added to the POI count before dividing, so a place with no POIs does not divide by zero
+POI_OFFSET = 1
+# The residents-per-POI bounds were set for POIs counted within 500 m
+POI_REFERENCE_RADIUS = 500
+
+
+def parse_population(value):
+    """Turns '545,796' or 545796 into an int. Returns None when it is not a number."""
+    try:
+        return int(str(value).replace(",", ""))
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_population_array(values):
+    """Vectorised parse_population for a whole column. Values that are not numbers become NaN."""
+    values = np.asarray(values)
+    if values.dtype.kind in "iuf":
+        return values.astype(np.float64)
+    cleaned = np.char.replace(values.astype(str), ",", "")
+    numbers = np.full(len(cleaned), np.nan)
+    is_number = np.char.isdigit(cleaned)
+    numbers[is_number] = cleaned[is_number].astype(np.float64)
+    return numbers
+
+
+def min_max_scale(values, xmin, xmax):
+    """Scales to 0..1 and clips values outside [xmin, xmax]."""
+    if xmax == xmin:
+        return np.zeros_like(np.asarray(values, dtype=np.float64))
+    return np.clip((np.asarray(values, dtype=np.float64) - xmin) / (xmax - xmin), 0.0, 1.0)
+
+
+def compute_scores(population, cirac_level, poi_count, weights=WEIGHTS, poi_offset=POI_OFFSET, poi_radius=POI_REFERENCE_RADIUS,
+                   pop_bounds=(POP_MIN, POP_MAX), cirac_bounds=(CIRAC_MIN, CIRAC_MAX), resid_poi_bounds=(RESID_POI_MIN, RESID_POI_MAX)):
+    """
+    Potential score for arrays (or single values) of population, CIRAC level and POI count.
+    More people raises the score; a higher flood risk and more residents per POI lower it.
+    POIs counted within another poi_radius are scaled by area to the reference ring first.
+    """
+    population = np.asarray(population, dtype=np.float64)
+    cirac_level = np.asarray(cirac_level, dtype=np.float64)
+    poi_count = np.asarray(poi_count, dtype=np.float64) * (POI_REFERENCE_RADIUS / poi_radius) ** 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        resid_poi = population / (poi_count + poi_offset)
+
+    pop_norm = min_max_scale(population, *pop_bounds)
+    cirac_norm_inv = 1.0 - min_max_scale(cirac_level, *cirac_bounds)
+    resid_norm_inv = 1.0 - min_max_scale(resid_poi, *resid_poi_bounds)
+
+    w_pop, w_cirac, w_poi = weights
+    return w_pop * pop_norm + w_cirac * cirac_norm_inv + w_poi * resid_norm_inv
+
+
+def classify(scores, thresholds=CLASS_THRESHOLDS, labels=CLASS_LABELS):
+    """Maps scores to REDUZIDO / MÉDIO / ALTO (or the given labels) in one pass."""
+    return np.asarray(labels, dtype=object)[np.digitize(scores, thresholds)]
+
+
+def score_one(population, cirac_level, poi_count, **options):
+    """Score and class of a single address, using the same maths as the array version. Missing inputs give (None, None)."""
+    labels = options.pop("labels", CLASS_LABELS)
+    score = float(compute_scores(population, cirac_level, poi_count, **options))
+    if np.isnan(score):
+        return None, None
+    return score, classify([score], labels=labels)[0]
+
+
+def score_frame(frame, population_column="population", cirac_column="cirac_level", poi_column="poi_count", labels=CLASS_LABELS, **options):
+    """
+    Adds 'score' and 'final_class' columns to a copy of a DataFrame.
+    Rows with a missing population, CIRAC level or POI count get no score.
+    """
+    population = parse_population_array(frame[population_column].to_numpy())
+    cirac_level = frame[cirac_column].to_numpy(dtype=np.float64, na_value=np.nan)
+    poi_count = frame[poi_column].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    scores = compute_scores(population, cirac_level, poi_count, **options)
+    has_inputs = ~(np.isnan(population) | np.isnan(cirac_level) | np.isnan(poi_count))
+
+    scored = frame.copy()
+    scored["score"] = np.where(has_inputs, scores, np.nan)
+    scored["final_class"] = np.where(has_inputs, classify(np.nan_to_num(scores), labels=labels), None)
+    return scored
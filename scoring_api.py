@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import metrics
+from analysis_result import AnalysisResult
+from result_cache import analyse_with_cache
+
+# --- Scoring API Settings ---
+API_HOST = os.getenv("SCORING_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("SCORING_API_PORT", 8000))
+# Analyses running at once; they wait on upstream services, so there are more threads than cores
+API_WORKERS = int(os.getenv("SCORING_API_WORKERS", 32))
+API_MAX_BATCH = int(os.getenv("SCORING_API_MAX_BATCH", 1000))
+
+# The analyses are blocking calls, so the async handlers hand them to these threads.
+# The result cache, geocode cache and HTTP connection pool are module-level and shared by all of them
+analysis_pool = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="scoring-api")
+
+
+def error_response(message, status_code=400):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+async def score_address(address):
+    """The summary of one analysis; an unexpected error becomes a failed result instead of failing the request."""
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(analysis_pool, analyse_with_cache, address)
+    except Exception as e:
+        result = AnalysisResult(address, f"Ocorreu um erro inesperado: {e}")
+    return result.summary()
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# --- Endpoints ---
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def score(request):
+    """GET /score?address=... or POST /score with {"address": "..."}."""
+    if request.method == "GET":
+        address = request.query_params.get("address")
+    else:
+        body = await read_json(request)
+        address = body.get("address") if isinstance(body, dict) else None
+    if not isinstance(address, str) or not address.strip():
+        return error_response("Indique a morada em 'address'.")
+    return JSONResponse(await score_address(address.strip()))
+
+
+async def score_batch(request):
+    """POST /score/batch with {"addresses": [...]}; the results come back in the same order."""
+    body = await read_json(request)
+    addresses = body.get("addresses") if isinstance(body, dict) else None
+    if not isinstance(addresses, list) or not all(isinstance(address, str) and address.strip() for address in addresses):
+        return error_response("Indique uma lista de moradas em 'addresses'.")
+    if len(addresses) > API_MAX_BATCH:
+        return error_response(f"No máximo {API_MAX_BATCH} moradas por pedido.", status_code=413)
+    results = await asyncio.gather(*(score_address(address.strip()) for address in addresses))
+    return JSONResponse({"results": results})
+
+
+async def prometheus_metrics(request):
+    return PlainTextResponse(metrics.registry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+app = Starlette(routes=[
+    Route("/health", health),
+    Route("/score", score, methods=["GET", "POST"]),
+    Route("/score/batch", score_batch, methods=["POST"]),
+    Route("/metrics", prometheus_metrics),
+])
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP de pontuação de moradas, sem interface gráfica.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError("Para servir a API instale o pacote 'uvicorn' (pip install uvicorn).")
+
+    metrics.enable_structured_logs()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers asking for a key that is
+    already being fetched wait for that call and get its result (or its
+    exception) instead of sending the same upstream request again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.shared_calls = 0
+
+    def run(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            is_first = call is None
+            if is_first:
+                call = self.calls[key] = Future()
+            else:
+                self.shared_calls += 1
+        if not is_first:
+            return call.result()
+
+        try:
+            result = function()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from single_flight import SingleFlight
+
+# --- SQLite Cache Settings ---
+# How long a write waits for another process holding the file, such as the other shards of a batch run
+SQLITE_TIMEOUT_SECONDS = float(os.getenv("SQLITE_TIMEOUT_SECONDS", 60))
+
+
+class SqliteCache:
+    """
+    A key-value cache in a local SQLite file, used for geocoding answers, POI tiles and analysis results.
+    Keys are grouped by kind, so one file can hold several kinds of value.
+    Entries expire after ttl_seconds, and when there are more than max_entries
+    the least recently used ones are removed. Hits and misses are counted.
+    Values are saved as JSON unless other encode/decode functions are given;
+    decode raises ValueError for values it cannot read, which then count as misses.
+    """
+
+    def __init__(self, path, ttl_seconds, max_entries, encode=json.dumps, decode=json.loads, timeout_seconds=SQLITE_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout_seconds = timeout_seconds
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.encode = encode
+        self.decode = decode
+        # Concurrent misses for the same key share one fetch
+        self.fetches = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        # Opened on first use, so importing this module never touches the disk
+        if self.connection is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=self.timeout_seconds, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self._rename_old_table()
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (kind, key))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS cache_entries_last_used ON cache_entries (last_used)")
+        return self.connection
+
+    def _rename_old_table(self):
+        # Files written while this was the geocoding cache keep their entries
+        tables = {row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "geocode_cache" in tables and "cache_entries" not in tables:
+            self.connection.execute("ALTER TABLE geocode_cache RENAME TO cache_entries")
+            self.connection.execute("DROP INDEX IF EXISTS geocode_cache_last_used")
+            self.connection.commit()
+
+    def lookup(self, kind, key):
+        """Returns (True, value) for a fresh entry, otherwise (False, None)."""
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute("SELECT value, created_at FROM cache_entries WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return False, None
+            try:
+                value = self.decode(row[0])
+            except ValueError:
+                # Written in an older format; it is replaced by the next store()
+                self.misses += 1
+                return False, None
+            connection.execute("UPDATE cache_entries SET last_used = ? WHERE kind = ? AND key = ?", (now, kind, key))
+            connection.commit()
+            self.hits += 1
+            return True, value
+
+    def lookup_many(self, kind, keys):
+        """Returns {key: value} for the keys with a fresh entry, in one query. Every other key counts as a miss."""
+        now = time.time()
+        found = {}
+        with self.lock:
+            connection = self.connect()
+            placeholders = ",".join("?" * len(keys))
+            rows = connection.execute(
+                f"SELECT key, value, created_at FROM cache_entries WHERE kind = ? AND key IN ({placeholders})", (kind, *keys),
+            ).fetchall()
+            for key, value, created_at in rows:
+                if now - created_at > self.ttl_seconds:
+                    continue
+                try:
+                    found[key] = self.decode(value)
+                except ValueError:
+                    pass
+            if found:
+                connection.executemany(
+                    "UPDATE cache_entries SET last_used = ? WHERE kind = ? AND key = ?", [(now, kind, key) for key in found],
+                )
+                connection.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def store(self, kind, key, value):
+        self.store_many(kind, {key: value})
+
+    def store_many(self, kind, values):
+        """Stores {key: value} in one transaction."""
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO cache_entries (kind, key, value, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(kind, key, self.encode(value), now, now) for key, value in values.items()],
+            )
+            entry_count = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+            if entry_count > self.max_entries:
+                connection.execute(
+                    "DELETE FROM cache_entries WHERE rowid IN (SELECT rowid FROM cache_entries ORDER BY last_used LIMIT ?)",
+                    (entry_count - self.max_entries,),
+                )
+            connection.commit()
+
+    def cached(self, kind, key, fetch):
+        """
+        Returns the cached value for (kind, key), or calls fetch() and caches what it returns.
+        An empty or None answer is returned but not cached, so a transient upstream miss is asked again next time.
+        Callers missing the same key at the same time wait for a single fetch().
+        """
+        found, value = self.lookup(kind, key)
+        metrics.record_cache(found)
+        if found:
+            return value
+
+        def fetch_and_store():
+            fetched = fetch()
+            if fetched:
+                self.store(kind, key, fetched)
+            return fetched
+
+        return self.fetches.run((kind, key), fetch_and_store)
+
+    def remove_expired(self):
+        with self.lock:
+            connection = self.connect()
+            removed = connection.execute("DELETE FROM cache_entries WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+            connection.commit()
+            return removed
+
+    def stats(self):
+        with self.lock:
+            entry_count = self.connect().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        return {"entries": entry_count, "hits": self.hits, "misses": self.misses}
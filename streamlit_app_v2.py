@@ -1,12 +1,30 @@
 
-import streamlit as st
+import math
+import os
+import tempfile
 import requests
-import urllib.parse
-import csv
-import io
+import streamlit as st
 import pandas as pd
-import pydeck as pdk
-from collections import Counter
+
+import metrics
+from address_index import get_address_index
+from analysis import POI_PROFILE_RADII, POI_RADIUS
+from analysis_jobs import FAILED, job_queue
+from analysis_result import AnalysisResult, format_population
+from batch_analysis import DEFAULT_ADDRESS_COLUMN, read_addresses, run_batch
+from map_view import show_map, show_region_map
+from municipality_resolver import get_municipality_resolver
+from region_analysis import analyse_region
+from result_cache import RESULT_CACHE_TTL_SECONDS, analyse_with_cache, result_cache_key
+from scoring import CLASS_LABELS, MODEL_VERSION
+
+# --- Page Settings ---
+# How often a page waiting for its analysis checks the job
+JOB_POLL_SECONDS = float(os.getenv("ANALYSIS_JOB_POLL_SECONDS", 0.5))
+# Pause in typing after which the address suggestions are refreshed
+SUGGEST_PAUSE = os.getenv("ADDRESS_SUGGEST_PAUSE", "250ms")
+ADDRESS_LABEL = "Por favor, introduza a morada para análise:"
+REGION_CACHE_MAX_ENTRIES = 32
 
 # --- Set Background Color and Icons ---
 page_bg_img = """
@@ -49,149 +67,65 @@ div[data-testid="stHorizontalBlock"] div[data-testid="stHorizontalBlock"] div[da
 """
 st.markdown(page_bg_img, unsafe_allow_html=True)
 
-
-# --- Core Logic Function ---
-def get_analysis_for_address(address):
-    safe_address = urllib.parse.quote(address)
-    geocode_url = f"https://nominatim.openstreetmap.org/search?q={safe_address}&format=json"
-    headers = {'User-Agent': 'MyStreamlitApp/1.0'}
-    
-    try:
-        geocode_response = requests.get(geocode_url, headers=headers)
-        geocode_response.raise_for_status()
-        results = geocode_response.json()
-    except requests.exceptions.RequestException as e:
-        return f"Erro de rede ao contactar o serviço de geocodificação: {e}", None, None, None, None, None, None, None, None, None, None
-
-    if not results:
-        return "Não foi possível encontrar as coordenadas para a morada indicada.", None, None, None, None, None, None, None, None, None, None
-
-    first_result = results[0]
-    input_lat_str = first_result.get('lat')
-    input_lon_str = first_result.get('lon')
-
-    if not input_lat_str or not input_lon_str:
-        return "O serviço de geocodificação não retornou uma latitude ou longitude para esta morada.", None, None, None, None, None, None, None, None, None, None
-
-    try:
-        input_lat = float(input_lat_str)
-        input_lon = float(input_lon_str)
-    except (ValueError, TypeError):
-        return f"Não foi possível converter latitude '{input_lat_str}' ou longitude '{input_lon_str}' para um número.", None, None, None, None, None, None, None, None, None, None
-
-    # Use Nominatim for reverse geocoding
-    reverse_geocode_url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={input_lat}&lon={input_lon}&accept-language=pt"
-    
-    try:
-        reverse_response = requests.get(reverse_geocode_url, headers=headers)
-        reverse_response.raise_for_status()
-        location_data = reverse_response.json()
-    except requests.exceptions.RequestException as e:
-        return f"Erro de rede ao contactar o serviço de geocodificação inversa: {e}", None, input_lat, input_lon, None, None, None, None, None, None, None
-
-    address_details = location_data.get('address', {})
-    out_municipality = address_details.get('county') or address_details.get('city') or address_details.get('town') or address_details.get('village')
-
-    if not out_municipality:
-        return "Não foi possível encontrar o concelho para a morada indicada.", None, input_lat, input_lon, None, None, None, None, None, None, None
-
-    poi_locations = []
-    out_pop = None
-    out_cirac_desc = None
-    out_poi_count = None
-    poi_categories = None
-    try:
-        csv_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vR0A79pNYNO4YD-jhyZ4baNjHsGZCsAyTgVlZgaoSGdKN_ehlS5fUnwmESyknqyy-Wf9-30OnjdCR3I/pub?gid=0&single=true&output=csv"
-        csv_response = requests.get(csv_url)
-        csv_response.raise_for_status()
-        csv_text = csv_response.text
-        csv_file = io.StringIO(csv_text)
-        csv_reader = csv.reader(csv_file)
-        for row in csv_reader:
-            if len(row) > 2 and row[1] == out_municipality:
-                out_pop = row[2]
-                break
-
-        out_cirac_cod = 3
-        out_cirac_desc = "Risco moderado"
-
-        radius = 500
-        overpass_url = "https://overpass-api.de/api/interpreter"
-        overpass_query = f'''[out:json];(node["amenity"](around:{radius},{input_lat},{input_lon});way["amenity"](around:{radius},{input_lat},{input_lon});relation["amenity"](around:{radius},{input_lat},{input_lon}););out center;'''
-        poi_response = requests.post(overpass_url, data=overpass_query)
-        poi_response.raise_for_status()
-        poi_data = poi_response.json()
-        
-        poi_amenities = []
-        unique_poi_coords = set()
-        for el in poi_data.get('elements', []):
-            tags = el.get('tags', {})
-            name = tags.get('name')
-            amenity = tags.get('amenity')
-            if name and amenity:
-                lat, lon = (None, None)
-                if el['type'] == 'node':
-                    lat, lon = el.get('lat'), el.get('lon')
-                elif 'center' in el:
-                    lat, lon = el['center'].get('lat'), el['center'].get('lon')
-                
-                if lat and lon and (lat, lon) not in unique_poi_coords:
-                    poi_locations.append({'name': name, 'lat': lat, 'lon': lon})
-                    poi_amenities.append(amenity.replace('_', ' ').capitalize())
-                    unique_poi_coords.add((lat, lon))
-
-        out_poi_count = len(poi_locations)
-        if poi_amenities:
-            poi_categories = Counter(poi_amenities)
-
-    except requests.exceptions.RequestException as e:
-        return f"Erro de rede ao obter dados (população ou POIs): {e}", None, input_lat, input_lon, None, out_municipality, out_pop, out_cirac_desc, out_poi_count, None, address
-
-    final_class = None
-    if out_pop and out_poi_count >= 0:
-        try:
-            numeric_population = int(out_pop.replace(",", ""))
-        except (ValueError, TypeError):
-            numeric_population = 0 
-        resid_poi = numeric_population / (out_poi_count + 1)
-        
-        POP_MIN, POP_MAX = 384, 545_796
-        CIRAC_MIN, CIRAC_MAX = 1.0, 5.0
-        RESID_POI_MIN, RESID_POI_MAX = 0.0, 2000.0
-
-        def min_max_scale(x, xmin, xmax):
-            if xmax == xmin: return 0.0
-            val = (x - xmin) / (xmax - xmin)
-            return max(0.0, min(1.0, val))
-
-        pop_norm = min_max_scale(numeric_population, POP_MIN, POP_MAX)
-        cirac_norm = min_max_scale(out_cirac_cod, CIRAC_MIN, CIRAC_MAX)
-        resid_norm = min_max_scale(resid_poi, RESID_POI_MIN, RESID_POI_MAX)
-
-        cirac_norm_inv = 1.0 - cirac_norm
-        resid_norm_inv = 1.0 - resid_norm
-
-        w_pop, w_cirac, w_poi = 0.4, 0.3, 0.3
-        final_score = (w_pop * pop_norm + w_cirac * cirac_norm_inv + w_poi * resid_norm_inv)
-
-        if final_score < 0.33: final_class = "REDUZIDO"
-        elif final_score < 0.66: final_class = "MÉDIO"
-        else: final_class = "ALTO"
-
-    message = ""
-    if final_class and out_pop and out_cirac_desc:
-        try:
-            pop_number = int(out_pop.replace(",", ""))
-            out_pop_formatted = f"{pop_number:,}".replace(",", " ")
-        except (ValueError, TypeError):
-            out_pop_formatted = out_pop
-
-        message = f'''<p>A morada analizada localiza-se no concelho ({out_municipality}) onde residem {out_pop_formatted} pessoas.</p>
-<p>Apresenta um {out_cirac_desc} de inundação (CIRAC 2.0) e, num raio de 500m, existem {out_poi_count} POIs.</p>'''
+# --- Performance Metrics ---
+metrics.enable_structured_logs()
+metrics.start_metrics_server()  # Only when METRICS_PORT is set
+show_debug = st.query_params.get("debug") == "1" or bool(os.getenv("ANALYSIS_DEBUG"))
+
+
+# --- Region Cache ---
+@st.cache_data(ttl=RESULT_CACHE_TTL_SECONDS, max_entries=REGION_CACHE_MAX_ENTRIES, show_spinner="A calcular o potencial da região...")
+def cached_region(municipality, model_version, poi_radius):
+    """The region grid of a municipality, computed once for every session. The model and radius are part of the key."""
+    return analyse_region(municipality)
+
+
+# --- Progressive Results ---
+PROGRESS_FIELDS = (
+    ("fas fa-map-marked-alt", "Concelho", "municipality"),
+    ("fas fa-users", "População", "population"),
+    ("fas fa-cloud-rain", "Risco de Inundação", "cirac_desc"),
+    ("fas fa-map-marker-alt", f"Total de POIs ({POI_RADIUS}m)", "poi_count"),
+)
+
+
+def show_progress(address, partial):
+    """Shows the data found so far; fields still being fetched show '...'."""
+    st.info(f"A analisar {address}...")
+    if "lat" not in partial:
+        return
+    progress_col1, progress_col2 = st.columns(2)
+    with progress_col1:
+        show_map(partial["lat"], partial["lon"], partial.get("pois"))
+    with progress_col2:
+        st.markdown("##### Resumo dos Dados")
+        st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-crosshairs'></i>&nbsp;&nbsp;<strong>Coordenadas:</strong> {partial['lat']:.5f}, {partial['lon']:.5f}</p>", unsafe_allow_html=True)
+        for icon, label, key in PROGRESS_FIELDS:
+            value = format_population(partial.get(key)) if key == "population" else partial.get(key)
+            st.markdown(f"<p style='font-size:0.9em'><i class='{icon}'></i>&nbsp;&nbsp;<strong>{label}:</strong> {'...' if value is None else value}</p>", unsafe_allow_html=True)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def wait_for_job():
+    """Reruns on its own every JOB_POLL_SECONDS until the job ends, then reruns the whole page with the result."""
+    job = job_queue.get(st.session_state.analysis_job_id)
+    if job is None:
+        st.session_state.analysis_job_id = None
+        st.warning("A análise expirou. Por favor, analise a morada novamente.")
+        return
+    if not job.finished:
+        show_progress(job.address, job.progress)
+        return
+
+    if job.status == FAILED:
+        st.session_state.analysis_result = AnalysisResult(job.address, f"Ocorreu um erro inesperado: {job.error}")
     else:
-        message = "Não foi possível concluir a análise. Um ou mais dados (população, POIs) não foram encontrados para este local."
-        
-    return message, final_class, input_lat, input_lon, poi_locations, out_municipality, out_pop, out_cirac_desc, out_poi_count, poi_categories, address
+        # The job may have been started by another session, so the address is shown as typed here
+        st.session_state.analysis_result = job.result._replace(address=st.session_state.analysis_address)
+    st.session_state.analysis_trace = job.trace
+    st.session_state.analysis_job_id = None
+    st.rerun()
+
 
 # --- Streamlit App Interface ---
 st.title("Análise de Potencial de Morada")
@@ -201,91 +135,201 @@ if 'analysis_result' not in st.session_state:
     st.session_state.analysis_result = None
 if 'show_poi_details' not in st.session_state:
     st.session_state.show_poi_details = False
+if 'analysis_trace' not in st.session_state:
+    st.session_state.analysis_trace = None
+if 'analysis_job_id' not in st.session_state:
+    st.session_state.analysis_job_id = None
+    st.session_state.analysis_address = None
+if 'region_municipality' not in st.session_state:
+    st.session_state.region_municipality = None
 
 def clear_state():
     st.session_state.analysis_result = None
     st.session_state.show_poi_details = False
+    # A running job carries on and fills the result cache, but this page stops waiting for it
+    st.session_state.analysis_job_id = None
+
+
+def edit_address():
+    # The result is drawn outside the address fragment, so the page is redrawn once, on the first edit after a result
+    if st.session_state.analysis_result is not None or st.session_state.analysis_job_id is not None:
+        clear_state()
+        st.session_state.redraw_page = True
+
+
+def use_suggestion():
+    st.session_state.address_input = st.session_state.address_suggestion
+    st.session_state.address_suggestion = None
+    edit_address()
+
+
+@st.fragment
+def address_picker():
+    """
+    The address field. With a local address index it offers matching addresses while the user types;
+    only this fragment reruns on each pause, so the rest of the page stays as it is until the analysis starts.
+    """
+    address_index = get_address_index()
+    if address_index is None:
+        st.text_input(ADDRESS_LABEL, key="address_input", on_change=edit_address)
+    else:
+        typed = st.text_input(ADDRESS_LABEL, key="address_input", live=SUGGEST_PAUSE, on_change=edit_address)
+        suggestions = address_index.suggest(typed) if typed else []
+        if suggestions and typed not in suggestions:
+            st.pills("Sugestões", suggestions, key="address_suggestion", on_change=use_suggestion, label_visibility="collapsed")
+
+    if st.session_state.pop("redraw_page", False):
+        st.rerun(scope="app")
+
 
 # Input and button layout
+if 'address_input' not in st.session_state:
+    st.session_state.address_input = ""
 col1, col2 = st.columns([3, 1])
 with col1:
-    address_input = st.text_input("Por favor, introduza a morada para análise:", "", on_change=clear_state)
+    address_picker()
+    address_input = st.session_state.address_input
 with col2:
     st.markdown("<div style='margin-top: 28px;'></div>", unsafe_allow_html=True)
     analyze_button = st.button("Analisar Morada")
 
 if analyze_button and address_input:
-    with st.spinner("A analisar... Por favor, aguarde."):
-        st.session_state.analysis_result = get_analysis_for_address(address_input)
-        st.session_state.show_poi_details = False # Reset on new analysis
+    # The analysis runs on the job queue; identical addresses from any session share one job
+    job = job_queue.submit(address_input, analyse_with_cache, key=result_cache_key(address_input))
+    st.session_state.analysis_job_id = job.id
+    st.session_state.analysis_address = address_input
+    st.session_state.analysis_result = None
+    st.session_state.show_poi_details = False # Reset on new analysis
 elif analyze_button and not address_input:
     st.warning("Por favor, introduza uma morada.")
 
+if st.session_state.analysis_job_id:
+    wait_for_job()
+
 # Display results if they exist in session state
 if st.session_state.analysis_result:
-    result_message, final_class, lat, lon, poi_locations, out_municipality, out_pop, out_cirac_desc, out_poi_count, poi_categories, analyzed_address = st.session_state.analysis_result
+    result = st.session_state.analysis_result
+    map_span = None
 
-    if final_class:
-        if final_class == "REDUZIDO": color = "#d4edda"
-        elif final_class == "MÉDIO": color = "#fff3cd"
+    if result.ok:
+        if result.final_class == "REDUZIDO": color = "#d4edda"
+        elif result.final_class == "MÉDIO": color = "#fff3cd"
         else: color = "#f8d7da"
 
-        st.markdown(f'<div style="background-color: {color}; color: black; padding: 10px; border-radius: 5px; text-align: center;"><span style="font-size: 1.5em;"><strong>POTENCIAL {final_class}</strong></span><br><span style="font-size: 1.2em;">{analyzed_address}</span></div>', unsafe_allow_html=True)
+        st.markdown(f'<div style="background-color: {color}; color: black; padding: 10px; border-radius: 5px; text-align: center;"><span style="font-size: 1.5em;"><strong>POTENCIAL {result.final_class}</strong></span><br><span style="font-size: 1.2em;">{result.address}</span></div>', unsafe_allow_html=True)
         st.markdown("<br>", unsafe_allow_html=True)
 
         res_col1, res_col2 = st.columns(2)
         with res_col1:
-            st.markdown(f'<div style="background-color: {color}; color: black; padding: 10px; border-radius: 5px; font-size: 0.9em;">{result_message}</div>', unsafe_allow_html=True)
+            st.markdown(f'<div style="background-color: {color}; color: black; padding: 10px; border-radius: 5px; font-size: 0.9em;">{result.message}</div>', unsafe_allow_html=True)
         
         with res_col2:
             st.markdown("##### Resumo dos Dados")
-            try:
-                pop_number = int(out_pop.replace(",", ""))
-                out_pop_formatted = f"{pop_number:,}".replace(",", " ")
-            except (ValueError, TypeError):
-                out_pop_formatted = out_pop
-            
-            st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-map-marked-alt'></i>&nbsp;&nbsp;<strong>Concelho:</strong> {out_municipality}</p>", unsafe_allow_html=True)
-            st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-users'></i>&nbsp;&nbsp;<strong>População:</strong> {out_pop_formatted}</p>", unsafe_allow_html=True)
-            st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-cloud-rain'></i>&nbsp;&nbsp;<strong>Risco de Inundação:</strong> {out_cirac_desc}</p>", unsafe_allow_html=True)
-
-            if poi_categories:
+            st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-map-marked-alt'></i>&nbsp;&nbsp;<strong>Concelho:</strong> {result.municipality}</p>", unsafe_allow_html=True)
+            st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-users'></i>&nbsp;&nbsp;<strong>População:</strong> {format_population(result.population)}</p>", unsafe_allow_html=True)
+            st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-cloud-rain'></i>&nbsp;&nbsp;<strong>Risco de Inundação:</strong> {result.cirac_desc}</p>", unsafe_allow_html=True)
+
+            if result.poi_categories:
                 poi_col1, poi_col2 = st.columns([2,1])
                 with poi_col1:
-                    st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-map-marker-alt'></i>&nbsp;&nbsp;<strong>Total de POIs (500m):</strong> {out_poi_count}</p>", unsafe_allow_html=True)
+                    st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-map-marker-alt'></i>&nbsp;&nbsp;<strong>Total de POIs ({result.poi_radius}m):</strong> {result.poi_count}</p>", unsafe_allow_html=True)
                 with poi_col2:
                     if st.button("🔍"):
                         st.session_state.show_poi_details = not st.session_state.show_poi_details
             else:
-                 st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-map-marker-alt'></i>&nbsp;&nbsp;<strong>Total de POIs (500m):</strong> {out_poi_count}</p>", unsafe_allow_html=True)
+                 st.markdown(f"<p style='font-size:0.9em'><i class='fas fa-map-marker-alt'></i>&nbsp;&nbsp;<strong>Total de POIs ({result.poi_radius}m):</strong> {result.poi_count}</p>", unsafe_allow_html=True)
 
 
-            if st.session_state.show_poi_details and poi_categories:
-                for category, count in sorted(poi_categories.items()):
+            map_radius = result.poi_radius
+            if st.session_state.show_poi_details and result.poi_categories:
+                for category, count in sorted(result.poi_categories.items()):
                     st.markdown(f"<div style='font-size:0.8em; padding-left: 20px;'>- {category}: {count}</div>", unsafe_allow_html=True)
 
-        if lat and lon:
-            lat, lon = float(lat), float(lon)
-            ICON_DATA = {
-                "address": {"url": "https://maps.google.com/mapfiles/ms/icons/red-dot.png", "width": 128, "height": 128, "anchorY": 128},
-                "poi": {"url": "https://maps.google.com/mapfiles/ms/icons/blue-dot.png", "width": 128, "height": 128, "anchorY": 128}
-            }
-            address_df = pd.DataFrame([{'name': 'Morada Analisada', 'lat': lat, 'lon': lon}])
-            address_df["icon_data"] = [ICON_DATA["address"]]
-            address_layer = pdk.Layer("IconLayer", data=address_df, get_icon="icon_data", get_position='[lon, lat]', get_size=4, size_scale=15, pickable=True)
-            layers_to_render = [address_layer]
-
-            if poi_locations:
-                poi_df = pd.DataFrame(poi_locations)
-                poi_df["icon_data"] = [ICON_DATA["poi"]] * len(poi_locations)
-                poi_layer = pdk.Layer("IconLayer", data=poi_df, get_icon="icon_data", get_position='[lon, lat]', get_size=4, size_scale=10, pickable=True)
-                layers_to_render.append(poi_layer)
-            
-            st.pydeck_chart(pdk.Deck(
-                map_style="https://basemaps.cartocdn.com/gl/voyager-gl-style/style.json",
-                initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=15, pitch=0, bearing=0),
-                layers=layers_to_render,
-                tooltip={"text": "{name}"}
-            ))
+            # Every ring comes from the POIs already fetched, so changing it makes no network call
+            if st.session_state.show_poi_details and result.poi_categories and len(POI_PROFILE_RADII) > 1:
+                st.markdown("<p style='font-size:0.9em; margin-top: 10px;'><strong>Densidade de POIs por raio</strong></p>", unsafe_allow_html=True)
+                profile_rows = []
+                for radius, count, categories in result.pois.profile(POI_PROFILE_RADII):
+                    profile_rows.append({
+                        "Raio (m)": radius,
+                        "POIs": count,
+                        "POIs/km²": round(count / (math.pi * (radius / 1000) ** 2), 1),
+                        "Mais comum": categories.most_common(1)[0][0] if categories else "-",
+                    })
+                st.dataframe(pd.DataFrame(profile_rows), hide_index=True)
+                map_radius = st.select_slider("Raio dos POIs no mapa (m):", options=POI_PROFILE_RADII, value=result.poi_radius)
+
+        if result.lat is not None and result.lon is not None:
+            with metrics.stage("map_build") as map_span:
+                show_map(result.lat, result.lon, result.pois.within(map_radius), map_key=(result_cache_key(result.address), map_radius, result.pois.count))
     else:
-        st.error(result_message)
+        st.error(result.message)
+
+    if show_debug and st.session_state.analysis_trace:
+        trace = st.session_state.analysis_trace
+        with st.expander("Desempenho (debug)"):
+            st.markdown(f"**Tempo total da análise:** {trace.total_ms} ms")
+            spans = list(trace.spans)
+            if map_span:
+                # The map is rebuilt on every rerun, so its time comes from this run and not from the trace
+                spans.append(map_span)
+            st.dataframe(pd.DataFrame(spans, columns=["stage", "ms", "cache", "bytes"]), hide_index=True)
+
+# --- Region Analysis (municipality map) ---
+st.markdown("<br>", unsafe_allow_html=True)
+with st.expander("Análise por região (concelho)"):
+    resolver = get_municipality_resolver()
+    if resolver is None:
+        st.info("Para analisar um concelho inteiro são precisos os limites dos concelhos (CAOP) em MUNICIPALITY_BOUNDARIES_PATH.")
+    else:
+        municipality = st.selectbox("Concelho:", resolver.names(), index=None, placeholder="Escolha um concelho")
+        if municipality and st.button("Analisar Região"):
+            st.session_state.region_municipality = municipality
+
+        if st.session_state.region_municipality:
+            try:
+                region = cached_region(st.session_state.region_municipality, MODEL_VERSION, POI_RADIUS)
+            except ValueError as e:
+                st.error(str(e))
+            except requests.exceptions.RequestException as e:
+                st.error(f"Erro de rede ao obter os dados da região: {e}")
+            else:
+                st.markdown(f"**{region.municipality}**: população {format_population(region.population)}, {len(region.cells)} células de {region.cell_meters:.0f} m")
+                class_counts = region.class_counts()
+                for column, label in zip(st.columns(len(CLASS_LABELS)), CLASS_LABELS):
+                    column.metric(f"Potencial {label}", int(class_counts.get(label, 0)))
+                show_region_map(region, map_key=(region.municipality, region.cell_meters, MODEL_VERSION, POI_RADIUS))
+                st.download_button("Descarregar células", region.cells.to_csv(index=False).encode("utf-8"), "regiao.csv", "text/csv")
+
+# --- Batch Analysis (CSV upload) ---
+st.markdown("<br>", unsafe_allow_html=True)
+with st.expander("Análise em lote (ficheiro CSV)"):
+    uploaded_file = st.file_uploader(f"Ficheiro CSV com uma coluna '{DEFAULT_ADDRESS_COLUMN}':", type=["csv"])
+    output_format = st.radio("Formato dos resultados:", ["CSV", "Parquet"], horizontal=True)
+    if uploaded_file and st.button("Analisar Ficheiro"):
+        with tempfile.TemporaryDirectory() as work_dir:
+            input_path = os.path.join(work_dir, "moradas.csv")
+            with open(input_path, "wb") as input_file:
+                input_file.write(uploaded_file.getvalue())
+            output_path = os.path.join(work_dir, "resultados.csv" if output_format == "CSV" else "resultados.parquet")
+
+            progress_bar = st.progress(0.0)
+            finished_rows = []
+
+            def update_progress(row):
+                finished_rows.append(row)
+                progress_bar.progress(len(finished_rows) / total_rows, text=f"{len(finished_rows)} de {total_rows} moradas analisadas")
+
+            try:
+                # Reading the file checks for the address column, so it is inside the try
+                total_rows = max(1, sum(1 for _ in read_addresses(input_path)))
+                run_batch(read_addresses(input_path), output_path, on_row=update_progress)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                results_df = pd.read_csv(output_path) if output_format == "CSV" else pd.read_parquet(output_path)
+                st.dataframe(results_df)
+                if output_format == "CSV":
+                    st.download_button("Descarregar resultados", results_df.to_csv(index=False).encode("utf-8"), "resultados.csv", "text/csv")
+                else:
+                    st.download_button("Descarregar resultados", results_df.to_parquet(index=False), "resultados.parquet", "application/octet-stream")
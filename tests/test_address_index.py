@@ -0,0 +1,92 @@
+import pytest
+
+from address_index import ADDRESS_MIN_CONFIDENCE, AddressIndex, normalize_prefix, parse_address
+
+LISBON = (38.7100, -9.1366)
+PORTO = (41.1496, -8.6109)
+
+
+@pytest.fixture
+def index():
+    addresses = [
+        ("Rua Augusta", str(number), "1100-053", "Lisboa", LISBON[0] + number * 1e-5, LISBON[1])
+        for number in range(2, 282, 2)
+    ]
+    addresses += [
+        ("Rua de Santa Catarina", "10", "4000-447", "Porto", *PORTO),
+        ("Rua de Santa Catarina", "12", "4000-447", "Porto", PORTO[0] + 1e-4, PORTO[1]),
+        ("Rua de Santa Catarina", "7", "1200-401", "Lisboa", *LISBON),
+        ("Avenida 24 de Julho", "2", "1200-480", "Lisboa", *LISBON),
+    ]
+    return AddressIndex.from_addresses(addresses)
+
+
+@pytest.mark.parametrize("address, expected", [
+    ("Rua Augusta 100, 1100-053 Lisboa", ("rua augusta", "100", "1100-053", "lisboa")),
+    ("R. Augusta, 100, 1100 Lisboa", ("rua augusta", "100", "1100", "lisboa")),
+    ("Rua Augusta 1100, Lisboa", ("rua augusta", "1100", "", "lisboa")),
+    ("Rua Augusta, 1100, Lisboa", ("rua augusta", "1100", "", "lisboa")),
+    ("Avenida 24 de Julho 100, Lisboa", ("avenida 24 julho", "100", "", "lisboa")),
+    ("Rua Augusta 12 A, 1100053", ("rua augusta", "12a", "1100-053", "")),
+])
+def test_parse_address(address, expected):
+    assert tuple(parse_address(address)) == expected
+
+
+def test_exact_house_number(index):
+    match = index.geocode("Rua Augusta 100, 1100-053 Lisboa")
+    assert match.confidence == 1.0
+    assert match.lat == pytest.approx(LISBON[0] + 100e-5)
+
+
+def test_postcode_of_another_place_is_not_trusted(index):
+    match = index.geocode("Rua Augusta 100, 4000-001 Porto")
+    assert match.confidence < ADDRESS_MIN_CONFIDENCE
+
+
+def test_locality_of_another_place_is_not_trusted(index):
+    assert index.geocode("Rua Augusta 100, Porto").confidence < ADDRESS_MIN_CONFIDENCE
+
+
+def test_locality_picks_between_streets_of_the_same_name(index):
+    match = index.geocode("Rua Santa Catarina 10, Porto")
+    assert (match.lat, match.lon) == PORTO
+    assert match.confidence == 1.0
+
+
+def test_postcode_picks_between_streets_of_the_same_name(index):
+    match = index.geocode("Rua Santa Catarina 7, 1200-401")
+    assert (match.lat, match.lon) == LISBON
+    assert match.confidence == 1.0
+
+
+def test_same_name_without_locality_or_postcode_is_ambiguous(index):
+    assert index.geocode("Rua Santa Catarina 10").confidence < ADDRESS_MIN_CONFIDENCE
+
+
+def test_close_missing_number_is_accepted(index):
+    match = index.geocode("Rua Augusta 101, Lisboa")
+    assert match.confidence >= ADDRESS_MIN_CONFIDENCE
+    assert match.display_name.startswith("100")
+
+
+def test_far_missing_number_is_not_trusted(index):
+    match = index.geocode("Rua Augusta 500, Lisboa")
+    assert match.display_name.startswith("280")
+    assert match.confidence < ADDRESS_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Av 24 de", "avenida 24"),
+    ("Av 24 de J", "avenida 24 j"),
+    ("Rua de Santa Cat", "rua santa cat"),
+    ("R. Áug", "rua aug"),
+    ("Av", "av"),
+])
+def test_normalize_prefix(text, expected):
+    assert normalize_prefix(text) == expected
+
+
+@pytest.mark.parametrize("text", ["Av 24", "Av 24 de", "Av 24 de Ju", "Av 24 de Julho"])
+def test_suggestions_last_while_typing(index, text):
+    assert index.suggest(text) == ["Avenida 24 de Julho, Lisboa"]
@@ -0,0 +1,20 @@
+import pytest
+
+from batch_analysis import read_addresses
+
+
+def write_csv(tmp_path, text):
+    path = tmp_path / "moradas.csv"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_line_numbers_without_id_column(tmp_path):
+    path = write_csv(tmp_path, 'address,notes\n"Rua Augusta 100, Lisboa",\n,vazia\n"Rua Augusta 100, Lisboa",\n')
+    assert list(read_addresses(path)) == [("1", "Rua Augusta 100, Lisboa"), ("3", "Rua Augusta 100, Lisboa")]
+
+
+def test_repeated_id_is_rejected(tmp_path):
+    path = write_csv(tmp_path, 'id,address\na1,"Rua Augusta 100, Lisboa"\na1,"Rua do Ouro 20, Lisboa"\n')
+    with pytest.raises(ValueError, match="'a1'"):
+        list(read_addresses(path))
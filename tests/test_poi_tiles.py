@@ -0,0 +1,88 @@
+import json
+
+import pytest
+import requests
+
+import poi_tiles
+from poi_tiles import OverpassError, PoiTileCache, iter_json_array
+
+ELEMENTS = [
+    {"type": "node", "lat": 38.71, "lon": -9.14, "tags": {"amenity": "cafe", "name": "Café Água"}},
+    {"type": "way", "center": {"lat": 38.72, "lon": -9.15}, "tags": {"amenity": "school", "name": "Escola [1]"}},
+]
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64, 100_000])
+def test_items_split_across_chunks(size):
+    body = json.dumps({"version": 0.6, "elements": ELEMENTS}, ensure_ascii=False).encode("utf-8")
+    assert list(iter_json_array(chunked(body, size))) == ELEMENTS
+
+
+def test_empty_array():
+    assert list(iter_json_array([b'{"elements": []}'])) == []
+
+
+def test_missing_key_raises():
+    with pytest.raises(requests.exceptions.RequestException):
+        list(iter_json_array(chunked(b"<html><body>Too many requests</body></html>", 8)))
+
+
+def test_cut_short_raises():
+    body = json.dumps({"elements": ELEMENTS}).encode("utf-8")
+    with pytest.raises(requests.exceptions.RequestException):
+        list(iter_json_array(chunked(body[:-30], 16)))
+
+
+def test_other_fields_are_read_after_the_array():
+    body = json.dumps({"version": 0.6, "elements": ELEMENTS, "remark": "runtime error: Query timed out"}).encode("utf-8")
+    other_fields = {}
+    assert list(iter_json_array(chunked(body, 5), other_fields=other_fields)) == ELEMENTS
+    assert other_fields == {"version": 0.6, "remark": "runtime error: Query timed out"}
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        return iter(chunked(self.body, chunk_size))
+
+    def close(self):
+        pass
+
+
+def answer_with(monkeypatch, document):
+    body = document if isinstance(document, bytes) else json.dumps(document).encode("utf-8")
+    monkeypatch.setattr(poi_tiles.http_client, "post", lambda *args, **kwargs: FakeResponse(body))
+
+
+@pytest.mark.parametrize("document", [
+    {"elements": ELEMENTS[:1], "remark": "runtime error: Query ran out of memory"},
+    b"<html>Gateway Timeout</html>",
+])
+def test_failed_answer_stores_no_tiles(monkeypatch, tmp_path, document):
+    answer_with(monkeypatch, document)
+    cache = PoiTileCache(str(tmp_path / "tiles.sqlite"))
+    with pytest.raises(requests.exceptions.RequestException):
+        cache.query(38.71, -9.14, 500)
+    assert cache.stats()["entries"] == 0
+
+
+def test_remark_raises_overpass_error(monkeypatch):
+    answer_with(monkeypatch, {"elements": [], "remark": "runtime error: Query timed out"})
+    with pytest.raises(OverpassError):
+        poi_tiles.fetch_overpass_pois("38.7,-9.2,38.8,-9.1")
+
+
+def test_complete_answer_is_stored(monkeypatch, tmp_path):
+    answer_with(monkeypatch, {"elements": ELEMENTS})
+    cache = PoiTileCache(str(tmp_path / "tiles.sqlite"))
+    assert cache.query(38.71, -9.14, 500).count == 1
+    assert cache.stats()["entries"] > 0
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from analysis_result import AnalysisResult
+from raw_inputs import RawInputWriter, load_raw_inputs, raw_input_parts, save_raw_inputs
+
+
+def record(path, address, score):
+    writer = RawInputWriter(path)
+    writer.versions = {"model_version": "m1", "population_version": "p1", "cirac_source": "grid", "poi_source": "index"}
+    writer.write(AnalysisResult(
+        address=address, message="", lat=38.71, lon=-9.14, municipality="Lisboa", population=545796,
+        cirac_level=3, poi_radius=500, poi_count=10, score=score, final_class="Médio",
+    ))
+    writer.close()
+
+
+def test_save_keeps_parts_written_meanwhile(tmp_path):
+    path = str(tmp_path / "raw.parquet")
+    record(path, "Rua Augusta 100, Lisboa", 0.5)
+    parts = raw_input_parts(path)
+    frame = load_raw_inputs(path, parts)
+
+    # A batch records another address while the re-score runs
+    record(path, "Rua do Ouro 20, Lisboa", 0.6)
+    frame["score"] = 0.9
+    save_raw_inputs(frame, parts, path)
+
+    stored = load_raw_inputs(path).set_index("address")["score"].to_dict()
+    assert stored == {"Rua Augusta 100, Lisboa": 0.9, "Rua do Ouro 20, Lisboa": 0.6}
+    assert len(raw_input_parts(path)) == 2
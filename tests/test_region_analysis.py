@@ -0,0 +1,19 @@
+import pytest
+
+import region_analysis
+from municipality_resolver import MunicipalityPolygon
+
+# A diamond about 200 m across, so no corner of its bounding box lies inside it
+DIAMOND = [[-9.140, 38.709], [-9.139, 38.710], [-9.140, 38.711], [-9.141, 38.710], [-9.140, 38.709]]
+
+
+class FakeResolver:
+    def polygons_of(self, name):
+        return [MunicipalityPolygon("Freguesia Pequena", "000000", [DIAMOND])]
+
+
+def test_no_cell_inside_the_polygon(monkeypatch):
+    monkeypatch.setattr(region_analysis, "get_municipality_resolver", lambda: FakeResolver())
+    monkeypatch.setattr(region_analysis, "get_population", lambda name: "1000")
+    with pytest.raises(ValueError, match="células mais pequenas"):
+        region_analysis.analyse_region("Freguesia Pequena", cell_meters=5000)
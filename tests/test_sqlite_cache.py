@@ -0,0 +1,17 @@
+from sqlite_cache import SqliteCache
+
+
+def test_empty_answers_are_not_cached():
+    cache = SqliteCache(":memory:", ttl_seconds=60, max_entries=10)
+    answers = iter([[], None, [{"lat": "38.71", "lon": "-9.14"}]])
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return next(answers)
+
+    assert cache.cached("search", "rua augusta", fetch) == []
+    assert cache.cached("search", "rua augusta", fetch) is None
+    assert cache.cached("search", "rua augusta", fetch) == [{"lat": "38.71", "lon": "-9.14"}]
+    assert cache.cached("search", "rua augusta", fetch) == [{"lat": "38.71", "lon": "-9.14"}]
+    assert len(calls) == 3